@@ -1 +1,6 @@
 """Reso auto main module."""
+
+import time
+
+# launch start for the --profile-startup report
+STARTED_AT = time.perf_counter()
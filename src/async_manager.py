@@ -0,0 +1,470 @@
+"""Pinned message manager on the async bot with one keep-alive connection pool."""
+
+import asyncio
+import time
+from contextlib import suppress
+from functools import wraps
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiHTTPException, ApiTelegramException, RequestTimeout
+
+from src.choiches import StorageFields
+from src.codec import JsonCodec, cookie_digest, decode, get_codec
+from src.exceptions import InvalidBotToken, TelegramError
+from src.handlers import count_retry, give_up, next_retry, not_modified
+from src.manager import MessageManager, PinnedCache, messages_by_hash, shard_chats
+from src.metrics import Instrumented, metrics
+from src.scheduler import AdaptivePoller
+from src.settings import (
+    BOT_TOKEN,
+    CACHE_TTL,
+    CHAT_ID,
+    RETRY_ATTEMPTS,
+    STORAGE_CODEC,
+    WATCH_INTERVAL,
+    WATCH_MAX_INTERVAL,
+)
+from src.storage import StorageBackend
+
+# the async helper turns network errors into RequestTimeout, non-json replies into ApiHTTPException
+NETWORK_ERRORS = (RequestTimeout, ApiHTTPException, asyncio.TimeoutError)
+
+
+def async_retry(fn: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """Retry decorator for coroutines with the same rules and counters as retry.
+
+    Args:
+        fn: coroutine function that will be wrapped.
+
+    Returns:
+        Decorator closure.
+    """
+
+    @wraps(fn)
+    async def inner(*args: Tuple, **kwargs: Dict) -> Optional[object]:
+        exception = None
+        count_retry(fn.__name__, 'calls')
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                return await fn(*args, **kwargs)
+            except NETWORK_ERRORS as e:
+                exception = e
+            except ApiTelegramException as e:
+                exception = e
+            delay = next_retry(fn.__name__, exception, attempt)
+            if delay is not None:
+                await asyncio.sleep(delay)
+        raise give_up(fn.__name__, isinstance(exception, NETWORK_ERRORS))
+    return inner
+
+
+class AsyncMessageManager(object):
+    """Hot path of MessageManager on AsyncTeleBot: cached reads, optimistic writes and change watching.
+
+    All requests go through the single aiohttp session of the async bot, so connections are kept alive and
+    reads of different chats are in flight at the same time. Concurrent reads of one chat share a request.
+    Accounts and shards are managed with the sync MessageManager.
+    """
+
+    message_sample = StorageBackend.message_sample
+
+    def __init__(self, cache_ttl: float = CACHE_TTL, codec: Optional[JsonCodec] = None) -> None:
+        """Async account manager initial method.
+
+        Args:
+            cache_ttl: seconds during which reads are served without requesting telegram.
+            codec: codec for writing pinned message, messages of any known codec are read.
+        """
+        self.bot = Instrumented(AsyncTeleBot(BOT_TOKEN), metrics, 'telegram_call_seconds')
+        self.chat = CHAT_ID
+        self.codec = codec or get_codec(STORAGE_CODEC)
+        self.cache_ttl = cache_ttl
+        self._cache: Dict[str, PinnedCache] = {}
+        # requests in flight and write locks by chat
+        self._reads: Dict[str, asyncio.Future] = {}
+        self._write_locks: Dict[str, asyncio.Lock] = {}
+        self._changed = asyncio.Event()
+        # notifications so far, the watcher polls quickly again after each of them
+        self._change_count = 0
+        self._watcher: Optional[asyncio.Task] = None
+
+    def invalidate_cache(self, chat: Optional[str] = None) -> None:
+        """Drop cached pinned message, next read will request telegram.
+
+        Args:
+            chat: chat id, all chats if not set.
+        """
+        if chat is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(str(chat), None)
+
+    async def _read_pinned(self, chat: Optional[str] = None, force: bool = False) -> Dict:
+        """Read pinned message content through the cache, joining a request of the same chat in flight.
+
+        Args:
+            chat: chat id, the main chat if not set.
+            force: request telegram even if the cache is still fresh.
+
+        Returns:
+            Pinned message content as dictionary.
+        """
+        chat = str(chat or self.chat)
+        cache = self._cache.get(chat)
+        if not force and cache and time.monotonic() - cache.fetched_at < self.cache_ttl:
+            metrics.inc('storage_reads_total', source='cache')
+            return cache.data
+        # forced reads must see writes made before them, so they do not join a request that may be older
+        if not force and chat in self._reads:
+            metrics.inc('storage_reads_total', source='shared')
+            return await asyncio.shield(self._reads[chat])
+        metrics.inc('storage_reads_total', source='telegram')
+        read = self._reads[chat] = asyncio.ensure_future(self._fetch_pinned(chat))
+        try:
+            return await asyncio.shield(read)
+        finally:
+            if self._reads.get(chat) is read:
+                del self._reads[chat]
+
+    async def _fetch_pinned(self, chat: str) -> Dict:
+        """Request pinned message and put it into the cache.
+
+        Args:
+            chat: chat id.
+
+        Returns:
+            Pinned message content as dictionary.
+        """
+        try:
+            pinned = (await self.bot.get_chat(chat)).pinned_message
+        except ApiTelegramException as error:
+            if error.error_code in {HTTPStatus.UNAUTHORIZED, HTTPStatus.NOT_FOUND}:
+                raise InvalidBotToken(InvalidBotToken.msg)
+            raise
+        if not pinned:
+            # new storage starts with message sample, new shard with empty message, like in the sync manager
+            text = self.codec.encode(self.message_sample if chat == str(self.chat) else {})
+            msg = await self.bot.send_message(chat_id=chat, text=text)
+            await self.bot.pin_chat_message(chat_id=chat, message_id=msg.message_id)
+            pinned = (await self.bot.get_chat(chat)).pinned_message
+        cache = self._cache.get(chat)
+        key = (pinned.message_id, pinned.edit_date)
+        if cache and cache.key == key and cache.text == pinned.text:
+            data = cache.data
+        else:
+            data = decode(pinned.text)
+            self.notify_change()
+        self._cache[chat] = PinnedCache(key=key, text=pinned.text, data=data, fetched_at=time.monotonic())
+        return data
+
+    async def _edit_pinned(self, chat: str, message_id: int, text: str) -> None:
+        """Write new text to pinned message and invalidate the cache.
+
+        Args:
+            chat: chat id.
+            message_id: pinned message id.
+            text: encoded message content.
+        """
+        self.invalidate_cache(chat)
+        try:
+            await self.bot.edit_message_text(chat_id=chat, message_id=message_id, text=text)
+        except ApiTelegramException as error:
+            # в сообщении уже то, что мы хотели записать
+            if not not_modified('_edit_pinned', error):
+                raise
+
+    _write_steps = MessageManager._write_steps
+    _normalize = MessageManager._normalize
+
+    async def _update(self, mutate: Callable[[Dict], None], chat: Optional[str] = None) -> None:
+        """Change pinned message with the steps of MessageManager._write_steps.
+
+        Writes of one chat from this process wait for each other, so they do not conflict among themselves.
+
+        Args:
+            mutate: function that changes message content in place.
+            chat: chat id, the main chat if not set.
+        """
+        chat = str(chat or self.chat)
+        async with self._write_locks.setdefault(chat, asyncio.Lock()):
+            steps = self._write_steps(mutate, await self._read_pinned(chat))
+            step = next(steps)
+            with suppress(StopIteration):
+                while True:
+                    if step is None:
+                        step = steps.send(await self._read_pinned(chat, force=True))
+                    else:
+                        await self._edit_pinned(chat, self._cache[chat].key[0], step)
+                        step = next(steps)
+
+    async def _messages_of(self, hashes: Iterable[str]) -> Dict[str, Dict]:
+        """Get contents of messages that store accounts, shards are read concurrently.
+
+        Args:
+            hashes: user identification hashes.
+
+        Returns:
+            Message content by hash.
+        """
+        hashes = list(hashes)
+        main = await self._read_pinned()
+        chats = shard_chats(hashes, main)
+        shards = dict(zip(chats, await asyncio.gather(*(self._read_pinned(chat) for chat in chats))))
+        return messages_by_hash(hashes, main, shards)
+
+    @async_retry
+    async def get_telegram_cookies(self, hsh: str) -> List:
+        """Get cookies by hash from pinned message or its shard.
+
+        Args:
+            hsh: user identification hash.
+
+        Returns:
+            Cookies list.
+        """
+        return (await self._messages_of([hsh]))[hsh][hsh]
+
+    @async_retry
+    async def get_moved_cookies(
+        self,
+        digests: Dict[str, Optional[str]],
+    ) -> Dict[str, Tuple[Optional[str], Optional[List]]]:
+        """Get current digests of accounts and cookies only of accounts whose digest has moved.
+
+        Args:
+            digests: digests known to the caller by hash, None for unknown.
+
+        Returns:
+            Dictionary with (digest, cookies or None if digest is the known one) by hash.
+        """
+        moved = {}
+        for hsh, message in (await self._messages_of(digests)).items():
+            digest = message.get(StorageFields.digests, {}).get(hsh) or cookie_digest(message[hsh])
+            moved[hsh] = (digest, message[hsh] if digest != digests[hsh] else None)
+        return moved
+
+    @async_retry
+    async def set_telegram_cookies(self, cookies: List, hsh: str) -> None:
+        """Set new cookies to pinned message by hash.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash.
+        """
+        main = await self._read_pinned()
+        chat = main.get(StorageFields.index, {}).get(hsh, self.chat)
+        await self._update(lambda as_json: as_json.update({hsh: cookies}), chat)
+
+    @async_retry
+    async def refresh(self) -> None:
+        """Request main and already read shard messages whose cache has expired concurrently."""
+        await asyncio.gather(*(self._read_pinned(chat) for chat in {str(self.chat), *list(self._cache)}))
+
+    def notify_change(self) -> None:
+        """Wake up everybody who waits for a change."""
+        self._change_count += 1
+        self._changed.set()
+
+    async def wait_for_change(self, timeout: float) -> bool:
+        """Wait until storage is changed by anybody or timeout is over.
+
+        Args:
+            timeout: seconds to wait.
+
+        Returns:
+            True if storage has changed.
+        """
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._changed.clear()
+        return True
+
+    def watch(self, interval: float = WATCH_INTERVAL) -> None:
+        """Start watcher task in the running loop, one per manager.
+
+        Args:
+            interval: seconds between storage checks right after a change, they grow while nothing changes.
+        """
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.ensure_future(self._watch_loop(interval))
+
+    async def _watch_loop(self, interval: float) -> None:
+        """Watcher task body, checks are made less often while nothing changes and after failed ones.
+
+        Args:
+            interval: seconds between storage checks right after a change.
+        """
+        poller = AdaptivePoller(interval, max(interval, WATCH_MAX_INTERVAL))
+        while True:
+            seen = self._change_count
+            try:
+                await self.refresh()
+            except (TelegramError, ApiTelegramException):
+                # sync loop will face the same error on its own read, other errors are bugs and end the task
+                metrics.inc('storage_watch_errors_total')
+            if self._change_count != seen:
+                poller.reset()
+            await asyncio.sleep(poller.next_interval())
+
+    async def close(self) -> None:
+        """Stop watcher and close the connection pool."""
+        if self._watcher is not None:
+            self._watcher.cancel()
+        await self.bot.close_session()
+
+
+class LoopStorage(StorageBackend):
+    """Sync storage for sessions running in threads, calls are made on the loop of an AsyncMessageManager.
+
+    Accounts and leases are managed with the sync MessageManager, it is created on the first such call.
+    """
+
+    def __init__(self, manager: AsyncMessageManager, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """Bind to async manager.
+
+        Args:
+            manager: async manager.
+            loop: running loop of the manager, may be set later.
+        """
+        super().__init__()
+        self.async_manager = manager
+        self.loop = loop
+        self._manager: Optional[MessageManager] = None
+
+    def _call(self, coroutine: Awaitable) -> object:
+        """Run coroutine on the loop of the manager and wait for its result in this thread.
+
+        Args:
+            coroutine: coroutine of the async manager.
+
+        Returns:
+            Coroutine result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    @property
+    def manager(self) -> MessageManager:
+        """Sync manager for accounts and leases with the cache settings of the async one.
+
+        Returns:
+            MessageManager instance.
+        """
+        if self._manager is None:
+            self._manager = MessageManager(self.async_manager.cache_ttl, self.async_manager.codec)
+        return self._manager
+
+    def get_telegram_cookies(self, hsh: str) -> List:
+        """Get cookies by hash on the loop.
+
+        Args:
+            hsh: user identification hash.
+
+        Returns:
+            Cookies list.
+        """
+        return self._call(self.async_manager.get_telegram_cookies(hsh))
+
+    def get_moved_cookies(self, digests: Dict[str, Optional[str]]) -> Dict[str, Tuple[Optional[str], Optional[List]]]:
+        """Get current digests of accounts and cookies of moved ones on the loop.
+
+        Args:
+            digests: digests known to the caller by hash, None for unknown.
+
+        Returns:
+            Dictionary with (digest, cookies or None if digest is the known one) by hash.
+        """
+        return self._call(self.async_manager.get_moved_cookies(digests))
+
+    def set_telegram_cookies(self, cookies: List, hsh: str) -> None:
+        """Set cookies by hash on the loop.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash.
+        """
+        self._call(self.async_manager.set_telegram_cookies(cookies, hsh))
+
+    def refresh(self) -> None:
+        """Check storage for changes on the loop."""
+        self._call(self.async_manager.refresh())
+
+    def notify_change(self) -> None:
+        """Wake up waiters of the async manager, the runner waits for changes there."""
+        if self.loop is None:
+            self.async_manager.notify_change()
+        else:
+            # событие asyncio можно трогать только из потока цикла
+            self.loop.call_soon_threadsafe(self.async_manager.notify_change)
+
+    def wait_for_change(self, timeout: float) -> bool:
+        """Wait for a change on the event of the async manager.
+
+        Args:
+            timeout: seconds to wait.
+
+        Returns:
+            True if storage has changed.
+        """
+        return self._call(self.async_manager.wait_for_change(timeout))
+
+    def watch(self, interval: float = WATCH_INTERVAL) -> None:
+        """Start watcher task of the async manager.
+
+        Args:
+            interval: seconds between storage checks.
+        """
+        self.loop.call_soon_threadsafe(self.async_manager.watch, interval)
+
+    def add_account(self, hsh: str) -> None:
+        """Add new account with the sync manager.
+
+        Args:
+            hsh: user identification hash.
+        """
+        self.manager.add_account(hsh)
+
+    def remove_account(self, hsh: str) -> None:
+        """Remove account with the sync manager.
+
+        Args:
+            hsh: user identification hash.
+        """
+        self.manager.remove_account(hsh)
+
+    def get_accounts(self) -> List[str]:
+        """Get account hashes with the sync manager.
+
+        Returns:
+            List with account hashes.
+        """
+        return self.manager.get_accounts()
+
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew lease with the sync manager.
+
+        Args:
+            name: lease name, like account hash.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if holder has the lease.
+        """
+        return self.manager.acquire_lease(name, holder, ttl)
+
+    def release_lease(self, name: str, holder: str) -> None:
+        """Give lease back with the sync manager.
+
+        Args:
+            name: lease name.
+            holder: unique id of the client.
+        """
+        self.manager.release_lease(name, holder)
+
+    def reinit(self) -> None:
+        """Reset pinned message with the sync manager."""
+        self.manager.reinit()
@@ -0,0 +1,106 @@
+"""Run several account sessions in one process with telegram I/O on an asyncio loop."""
+
+import asyncio
+from collections import defaultdict
+from http.client import RemoteDisconnected
+from typing import Dict, List, Mapping, Optional
+
+from selenium.common.exceptions import InvalidSessionIdException
+
+from src.async_manager import AsyncMessageManager, LoopStorage
+from src.main import BrowserMeta, ResoSession
+from src.metrics import metrics, runtime_profiler, serve
+from src.runner import SessionRunner
+from src.settings import METRICS_PORT
+
+
+class AsyncSessionRunner(SessionRunner):
+    """SessionRunner whose storage reads and writes are awaited while browsers are probed.
+
+    Browser work of every account runs in its own worker thread, sessions of one account go one after another
+    as in SessionRunner. Their storage calls are made on the loop, so writes of one account and reads of the
+    next tick are in flight together with probes of other accounts.
+    """
+
+    def __init__(self, sessions_options: List[Mapping], manager: Optional[AsyncMessageManager] = None) -> None:
+        """Create session classes.
+
+        Args:
+            sessions_options: options of every session.
+            manager: async storage shared between sessions.
+        """
+        self.async_manager = manager or AsyncMessageManager()
+        super().__init__(sessions_options, LoopStorage(self.async_manager))
+
+    async def tick_async(self) -> None:
+        """Read storage once and sync sessions of different accounts concurrently."""
+        moved = await self.async_manager.get_moved_cookies({
+            session.hash: self.digests.get(session.hash) for session in self.sessions
+        })
+        for hsh, (digest, fresh) in moved.items():
+            if fresh is not None:
+                self.digests[hsh], self.cookies[hsh] = digest, fresh
+        accounts: Dict[str, List[ResoSession]] = defaultdict(list)
+        for session in self.sessions:
+            accounts[session.hash].append(session)
+        closed = await asyncio.gather(*(
+            asyncio.to_thread(self._tick_account, sessions, self.cookies[hsh]) for hsh, sessions in accounts.items()
+        ))
+        # sessions list is changed only in the loop thread
+        for session in (session for sessions in closed for session in sessions):
+            self.close(session)
+            await asyncio.to_thread(self.recover, session)
+
+    def _tick_account(self, sessions: List[ResoSession], cookies: List) -> List[ResoSession]:
+        """Sync sessions of one account, worker thread body.
+
+        Args:
+            sessions: sessions of the account.
+            cookies: storage cookies of the account.
+
+        Returns:
+            Sessions whose browsers were closed.
+        """
+        closed = []
+        for session in sessions:
+            try:
+                if session.tick(cookies):
+                    # next sessions of the same account must not roll back just published cookies
+                    cookies = session.last_cookies
+            except (InvalidSessionIdException, RemoteDisconnected):
+                closed.append(session)
+        return closed
+
+    async def run_async(self) -> None:
+        """Run sessions until all browsers are closed."""
+        self.manager.loop = asyncio.get_running_loop()
+        try:
+            await asyncio.to_thread(self.start)
+            self.async_manager.watch()
+            while self.sessions:
+                runtime_profiler.step()
+                with metrics.timer('runner_tick_seconds'):
+                    await self.tick_async()
+                timeout = min(session.poller.next_interval() for session in self.sessions) if self.sessions else 0
+                if await self.async_manager.wait_for_change(timeout=timeout):
+                    for session in self.sessions:
+                        session.poller.reset()
+                for pool in self.pools.values():
+                    await asyncio.to_thread(pool.maintain)
+        finally:
+            for session in list(self.sessions):
+                await asyncio.to_thread(self.close, session)
+            for pool in self.pools.values():
+                await asyncio.to_thread(pool.close)
+            await self.async_manager.close()
+
+    def run(self) -> None:
+        """Run sessions on a new event loop."""
+        asyncio.run(self.run_async())
+
+
+if __name__ == '__main__':
+    if METRICS_PORT:
+        serve(METRICS_PORT)
+    runner = AsyncSessionRunner(sessions_options=BrowserMeta.get_sessions_options())
+    runner.run()
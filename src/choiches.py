@@ -7,6 +7,22 @@ class CookieFields:
     aspnet = 'ASP.NET_SessionId'
     reso_office60 = 'ResoOffice60'
 
+
+class StorageFields:
+    """Service keys of the shared storage, they are not account hashes."""
+
+    revision = '__rev__'
+    # shard chat ids registered in the main message
+    shards = '__shards__'
+    # account hash to shard chat id, accounts without entry are stored in the main message
+    index = '__index__'
+    # account hash to digest of its cookie names and values
+    digests = '__digests__'
+    # lease name to [holder id, unix time when it ends]
+    leases = '__leases__'
+
+    service = frozenset({revision, shards, index, digests, leases})
+
 class Systems:
 
     windows = 'windows'
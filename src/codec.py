@@ -0,0 +1,210 @@
+"""Storage codecs for the pinned message text."""
+
+import base64
+import hashlib
+import json
+import zlib
+from typing import Dict, List, Optional
+
+from src.choiches import CookieFields, StorageFields
+
+# cookie fields accepted by WebDriver.add_cookie, others are not stored
+COOKIE_KEYS = {
+    'name': 'n',
+    'value': 'v',
+    'path': 'p',
+    'domain': 'd',
+    'secure': 's',
+    'httpOnly': 'h',
+    'sameSite': 'ss',
+    'expiry': 'e',
+}
+# values that are not stored in the compact format, because reso sets them this way
+COOKIE_DEFAULTS = {
+    'path': '/',
+    'domain': '.reso.ru',
+    'secure': False,
+    'httpOnly': True,
+    'sameSite': 'None',
+}
+COOKIE_NAMES = {
+    CookieFields.aspnet: 'a',
+    CookieFields.reso_office60: 'o',
+}
+
+
+def cookie_digest(cookies: Optional[List]) -> Optional[str]:
+    """Short digest of cookie names and values, other fields like expiry and field order are ignored.
+
+    Args:
+        cookies: list with selenium cookie dictionaries.
+
+    Returns:
+        Hex digest or None if there are no cookies.
+    """
+    if not cookies:
+        return None
+    pairs = sorted((cookie['name'], cookie['value']) for cookie in cookies if cookie)
+    return hashlib.blake2b(json.dumps(pairs).encode(), digest_size=8).hexdigest()
+
+
+def stamp_digests(as_json: Dict) -> None:
+    """Put digests of every account of the storage content next to the cookies.
+
+    Args:
+        as_json: storage content.
+    """
+    digests = {hsh: cookie_digest(cookies) for hsh, cookies in as_json.items() if hsh not in StorageFields.service}
+    if digests:
+        as_json[StorageFields.digests] = digests
+    else:
+        as_json.pop(StorageFields.digests, None)
+
+
+class JsonCodec(object):
+    """Plain json codec, the original pinned message format."""
+
+    prefix = ''
+
+    def encode(self, as_json: Dict) -> str:
+        """Encode storage content to message text.
+
+        Args:
+            as_json: storage content.
+
+        Returns:
+            Message text.
+        """
+        return json.dumps(as_json)
+
+    def decode(self, text: str) -> Dict:
+        """Decode message text to storage content.
+
+        Args:
+            text: message text.
+
+        Returns:
+            Storage content.
+        """
+        return json.loads(text)
+
+
+class CompactCodec(JsonCodec):
+    """Codec that keeps only cookie fields needed for insertion under short keys and compresses them.
+
+    Digests are not written, they are computed again on decoding, so they cost no message space.
+    """
+
+    prefix = 'z1:'
+
+    def encode(self, as_json: Dict) -> str:
+        """Encode storage content to compressed message text.
+
+        Args:
+            as_json: storage content.
+
+        Returns:
+            Message text.
+        """
+        packed = {
+            key: value if key in StorageFields.service else [self.pack_cookie(cookie) for cookie in value]
+            for key, value in as_json.items()
+            if key != StorageFields.digests
+        }
+        raw = json.dumps(packed, separators=(',', ':')).encode()
+        return self.prefix + base64.b85encode(zlib.compress(raw, 9)).decode()
+
+    def decode(self, text: str) -> Dict:
+        """Decode compressed message text to storage content.
+
+        Args:
+            text: message text.
+
+        Returns:
+            Storage content.
+        """
+        packed = json.loads(zlib.decompress(base64.b85decode(text[len(self.prefix):])))
+        as_json = {
+            key: value if key in StorageFields.service else [self.unpack_cookie(cookie) for cookie in value]
+            for key, value in packed.items()
+        }
+        stamp_digests(as_json)
+        return as_json
+
+    @staticmethod
+    def pack_cookie(cookie: Dict) -> Dict:
+        """Pack selenium cookie dictionary.
+
+        Args:
+            cookie: selenium cookie dictionary.
+
+        Returns:
+            Dictionary with short keys and without default values.
+        """
+        packed: Dict = {}
+        for field, short in COOKIE_KEYS.items():
+            if field not in cookie:
+                if field in COOKIE_DEFAULTS:
+                    # absent field must stay absent after decoding
+                    packed[short] = None
+                continue
+            value = cookie[field]
+            if field == 'name':
+                packed[short] = COOKIE_NAMES.get(value, value)
+            elif COOKIE_DEFAULTS.get(field, packed) != value:
+                packed[short] = value
+        return packed
+
+    @staticmethod
+    def unpack_cookie(packed: Dict) -> Dict:
+        """Unpack cookie packed by pack_cookie.
+
+        Args:
+            packed: dictionary with short keys.
+
+        Returns:
+            Selenium cookie dictionary.
+        """
+        names = {short: name for name, short in COOKIE_NAMES.items()}
+        cookie = {}
+        for field, short in COOKIE_KEYS.items():
+            value = packed.get(short, COOKIE_DEFAULTS.get(field))
+            if field == 'name':
+                value = names.get(value, value)
+            if value is not None:
+                cookie[field] = value
+        return cookie
+
+
+CODECS = {
+    'json': JsonCodec,
+    'compact': CompactCodec,
+}
+
+
+def get_codec(name: str) -> JsonCodec:
+    """Create codec by its name.
+
+    Args:
+        name: codec name, key of CODECS.
+
+    Returns:
+        Codec instance.
+    """
+    return CODECS[name]()
+
+
+def decode(text: str, codecs: Optional[List[JsonCodec]] = None) -> Dict:
+    """Decode message text written by any known codec.
+
+    Args:
+        text: message text.
+        codecs: codecs to detect, all known codecs by default.
+
+    Returns:
+        Storage content.
+    """
+    for codec in codecs or [klass() for klass in CODECS.values()]:
+        if codec.prefix and text.startswith(codec.prefix):
+            return codec.decode(text)
+    return JsonCodec().decode(text)
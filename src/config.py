@@ -0,0 +1,172 @@
+"""Options of reso.ini and the storage they choose, importing it does not read the file."""
+
+from configparser import ConfigParser, SectionProxy
+from typing import Dict, List, Mapping
+
+from src.exceptions import InvalidIniFieldError, InvalidIniValueError, NoIniFileError, NoIniOptionsError
+from src.hub import HubStorage
+from src.manager import MessageManager
+from src.offline import CachedStorage
+from src.settings import HUB_PORT, INI_PATH
+from src.storage import SQLiteStorage, StorageBackend
+
+
+class IniOptions(object):
+    """Reading and checking of reso.ini fields, shared by the browser metaclass and the console."""
+
+    ini_fields = frozenset({
+        'hash', 'browser', 'user-agent', 'proxy-server', 'storage', 'storage-path', 'http-probe', 'probe-marker',
+        'poll-min', 'poll-max', 'pool-size', 'pool-idle-timeout', 'local-cache', 'keepalive', 'keepalive-idle',
+        'keepalive-margin', 'cookie-events', 'write-lease', 'lease-ttl', 'write-delay', 'lite-mode', 'memory-limit',
+        'hub-url', 'batched-probe',
+    })
+
+    @classmethod
+    def get_flag(cls, options: Mapping, field: str, default: str) -> bool:
+        """Get yes/no field from ini options.
+
+        Args:
+            options: ini options.
+            field: field name.
+            default: "yes" or "no" if field is absent.
+
+        Returns:
+            True for yes.
+        """
+        value = options.get(field, default).lower()
+        if value not in {'yes', 'no'}:
+            raise InvalidIniValueError(InvalidIniValueError.msg.format(field=field, value=value))
+        return value == 'yes'
+
+    @classmethod
+    def get_count(cls, options: Mapping, field: str, default: int) -> int:
+        """Get non-negative integer from ini options.
+
+        Args:
+            options: ini options.
+            field: field name.
+            default: value if field is absent.
+
+        Returns:
+            Field value.
+        """
+        value = options.get(field, str(default))
+        if not value.isdigit():
+            raise InvalidIniValueError(InvalidIniValueError.msg.format(field=field, value=value))
+        return int(value)
+
+    @classmethod
+    def get_float(cls, options: Mapping, field: str, default: float, zero: bool = False) -> float:
+        """Get positive number from ini options.
+
+        Args:
+            options: ini options.
+            field: field name.
+            default: value if field is absent.
+            zero: whether 0 is allowed, it turns the feature off.
+
+        Returns:
+            Field value.
+        """
+        value = options.get(field, str(default))
+        try:
+            number = float(value)
+        except ValueError:
+            number = -1
+        if number < 0 or (number == 0 and not zero):
+            raise InvalidIniValueError(InvalidIniValueError.msg.format(field=field, value=value))
+        return number
+
+    @classmethod
+    def get_storage(cls, options: SectionProxy) -> StorageBackend:
+        """Create shared storage chosen in ini options.
+
+        Args:
+            options: ini options.
+
+        Returns:
+            Telegram pinned message manager, local SQLite storage or sync hub, wrapped in the local cookie cache.
+        """
+        remote = cls.get_remote_storage(options)
+        return CachedStorage(remote) if cls.get_flag(options, 'local-cache', 'yes') else remote
+
+    @classmethod
+    def get_remote_storage(cls, options: Mapping) -> StorageBackend:
+        """Create shared storage chosen in ini options without the local cookie cache.
+
+        Args:
+            options: ini options.
+
+        Returns:
+            Telegram pinned message manager, local SQLite storage or sync hub.
+        """
+        storage = options.get('storage', 'telegram')
+        if storage == 'telegram':
+            remote: StorageBackend = MessageManager(write_delay=cls.get_float(options, 'write-delay', 1, zero=True))
+        elif storage == 'sqlite':
+            remote = SQLiteStorage(options.get('storage-path', 'cookies.sqlite3'))
+        elif storage == 'hub':
+            remote = HubStorage(options.get('hub-url', 'http://127.0.0.1:{port}'.format(port=HUB_PORT)))
+        else:
+            raise InvalidIniValueError(InvalidIniValueError.msg.format(field='storage', value=storage))
+        return remote
+
+    @classmethod
+    def get_ini_options(cls) -> SectionProxy:
+        """Get and check that ini options is correct.
+
+        Returns:
+            SectionProxy instance (like dict) with hash, user-agent and browser fields.
+        """
+        ini_options = cls.read_ini()
+        try:
+            options = ini_options['options']
+        except KeyError:
+            raise NoIniOptionsError(NoIniFileError.msg)
+        cls.check_options(options)
+        return options
+
+    @classmethod
+    def get_sessions_options(cls) -> List[Dict[str, str]]:
+        """Get options of every session from [session ...] sections of ini file.
+
+        Fields missed in a session section are taken from [options] section.
+
+        Returns:
+            List with session options, only [options] section if there are no session sections.
+        """
+        ini_options = cls.read_ini()
+        options = cls.get_ini_options()
+        sessions = []
+        for section in ini_options.sections():
+            if section.startswith('session'):
+                cls.check_options(ini_options[section])
+                sessions.append({**options, **ini_options[section]})
+        return sessions or [dict(options)]
+
+    @classmethod
+    def read_ini(cls) -> ConfigParser:
+        """Read ini file.
+
+        Returns:
+            ConfigParser instance with file content.
+        """
+        ini_options = ConfigParser()
+        ini_content = ini_options.read(filenames=INI_PATH, encoding='UTF-8')
+        # нет файла
+        if not ini_content:
+            raise NoIniFileError(NoIniFileError.msg)
+        return ini_options
+
+    @classmethod
+    def check_options(cls, options: SectionProxy) -> None:
+        """Check that ini section fields and values are correct.
+
+        Args:
+            options: ini section.
+        """
+        for field, field_content in options.items():
+            if field not in cls.ini_fields:
+                raise InvalidIniFieldError(InvalidIniFieldError.msg.format(field=field))
+            if not options.get(field):
+                raise InvalidIniValueError(InvalidIniValueError.msg.format(field=field, value=field_content))
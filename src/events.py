@@ -0,0 +1,129 @@
+"""Office cookie change events from the browser over WebDriver BiDi."""
+
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.bidi.common import command_builder
+from selenium.webdriver.common.bidi.network import NetworkEvent
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from src.choiches import CookieFields
+from src.metrics import metrics
+
+RESPONSE_COMPLETED = 'network.responseCompleted'
+# the browser is probed anyway after this many seconds without events, in case one was missed
+FULL_CHECK_INTERVAL = 30
+
+
+class CookieEvents(object):
+    """Tells the sync loop when the browser has to be probed.
+
+    Firefox, Chrome and Edge report completed responses over WebDriver BiDi, chromium drivers translate them
+    from CDP. Only page navigations and Set-Cookie headers of watched cookies from office hosts count.
+    Without BiDi every check says yes, so the loop polls as before.
+    """
+
+    def __init__(
+        self,
+        host: str = 'reso.ru',
+        names: Iterable[str] = (CookieFields.aspnet, CookieFields.reso_office60),
+        full_check: float = FULL_CHECK_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+        on_change: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Create events that have not been attached to a browser.
+
+        Args:
+            host: office domain, its subdomains count too.
+            names: watched cookie names.
+            full_check: seconds after which the browser is probed without events.
+            clock: monotonic clock.
+            on_change: called on every event, so the sync loop does not sleep through it.
+        """
+        self.host = host
+        self.on_change = on_change
+        self.names = frozenset(names)
+        self.full_check = full_check
+        self.clock = clock
+        self.active = False
+        self.last_check = 0.0
+        self._event = threading.Event()
+        # the first check always probes
+        self._event.set()
+
+    def attach(self, driver: WebDriver) -> bool:
+        """Subscribe to responses of the browser, session must be created with BiDi enabled.
+
+        Args:
+            driver: browser.
+
+        Returns:
+            True if events are received, False if the browser has no BiDi and polling stays.
+        """
+        try:
+            conn = driver.network.conn
+            conn.execute(command_builder('session.subscribe', {'events': [RESPONSE_COMPLETED]}))
+            conn.add_callback(NetworkEvent(RESPONSE_COMPLETED), self.on_response)
+        except WebDriverException:
+            metrics.inc('cookie_events_unavailable_total')
+            self.active = False
+            return False
+        self.active = True
+        return True
+
+    def on_response(self, event: NetworkEvent) -> None:
+        """Handle completed response, called by websocket threads.
+
+        Args:
+            event: BiDi event with request and response.
+        """
+        params = event.params
+        response = params.get('response') or {}
+        url = response.get('url') or (params.get('request') or {}).get('url', '')
+        hostname = urlparse(url).hostname or ''
+        if hostname != self.host and not hostname.endswith('.' + self.host):
+            return
+        if params.get('navigation') or self.touches(response.get('headers') or []):
+            metrics.inc('cookie_events_total')
+            self._event.set()
+            if self.on_change:
+                self.on_change()
+
+    def touches(self, headers: List[Dict]) -> bool:
+        """Check that response sets one of watched cookies.
+
+        Args:
+            headers: BiDi headers, values are {"type": "string", "value": ...} or plain strings.
+
+        Returns:
+            True if a Set-Cookie header names a watched cookie.
+        """
+        for header in headers:
+            if header.get('name', '').lower() != 'set-cookie':
+                continue
+            value = header.get('value')
+            if isinstance(value, dict):
+                value = value.get('value', '')
+            # several cookies may be joined in one header value
+            for line in (value or '').split('\n'):
+                if line.split('=', 1)[0].strip() in self.names:
+                    return True
+        return False
+
+    def changed(self) -> bool:
+        """Check that browser must be probed: after an event, after full_check seconds or always without BiDi.
+
+        Returns:
+            True if browser must be probed.
+        """
+        if not self.active:
+            return True
+        now = self.clock()
+        if self._event.is_set() or now - self.last_check >= self.full_check:
+            self._event.clear()
+            self.last_check = now
+            return True
+        return False
@@ -12,6 +12,12 @@ class IniFileError(ResoException):
 class BrowserNotInstalled(ResoException):
     pass
 
+class LocalStorageError(ResoException):
+    msg = 'Ошибка локального хранилища {path}: {error}'
+
+class AccountsFileError(ResoException):
+    msg = 'Не удалось прочитать файл аккаунтов {path}: {error}'
+
 class BrowserNotFoundError(IniFileError):
     pass
 
@@ -34,4 +40,16 @@ class InvalidHash(TelegramError):
     msg = 'Невалидный хэш "{hash}" в reso.ini, такой хэш отсутствует на сервере.'
 
 class MessageTooLong(TelegramError):
-    msg = f'При добавлении нового аккаунта будет превышен лимит {TELEGRAM_MSG_LIMIT} байт (символов). Такое количество аккаунтов создать не получится'
+    msg = (
+        f'При добавлении нового аккаунта будет превышен лимит {TELEGRAM_MSG_LIMIT} байт (символов). '
+        'Такое количество аккаунтов создать не получится, добавьте новый шард'
+    )
+
+class TelegramUnavailable(TelegramError):
+    pass
+
+class HubError(TelegramError):
+    msg = 'Хаб {url} отклонил запрос: {error}'
+
+class WriteConflict(TelegramError):
+    msg = 'Не удалось записать изменения: закрепленное сообщение одновременно изменяют другие клиенты'
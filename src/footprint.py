@@ -0,0 +1,147 @@
+"""Memory and CPU used by browsers of sessions, exported with the other metrics."""
+
+import os
+import weakref
+from contextlib import suppress
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from src.metrics import metrics
+
+try:
+    import psutil
+except ImportError:
+    # optional, without it usage is read from /proc on Linux
+    psutil = None
+
+PROC = '/proc'
+
+
+class ResourceUsage(NamedTuple):
+    """Usage of a process with its children."""
+
+    # resident memory in bytes, memory shared between the processes is counted in each of them
+    rss: int
+    # user and system CPU seconds
+    cpu: float
+    processes: int
+
+
+# sessions whose browsers are reported, closed ones disappear by themselves
+_sessions: 'weakref.WeakSet' = weakref.WeakSet()
+
+
+def process_tree_usage(pid: int) -> Optional[ResourceUsage]:
+    """Sum usage of a process and all its children.
+
+    Args:
+        pid: root process id, like the webdriver process that has started the browser.
+
+    Returns:
+        ResourceUsage or None if neither psutil nor /proc is available or the process has ended.
+    """
+    if psutil is None:
+        return proc_tree_usage(pid) if os.path.isdir(PROC) else None
+    try:
+        root = psutil.Process(pid)
+        processes = [root] + root.children(recursive=True)
+    except psutil.Error:
+        return None
+    rss, cpu, count = 0, 0.0, 0
+    for process in processes:
+        # a child may end between listing and reading it
+        with suppress(psutil.Error):
+            memory, times = process.memory_info(), process.cpu_times()
+            rss += memory.rss
+            cpu += times.user + times.system
+            count += 1
+    return ResourceUsage(rss=rss, cpu=cpu, processes=count)
+
+
+def read_proc_stat(pid: str) -> Optional[List[str]]:
+    """Read fields of /proc/<pid>/stat that follow the process name.
+
+    Args:
+        pid: process id.
+
+    Returns:
+        Fields from the process state on, None if the process has ended.
+    """
+    try:
+        with open(os.path.join(PROC, pid, 'stat')) as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # имя процесса в скобках может содержать пробелы и скобки
+    return stat[stat.rindex(')') + 2:].split()
+
+
+def proc_tree_usage(pid: int) -> Optional[ResourceUsage]:
+    """Sum usage of a process and all its children from /proc, used when psutil is not installed.
+
+    Args:
+        pid: root process id.
+
+    Returns:
+        ResourceUsage or None if the process has ended.
+    """
+    stats = {}
+    for name in os.listdir(PROC):
+        stat = read_proc_stat(name) if name.isdigit() else None
+        if stat:
+            stats[int(name)] = stat
+    if pid not in stats:
+        return None
+    children: Dict[int, List[int]] = {}
+    for child, stat in stats.items():
+        children.setdefault(int(stat[1]), []).append(child)
+    tree, queue = [], [pid]
+    while queue:
+        current = queue.pop()
+        tree.append(current)
+        queue.extend(children.get(current, []))
+    # rss is in pages, utime and stime in clock ticks
+    rss = sum(int(stats[process][21]) for process in tree) * os.sysconf('SC_PAGE_SIZE')
+    cpu = sum(int(stats[process][11]) + int(stats[process][12]) for process in tree) / os.sysconf('SC_CLK_TCK')
+    return ResourceUsage(rss=rss, cpu=cpu, processes=len(tree))
+
+
+def track(session: object) -> None:
+    """Report browser usage of the session until it is closed.
+
+    Args:
+        session: webdriver with service and hash attributes.
+    """
+    _sessions.add(session)
+
+
+def session_pid(session: object) -> Optional[int]:
+    """Get id of the webdriver process, the browser is its child.
+
+    Args:
+        session: webdriver.
+
+    Returns:
+        Process id or None if the driver was not started by us.
+    """
+    process = getattr(getattr(session, 'service', None), 'process', None)
+    return getattr(process, 'pid', None)
+
+
+@metrics.collector
+def collect_browser_usage() -> List[Tuple[str, Dict[str, str], float]]:
+    """Export memory and CPU of browsers by session.
+
+    Returns:
+        Counters as (name, labels, value).
+    """
+    samples = []
+    for session in list(_sessions):
+        pid = session_pid(session)
+        usage = process_tree_usage(pid) if pid else None
+        if usage is None:
+            continue
+        labels = {'hash': str(getattr(session, 'hash', '')), 'pid': str(pid)}
+        samples.append(('browser_rss_bytes', labels, usage.rss))
+        samples.append(('browser_cpu_seconds', labels, usage.cpu))
+        samples.append(('browser_processes', labels, usage.processes))
+    return samples
@@ -2,15 +2,21 @@
 
 import ctypes
 import platform
+import random
 import subprocess
 import sys
+import threading
 import time
+from collections import Counter
+from functools import wraps
+from http import HTTPStatus
 from http.client import RemoteDisconnected
 # for pyinstaller
 from sys import exit
 from typing import Any, Callable, Dict, Optional, Tuple
 
 from requests import ConnectionError as ConnectionErrorRequests
+from requests import Timeout
 from selenium.common.exceptions import (
     InvalidCookieDomainException, InvalidSessionIdException, NoSuchWindowException, UnexpectedAlertPresentException,
     WebDriverException
@@ -20,12 +26,131 @@ from telebot.apihelper import ApiTelegramException
 from urllib3.exceptions import MaxRetryError
 
 from src.choiches import Systems
-from src.exceptions import TelegramError
+from src.exceptions import TelegramUnavailable
+from src.settings import RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+
+
+# retry counters for monitoring, keys are "<counter>" and "<counter>:<function name>"
+retry_stats: Counter = Counter()
+_retry_stats_lock = threading.Lock()
+
+
+def count_retry(name: str, counter: str, amount: float = 1) -> None:
+    """Increase retry counter in total and for the function.
+
+    Args:
+        name: wrapped function name.
+        counter: counter name.
+        amount: value to add.
+    """
+    with _retry_stats_lock:
+        retry_stats[counter] += amount
+        retry_stats['{counter}:{name}'.format(counter=counter, name=name)] += amount
+
+
+def retry_snapshot() -> Dict[str, float]:
+    """Get consistent copy of retry counters.
+
+    Returns:
+        Dictionary with counters.
+    """
+    with _retry_stats_lock:
+        return dict(retry_stats)
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """Classify error and get delay before the next attempt.
+
+    Errors of the sync and the async bot are told apart by their error_code, so both share the rules.
+
+    Args:
+        error: raised exception.
+        attempt: number of failed attempt, starting from 0.
+
+    Returns:
+        Seconds to wait or None, if error is permanent and must not be retried.
+    """
+    error_code = getattr(error, 'error_code', None)
+    if isinstance(error_code, int):
+        if error_code == HTTPStatus.TOO_MANY_REQUESTS:
+            # telegram tells how long to wait
+            return float((error.result_json or {}).get('parameters', {}).get('retry_after', RETRY_MAX_DELAY))
+        if error_code < HTTPStatus.INTERNAL_SERVER_ERROR:
+            return None
+    # exponential backoff with jitter, so clients do not retry in lockstep
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1)
+
+
+def next_retry(name: str, error: Exception, attempt: int) -> Optional[float]:
+    """Count failed attempt and get delay before the next one, permanent errors are raised.
+
+    Args:
+        name: wrapped function name.
+        error: raised exception.
+        attempt: number of failed attempt, starting from 0.
+
+    Returns:
+        Seconds to wait, None after the last attempt.
+    """
+    delay = retry_delay(error, attempt)
+    if delay is None:
+        count_retry(name, 'permanent')
+        raise error
+    if attempt + 1 >= RETRY_ATTEMPTS:
+        # ждать перед отказом незачем
+        return None
+    if getattr(error, 'error_code', None) == HTTPStatus.TOO_MANY_REQUESTS:
+        count_retry(name, 'rate_limited')
+    count_retry(name, 'retries')
+    count_retry(name, 'sleep_seconds', delay)
+    return delay
+
+
+def not_modified(name: str, error: Exception) -> bool:
+    """Check that edit failed only because the message already has the text, such edit is a success.
+
+    Args:
+        name: editing function name.
+        error: error of the sync or the async bot.
+
+    Returns:
+        True if the message is not modified.
+    """
+    if 'message is not modified' not in (getattr(error, 'description', None) or ''):
+        return False
+    count_retry(name, 'not_modified')
+    return True
+
+
+def give_up(name: str, network: bool) -> TelegramUnavailable:
+    """Count failed call and make the error raised after the last attempt.
+
+    Args:
+        name: wrapped function name.
+        network: whether the last error was a network one.
+
+    Returns:
+        Exception to raise.
+    """
+    count_retry(name, 'failures')
+    if network:
+        err_msg = "Программа не смогла связаться с сервером Telegram. Проверьте соединение с интернетом. Исключение ConnectionErrorRequests"
+    else:
+        err_msg = "Программа не смогла связаться с Telegram по неизвестной причине. Исключение ApiTelegramException"
+    return TelegramUnavailable(
+        'Проблемы с интернетом.\n{err_type}\nФункция: {name}'.format(
+            err_type=err_msg,
+            name=name,
+        )
+    )
 
 
 def retry(fn: Callable) -> Callable:
     """Retry decorator for handle errors.
 
+    Network and server errors are retried with exponential backoff, rate limits after the time telegram
+    asks for, other telegram errors are raised at once.
+
     Args:
         fn: function that will be wrapped.
 
@@ -33,6 +158,7 @@ def retry(fn: Callable) -> Callable:
         Decorator closure.
     """
 
+    @wraps(fn)
     def inner(*args: Tuple, **kwargs: Dict) -> Optional[Callable]:
         """Inner decorator function.
 
@@ -40,31 +166,22 @@ def retry(fn: Callable) -> Callable:
             args: Tuple with any values.
             kwargs: Dictionary with any variables and values.
         """
-        err_counter = 0
         exception = None
-        while err_counter <= 10:
+        count_retry(fn.__name__, 'calls')
+        for attempt in range(RETRY_ATTEMPTS):
             try:
                 return fn(*args, **kwargs)
             # проблемы с интернетом
             # телеграм апи использует реквестс
-            except ConnectionErrorRequests as e:
-                err_counter += 1
+            except (ConnectionErrorRequests, Timeout) as e:
                 exception = e
             # проблемы с телеграмм
             except ApiTelegramException as e:
-                err_counter += 1
                 exception = e
-            time.sleep(1.5)
-        if isinstance(exception, ConnectionErrorRequests):
-            err_msg = "Программа не смогла связаться с сервером Telegram. Проверьте соединение с интернетом. Исключение ConnectionErrorRequests"
-        else:
-            err_msg = "Программа не смогла связаться с Telegram по неизвестной причине. Исключение ApiTelegramException"
-        raise TelegramError(
-            'Проблемы с интернетом.\n{err_type}\nФункция: {name}'.format(
-                err_type=err_msg,
-                name=fn.__name__,
-            )
-        )
+            delay = next_retry(fn.__name__, exception, attempt)
+            if delay is not None:
+                time.sleep(delay)
+        raise give_up(fn.__name__, isinstance(exception, (ConnectionErrorRequests, Timeout)))
     return inner
 
 
@@ -94,7 +211,9 @@ def exception_run_handler(fn: Callable) -> Callable:
             except InvalidCookieDomainException:
                 # raises if cookie adding attempt fails, for example, if self.get hasn't called
                 pass
-            time.sleep(1)
+            # repeated errors are retried less and less often
+            poller = getattr(driver, 'poller', None)
+            time.sleep(poller.next_interval() if poller else 1)
     return inner
 
 
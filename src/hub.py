@@ -0,0 +1,430 @@
+"""Sync hub: one process talks to telegram and serves cookies to the clients of a machine or LAN."""
+
+import argparse
+import hmac
+import json
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from requests import RequestException, Session
+
+from src.exceptions import HubError, InvalidHash, MessageTooLong, ResoException, TelegramUnavailable, WriteConflict
+from src.manager import MessageManager
+from src.metrics import metrics, serve
+from src.settings import HUB_POLL_TIMEOUT, HUB_PORT, HUB_TOKEN, METRICS_PORT, WATCH_INTERVAL
+from src.storage import SQLiteStorage, StorageBackend
+
+# storage errors that clients raise again by response status, other errors mean that storage is unreachable
+ERROR_STATUSES = {
+    InvalidHash: HTTPStatus.NOT_FOUND,
+    MessageTooLong: HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+    WriteConflict: HTTPStatus.CONFLICT,
+}
+STATUS_ERRORS = {status: error for error, status in ERROR_STATUSES.items()}
+
+
+class SyncHub(object):
+    """Shared storage served over HTTP, clients get changes by long polling instead of polling telegram.
+
+    Every route is a JSON request and a JSON response. A change of the storage, made by a client of the hub
+    or seen by the watcher of the storage, increments the version that /changes waits for.
+    """
+
+    def __init__(self, backend: StorageBackend, token: Optional[str] = HUB_TOKEN) -> None:
+        """Create hub, call serve to accept clients.
+
+        Args:
+            backend: storage that only the hub uses.
+            token: secret that clients send in X-Hub-Token, None lets everybody in.
+        """
+        self.backend = backend
+        self.token = token
+        self.version = 0
+        self._changed = threading.Condition()
+        self.routes: Dict[str, Callable[[Dict], Dict]] = {
+            'GET /accounts': lambda params: {'accounts': self.backend.get_accounts()},
+            'POST /cookies': lambda params: {'cookies': self.backend.get_many_cookies(params['hashes'])},
+            'POST /moved': lambda params: {'moved': self.backend.get_moved_cookies(params['digests'])},
+            'POST /set': self.set_cookies,
+            'POST /publish': self.publish_cookies,
+            'POST /lease': lambda params: {
+                'held': self.backend.acquire_lease(params['name'], params['holder'], params['ttl']),
+            },
+            'POST /release': lambda params: self.backend.release_lease(params['name'], params['holder']) or {},
+            'POST /add': lambda params: self.changed(self.backend.add_account(params['hash'])),
+            'POST /remove': lambda params: self.changed(self.backend.remove_account(params['hash'])),
+            'POST /reinit': lambda params: self.changed(self.backend.reinit()),
+            'POST /flush': lambda params: self.backend.flush_writes() or {},
+        }
+
+    def changed(self, result: Any = None) -> Dict:
+        """Wake up clients that wait for a change.
+
+        Args:
+            result: ignored, so storage calls can be wrapped.
+
+        Returns:
+            Empty response.
+        """
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+        return {}
+
+    def wait(self, since: int, timeout: float) -> int:
+        """Block until the version differs from the known one or timeout is over.
+
+        Args:
+            since: version known to the client.
+            timeout: maximum seconds to wait.
+
+        Returns:
+            Current version.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != since, timeout)
+            return self.version
+
+    def set_cookies(self, params: Dict) -> Dict:
+        """Set cookies of account and wake up clients.
+
+        Args:
+            params: request with hash and cookies.
+
+        Returns:
+            Empty response.
+        """
+        self.backend.set_telegram_cookies(params['cookies'], params['hash'])
+        return self.changed()
+
+    def publish_cookies(self, params: Dict) -> Dict:
+        """Publish cookies under the account lease, clients wake up only if they were written.
+
+        Args:
+            params: request with hash, cookies, holder and ttl.
+
+        Returns:
+            Response with published flag.
+        """
+        published = self.backend.publish_cookies(params['cookies'], params['hash'], params['holder'], params['ttl'])
+        if published:
+            self.changed()
+        return {'published': published}
+
+    def forward_changes(self) -> None:
+        """Pass changes made by clients outside the hub on, runs in background thread."""
+        self.backend.watch()
+        while True:
+            if self.backend.wait_for_change(timeout=HUB_POLL_TIMEOUT):
+                self.changed()
+
+    def serve(self, host: str = '127.0.0.1', port: int = HUB_PORT) -> ThreadingHTTPServer:
+        """Start watching the storage and serving clients in background threads.
+
+        Args:
+            host: address to listen on, 0.0.0.0 for the LAN.
+            port: port number, 0 picks a free one.
+
+        Returns:
+            Running server, server_address holds the port.
+        """
+        handler = type('HubHandler', (HubHandler,), {'hub': self})
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        threading.Thread(target=self.forward_changes, daemon=True).start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class HubHandler(BaseHTTPRequestHandler):
+    """Routes of SyncHub and /changes?since=N&timeout=T long polling."""
+
+    hub: SyncHub
+    # clients keep connections alive
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        self.dispatch('GET')
+
+    def do_POST(self) -> None:
+        self.dispatch('POST')
+
+    def dispatch(self, method: str) -> None:
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.hub.token and not hmac.compare_digest(self.headers.get('X-Hub-Token', ''), self.hub.token):
+            self.reply({'error': 'invalid token'}, HTTPStatus.FORBIDDEN)
+            return
+        changes = method == 'GET' and url.path == '/changes'
+        route = self.hub.routes.get('{0} {1}'.format(method, url.path))
+        if route is None and not changes:
+            # not found status means an unknown account
+            self.reply({'error': 'unknown route'}, HTTPStatus.NOT_IMPLEMENTED)
+            return
+        try:
+            if changes:
+                # long polling is not timed, it waits for changes on purpose
+                result = self.changes({key: values[0] for key, values in parse_qs(url.query).items()})
+            else:
+                with metrics.timer('hub_served_seconds', route=url.path):
+                    result = route(json.loads(body) if body else {})
+        except (ValueError, KeyError, TypeError) as error:
+            self.reply({'error': 'bad request: {0!r}'.format(error)}, HTTPStatus.BAD_REQUEST)
+        except ResoException as error:
+            self.reply({'error': str(error)}, ERROR_STATUSES.get(type(error), HTTPStatus.SERVICE_UNAVAILABLE))
+        else:
+            self.reply(result)
+
+    def changes(self, query: Dict[str, str]) -> Dict:
+        """Wait for a change newer than the version the client knows.
+
+        Args:
+            query: since and timeout parameters of the url.
+
+        Returns:
+            Current version.
+        """
+        since, timeout = int(query.get('since', -1)), float(query.get('timeout', HUB_POLL_TIMEOUT))
+        if not timeout >= 0:
+            raise ValueError('timeout must not be negative')
+        return {'version': self.hub.wait(since, min(timeout, HUB_POLL_TIMEOUT))}
+
+    def reply(self, result: Dict, status: HTTPStatus = HTTPStatus.OK) -> None:
+        data = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args: Any) -> None:
+        # requests are not printed into the console of the program
+        pass
+
+
+class HubStorage(StorageBackend):
+    """Storage of the sync hub, the client does not talk to telegram at all."""
+
+    def __init__(self, url: str, token: Optional[str] = HUB_TOKEN, timeout: float = 10) -> None:
+        """Create keep-alive HTTP sessions.
+
+        Args:
+            url: hub address like http://192.168.1.10:8765.
+            token: secret of the hub.
+            timeout: seconds to wait for a response, long polling waits longer.
+        """
+        super().__init__()
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = Session()
+        # long polling holds a connection, so requests of sessions do not wait behind it
+        self.watch_session = Session()
+        for session in (self.session, self.watch_session):
+            if token:
+                session.headers['X-Hub-Token'] = token
+        self.version: Optional[int] = None
+
+    def _call(self, method: str, route: str, params: Optional[Dict] = None, timeout: Optional[float] = None,
+              session: Optional[Session] = None) -> Dict:
+        """Send request to hub.
+
+        Args:
+            method: GET or POST.
+            route: path with query.
+            params: JSON body.
+            timeout: seconds to wait for the response.
+            session: HTTP session, the one of requests by default.
+
+        Returns:
+            JSON response.
+        """
+        try:
+            with metrics.timer('hub_request_seconds', route=urlparse(route).path):
+                response = (session or self.session).request(
+                    method, self.url + route, json=params, timeout=timeout or self.timeout,
+                )
+            result = response.json()
+        except (RequestException, ValueError) as error:
+            raise TelegramUnavailable('Хаб {url} недоступен: {error}'.format(url=self.url, error=error))
+        if response.status_code == HTTPStatus.OK:
+            return result
+        if response.status_code == HTTPStatus.SERVICE_UNAVAILABLE:
+            raise TelegramUnavailable(result.get('error'))
+        error = STATUS_ERRORS.get(response.status_code)
+        if error:
+            raise error(result.get('error'))
+        raise HubError(HubError.msg.format(url=self.url, error=result.get('error')))
+
+    def get_telegram_cookies(self, hsh: str) -> List:
+        """Get cookies by hash.
+
+        Args:
+            hsh: user identification hash.
+
+        Returns:
+            Cookies list.
+        """
+        return self.get_many_cookies([hsh])[hsh]
+
+    def get_many_cookies(self, hashes: Iterable[str]) -> Dict[str, List]:
+        """Get cookies of several accounts with one request.
+
+        Args:
+            hashes: user identification hashes.
+
+        Returns:
+            Dictionary with cookies by hash.
+        """
+        return self._call('POST', '/cookies', {'hashes': list(hashes)})['cookies']
+
+    def get_moved_cookies(self, digests: Dict[str, Optional[str]]) -> Dict[str, Tuple[Optional[str], Optional[List]]]:
+        """Get current digests of accounts and cookies only of accounts whose digest has moved.
+
+        Args:
+            digests: digests known to the caller by hash, None for unknown.
+
+        Returns:
+            Dictionary with (digest, cookies or None if digest is the known one) by hash.
+        """
+        moved = self._call('POST', '/moved', {'digests': digests})['moved']
+        return {hsh: (digest, cookies) for hsh, (digest, cookies) in moved.items()}
+
+    def set_telegram_cookies(self, cookies: List, hsh: str) -> None:
+        """Set new cookies by hash.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash.
+        """
+        self._call('POST', '/set', {'cookies': cookies, 'hash': hsh})
+
+    def publish_cookies(self, cookies: List, hsh: str, holder: str, ttl: float) -> bool:
+        """Set cookies only if holder has or takes the account lease.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash, it is also the lease name.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if cookies were written, False if another client holds the lease.
+        """
+        params = {'cookies': cookies, 'hash': hsh, 'holder': holder, 'ttl': ttl}
+        return self._call('POST', '/publish', params)['published']
+
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew lease in the storage of the hub.
+
+        Args:
+            name: lease name, like account hash.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if holder has the lease.
+        """
+        return self._call('POST', '/lease', {'name': name, 'holder': holder, 'ttl': ttl})['held']
+
+    def release_lease(self, name: str, holder: str) -> None:
+        """Give lease back.
+
+        Args:
+            name: lease name.
+            holder: unique id of the client.
+        """
+        self._call('POST', '/release', {'name': name, 'holder': holder})
+
+    def add_account(self, hsh: str) -> None:
+        """Add new account.
+
+        Args:
+            hsh: user identification hash.
+        """
+        self._call('POST', '/add', {'hash': hsh})
+
+    def remove_account(self, hsh: str) -> None:
+        """Remove account.
+
+        Args:
+            hsh: user identification hash.
+        """
+        self._call('POST', '/remove', {'hash': hsh})
+
+    def get_accounts(self) -> List[str]:
+        """Get stored account hashes.
+
+        Returns:
+            List of hashes.
+        """
+        return self._call('GET', '/accounts')['accounts']
+
+    def reinit(self) -> None:
+        """Reinitialize storage of the hub with message sample."""
+        self._call('POST', '/reinit')
+
+    def flush_writes(self) -> None:
+        """Make the hub write its queued cookies now."""
+        self._call('POST', '/flush')
+
+    def refresh(self) -> None:
+        """Wait for the next change on the hub, call notify_change when it comes."""
+        query = urlencode({'since': -1 if self.version is None else self.version, 'timeout': HUB_POLL_TIMEOUT})
+        version = self._call(
+            'GET', '/changes?' + query, timeout=HUB_POLL_TIMEOUT + self.timeout, session=self.watch_session,
+        )['version']
+        if self.version is not None and version != self.version:
+            self.notify_change()
+        self.version = version
+
+    def _watch_loop(self, interval: float) -> None:
+        """Watcher thread body, long polling waits on the hub, so the next request follows at once.
+
+        Args:
+            interval: seconds to wait after an error.
+        """
+        while True:
+            try:
+                self.refresh()
+            except ResoException:
+                time.sleep(interval)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run hub until it is interrupted.
+
+    Args:
+        argv: command line arguments.
+    """
+    parser = argparse.ArgumentParser(prog='python -m src.hub', description='Хаб синхронизации кук для клиентов сети.')
+    parser.add_argument('--host', default='127.0.0.1', help='адрес, 0.0.0.0 - для всей сети')
+    parser.add_argument('--port', type=int, default=HUB_PORT)
+    parser.add_argument('--storage', choices=('telegram', 'sqlite'), default='telegram')
+    parser.add_argument('--storage-path', default='cookies.sqlite3')
+    parser.add_argument('--write-delay', type=float, default=1, help='секунд до записи в Telegram, 0 - сразу')
+    args = parser.parse_args(argv)
+    if args.storage == 'telegram':
+        backend: StorageBackend = MessageManager(write_delay=args.write_delay)
+    else:
+        backend = SQLiteStorage(args.storage_path)
+    if METRICS_PORT:
+        serve(METRICS_PORT)
+    server = SyncHub(backend).serve(args.host, args.port)
+    print('Хаб слушает {0}:{1}'.format(*server.server_address))
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        backend.flush_writes()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Office session keep-alive: refresh shortly before cookies expire or the server drops an idle session."""
+
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class KeepAlive(object):
+    """Expiry tracking of account sessions, only the holder of the account lease refreshes them.
+
+    The office forgets a session that has not loaded a page for idle_timeout seconds, any client of the
+    account resets this timer. Clients know only their own page loads, so they see the session older than
+    it is and never refresh too late. The lease lives at most half of idle_timeout: when its holder goes
+    silent, another client takes it over while the session is still alive. A session is refreshed at most
+    once per min_interval, so cookies whose expiry the office does not move are not refreshed on every tick.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = 1200,
+        margin: float = 120,
+        clock: Callable[[], float] = time.time,
+        min_interval: Optional[float] = None,
+    ) -> None:
+        """Create tracker.
+
+        Args:
+            idle_timeout: seconds after the last page load when office ends the session.
+            margin: seconds before expiry when the session is refreshed.
+            clock: wall clock, cookie expiry is compared with it.
+            min_interval: seconds between refreshes of one session, margin if not set.
+        """
+        self.idle_timeout = idle_timeout
+        self.margin = min(margin, idle_timeout / 2)
+        self.clock = clock
+        self.min_interval = self.margin if min_interval is None else min_interval
+        # last page load by hash
+        self.last_activity: Dict[str, float] = {}
+        # last refresh by hash
+        self.last_refresh: Dict[str, float] = {}
+
+    def touch(self, hsh: str, at: Optional[float] = None) -> None:
+        """Remember page load, it resets the idle timer of the session.
+
+        Args:
+            hsh: user identification hash.
+            at: unix time of the load, now if not set. Older loads than the known one are ignored.
+        """
+        at = self.clock() if at is None else at
+        self.last_activity[hsh] = max(at, self.last_activity.get(hsh, 0))
+
+    def refreshed(self, hsh: str) -> None:
+        """Remember refresh request, it resets the idle timer and starts the interval until the next refresh.
+
+        Args:
+            hsh: user identification hash.
+        """
+        self.touch(hsh)
+        self.last_refresh[hsh] = self.clock()
+
+    def expires_at(self, hsh: str, cookies: Optional[List]) -> float:
+        """Get time when session ends: the idle timeout or the earliest cookie expiry.
+
+        Args:
+            hsh: user identification hash.
+            cookies: browser cookies of the account.
+
+        Returns:
+            Unix time.
+        """
+        expiries = [cookie['expiry'] for cookie in cookies or [] if cookie and cookie.get('expiry')]
+        return min([self.last_activity.get(hsh, 0) + self.idle_timeout] + expiries)
+
+    def due(self, hsh: str, cookies: Optional[List]) -> bool:
+        """Check that session must be refreshed now.
+
+        Args:
+            hsh: user identification hash.
+            cookies: browser cookies of the account.
+
+        Returns:
+            True if expiry is closer than margin and the last refresh is older than min_interval.
+        """
+        now = self.clock()
+        if now - self.last_refresh.get(hsh, float('-inf')) < self.min_interval:
+            return False
+        return now >= self.expires_at(hsh, cookies) - self.margin
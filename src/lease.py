@@ -0,0 +1,107 @@
+"""Per-account lease that elects one client to publish rotated cookies and keep the session alive."""
+
+import time
+import uuid
+from typing import Callable, Dict, List
+
+from src.storage import StorageBackend
+
+
+class AccountLease(object):
+    """Client side of account leases kept in the shared storage.
+
+    The holder publishes cookies rotated by the office and renews the lease with the same write,
+    other clients of the account take the published cookies. A lease that has not been renewed for ttl
+    seconds ends, so the next client with a change takes it over when the holder goes silent.
+    """
+
+    def __init__(self, ttl: float = 300, clock: Callable[[], float] = time.time) -> None:
+        """Create lease state with unique holder id.
+
+        Args:
+            ttl: seconds until the lease ends if it is not renewed.
+            clock: wall clock, leases of different computers are compared by it.
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self.holder = uuid.uuid4().hex[:8]
+        # end of our lease by hash
+        self.until: Dict[str, float] = {}
+
+    def needs_request(self, hsh: str, wanted: bool) -> bool:
+        """Check that storage must be asked for the lease: to take it when wanted, or to renew a half used one.
+
+        Args:
+            hsh: user identification hash.
+            wanted: whether the lease is needed now.
+
+        Returns:
+            True if lease must be requested.
+        """
+        until = self.until.get(hsh)
+        if until is None:
+            return wanted
+        return until - self.clock() < self.ttl / 2
+
+    def holds(self, hsh: str) -> bool:
+        """Check that our lease of the account has not ended.
+
+        Args:
+            hsh: user identification hash.
+
+        Returns:
+            True if this client is the holder.
+        """
+        return self.until.get(hsh, 0) > self.clock()
+
+    def granted(self, hsh: str, held: bool) -> None:
+        """Remember result of lease request.
+
+        Args:
+            hsh: user identification hash.
+            held: whether lease is ours.
+        """
+        if held:
+            self.until[hsh] = self.clock() + self.ttl
+        else:
+            self.until.pop(hsh, None)
+
+    def acquire(self, storage: StorageBackend, hsh: str) -> bool:
+        """Take or renew the lease.
+
+        Args:
+            storage: shared storage.
+            hsh: user identification hash.
+
+        Returns:
+            True if this client is the holder.
+        """
+        held = storage.acquire_lease(hsh, self.holder, self.ttl)
+        self.granted(hsh, held)
+        return held
+
+    def publish(self, storage: StorageBackend, cookies: List, hsh: str) -> bool:
+        """Publish cookies if this client holds or takes the lease, the write renews it.
+
+        Args:
+            storage: shared storage.
+            cookies: cookies of the account.
+            hsh: user identification hash.
+
+        Returns:
+            True if cookies were written.
+        """
+        published = storage.publish_cookies(cookies, hsh, self.holder, self.ttl)
+        self.granted(hsh, published)
+        return published
+
+    def release(self, storage: StorageBackend, hsh: str) -> None:
+        """Give our lease back, so another client takes it without waiting for its end.
+
+        Args:
+            storage: shared storage.
+            hsh: user identification hash.
+        """
+        if self.holds(hsh):
+            storage.release_lease(hsh, self.holder)
+        self.granted(hsh, False)
@@ -1,12 +1,13 @@
 """Main file to run main functionality."""
 
+import base64
 import os
-import time
-from configparser import ConfigParser, SectionProxy
+from contextlib import suppress
 from os import devnull
-from typing import Any, Dict, List, Tuple, Type, Optional
+from typing import Any, Dict, List, Mapping, Tuple, Type, Optional
 from http.client import RemoteDisconnected
-from selenium.common.exceptions import NoSuchElementException, NoSuchDriverException, InvalidSessionIdException, InvalidCookieDomainException
+from selenium.common.exceptions import NoSuchElementException, NoSuchDriverException, InvalidSessionIdException, InvalidCookieDomainException, \
+    JavascriptException, SessionNotCreatedException, TimeoutException
 from selenium.webdriver import Chrome, Edge, Firefox
 from selenium.webdriver.chrome.options import ChromiumOptions as ChromeOptions
 from selenium.webdriver.chrome.service import Service as ChromeService
@@ -17,14 +18,60 @@ from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.firefox.service import Service as FirefoxService
 from selenium.webdriver.remote.webdriver import WebDriver
 
+from src import footprint
 from src.choiches import CookieFields
-from src.exceptions import NoIniFileError, NoIniOptionsError, InvalidIniFieldError, InvalidIniValueError, \
-    BrowserNotFoundError, BrowserNotInstalled
+from src.codec import cookie_digest
+from src.config import IniOptions
+from src.exceptions import BrowserNotFoundError, BrowserNotInstalled, TelegramError
+from src.events import CookieEvents
 from src.handlers import exception_run_handler
-from src.manager import MessageManager
-from src.settings import INI_PATH
+from src.keepalive import KeepAlive
+from src.lease import AccountLease
+from src.metrics import metrics, runtime_profiler, serve
+from src.probe import LOGIN_MARKER, CookieProbe
+from src.scheduler import AdaptivePoller
+from src.settings import METRICS_PORT
+from src.startup import driver_cache, profiler
+from src.storage import LazyStorage, StorageBackend
 
 BaseDriverMeta: Type = type(WebDriver)
+profiler.mark('imports')
+# hosts of the office, requests to other hosts are blocked in lite mode
+OFFICE_DOMAIN = 'reso.ru'
+# proxy for requests that must fail at once, nothing listens on the discard port
+BLOCKING_PROXY = '127.0.0.1:9'
+# welcome message of the office page, it is shown only to logged in users
+WELCOME_XPATH = '/html/body/form/div[4]/div[1]/div[7]/div/div/div/div/div[1]'
+RESO_COOKIES = (CookieFields.aspnet, CookieFields.reso_office60)
+# login state and cookies visible to scripts in one webdriver round trip, HttpOnly cookies are not visible
+PROBE_SCRIPT = """
+return [
+    document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue === null,
+    document.cookie
+];
+"""
+# replaces cookies that are not HttpOnly in one round trip, expiry is unix time
+REPLACE_SCRIPT = """
+for (const cookie of arguments[0]) {
+    // host-only cookie and domain cookie with the same name would both be sent
+    const expired = cookie.name + '=; path=' + (cookie.path || '/') + '; expires=Thu, 01 Jan 1970 00:00:00 GMT';
+    document.cookie = expired;
+    if (cookie.domain) document.cookie = expired + '; domain=' + cookie.domain;
+    let line = cookie.name + '=' + cookie.value + '; path=' + (cookie.path || '/');
+    if (cookie.domain) line += '; domain=' + cookie.domain;
+    if (cookie.expiry) line += '; expires=' + new Date(cookie.expiry * 1000).toUTCString();
+    if (cookie.secure) line += '; secure';
+    if (cookie.sameSite) line += '; samesite=' + cookie.sameSite;
+    document.cookie = line;
+}
+"""
+# unix time when the page of the browser was loaded, the user may have opened it
+LOADED_SCRIPT = 'return performance.timeOrigin / 1000;'
+# background request of the office page with browser cookies, the page of the user stays as it is
+REFRESH_SCRIPT = """
+const done = arguments[arguments.length - 1];
+fetch(arguments[0], {credentials: 'include', cache: 'no-store'}).then(response => done(response.status), () => done(0));
+"""
 
 class BrowserDetector(object):
     """Detect browser class and his services and options."""
@@ -35,12 +82,14 @@ class BrowserDetector(object):
         'Edge': (Edge, EdgeService, EdgeOptions),
     }
 
-    def __init__(self, name: str, user_agent: str):
+    def __init__(self, name: str, user_agent: str, lite: bool = False, memory_limit: int = 0):
         """Create instance with options and service by name.
 
         Args:
             name: browser string capitalized name, like 'Firefox',
             user_agent: string User-Agent value.
+            lite: run browser in resource-saving mode.
+            memory_limit: megabytes of javascript heap per content process in lite mode, 0 for no limit.
         """
         self.name = name
         if self.name == 'Edge':
@@ -50,91 +99,362 @@ class BrowserDetector(object):
             self.klass = self.browser_dictionary[name][0]
         except KeyError:
             raise BrowserNotFoundError(f'Браузер {self.name} не поддерживается программой. Проверьте корректность ввода данных в reso.ini файле.')
-        self.service = self.browser_dictionary[name][1](log_output=devnull)
-        self.options = self.browser_dictionary[name][2]()
-        if isinstance(self.options, FirefoxOptions):
-            self.options.set_preference('general.useragent.override', user_agent)
-            self.options.set_preference("dom.webdriver.enabled", False)
-            self.options.set_preference("useAutomationExtension", False)  # на всякий случай
-            self.options.set_preference("devtools.jsonview.enabled", False)
+        self.user_agent = user_agent
+        self.lite = lite
+        self.memory_limit = memory_limit
+        # websocket url is asked when the session is created, events are subscribed after that
+        self.bidi = False
+        self.service, self.options = self.setup()
+
+    def setup(self) -> Tuple[Any, Any]:
+        """Create new service and options, the driver resolves paths into them, so they are not shared.
+
+        Returns:
+            Service and options of the browser.
+        """
+        service = self.browser_dictionary[self.name][1](log_output=devnull)
+        options = self.browser_dictionary[self.name][2]()
+        if isinstance(options, FirefoxOptions):
+            options.set_preference('general.useragent.override', self.user_agent)
+            options.set_preference("dom.webdriver.enabled", False)
+            options.set_preference("useAutomationExtension", False)  # на всякий случай
+            options.set_preference("devtools.jsonview.enabled", False)
         else:
-            self.options.add_argument('--user-agent={user_agent}'.format(user_agent=user_agent))
-            self.options.add_experimental_option("excludeSwitches", ["enable-automation"])
-            self.options.add_argument("--disable-blink-features=AutomationControlled")
-            self.options.set_capability("unhandledPromptBehavior", "ignore")
+            options.add_argument('--user-agent={user_agent}'.format(user_agent=self.user_agent))
+            options.add_experimental_option("excludeSwitches", ["enable-automation"])
+            options.add_argument("--disable-blink-features=AutomationControlled")
+            options.set_capability("unhandledPromptBehavior", "ignore")
+        if self.lite:
+            self.set_lite_options(options, self.memory_limit)
+        if self.bidi:
+            options.enable_bidi = True
+        return service, options
+
+    @staticmethod
+    def pac_url(domain: str = OFFICE_DOMAIN) -> str:
+        """Build proxy auto-config that lets through only the office and local hosts.
+
+        Args:
+            domain: office domain, its subdomains are allowed too.
+
+        Returns:
+            data: url of PAC script.
+        """
+        script = (
+            'function FindProxyForURL(url, host) {{'
+            ' if (host == "{domain}" || dnsDomainIs(host, ".{domain}") || isPlainHostName(host)'
+            ' || host == "127.0.0.1") return "DIRECT";'
+            ' return "PROXY {proxy}"; }}'
+        ).format(domain=domain, proxy=BLOCKING_PROXY)
+        return 'data:application/x-ns-proxy-autoconfig;base64,' + base64.b64encode(script.encode()).decode()
+
+    def set_lite_options(self, options: Any, memory_limit: int) -> None:
+        """Turn on resource-saving mode: the sync loop needs only cookies and the login marker of the office page.
 
+        Browser runs headless, does not load images, fonts and media, sends requests only to office hosts
+        and keeps one content process with limited javascript heap.
 
-class BrowserMeta(BaseDriverMeta):
+        Args:
+            options: browser options.
+            memory_limit: megabytes of javascript heap per content process, 0 for no limit.
+        """
+        if isinstance(options, FirefoxOptions):
+            options.add_argument('-headless')
+            options.set_preference('permissions.default.image', 2)
+            options.set_preference('gfx.downloadable_fonts.enabled', False)
+            options.set_preference('media.autoplay.default', 5)
+            options.set_preference('media.preload.default', 0)
+            options.set_preference('network.proxy.type', 2)
+            options.set_preference('network.proxy.autoconfig_url', self.pac_url())
+            options.set_preference('dom.ipc.processCount', 1)
+            options.set_preference('fission.autostart', False)
+            options.set_preference('browser.cache.memory.capacity', 16384)
+            if memory_limit:
+                options.set_preference('javascript.options.mem.max', memory_limit * 1024)
+        else:
+            options.add_argument('--headless=new')
+            options.add_argument('--blink-settings=imagesEnabled=false')
+            options.add_argument('--disable-remote-fonts')
+            options.add_argument('--autoplay-policy=user-gesture-required')
+            options.add_argument('--mute-audio')
+            options.add_argument('--proxy-pac-url={url}'.format(url=self.pac_url()))
+            options.add_argument('--renderer-process-limit=1')
+            options.add_argument('--disable-gpu')
+            options.add_argument('--disable-extensions')
+            options.add_argument('--disable-background-networking')
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+            if memory_limit:
+                options.add_argument('--js-flags=--max-old-space-size={limit}'.format(limit=memory_limit))
+
+
+class BrowserMeta(BaseDriverMeta, IniOptions):
     """Metaclass for detect browser in ini options and change ResoBrowser class inheritance."""
 
-    def __new__(cls, name: str, bases: Tuple, attrs: Dict) -> Any:
+    def __new__(cls, name: str, bases: Tuple, attrs: Dict, options: Optional[Mapping] = None) -> Any:
         """Class creation method.
 
         Args:
             name: string class name.
             bases: tuple with inheritance order.
             attrs: dictionary with class variables and values.
+            options: session options, [options] section of ini file if not set.
 
         Returns:
             Edited class.
         """
-        options = cls.get_ini_options()
+        if options is None:
+            options = cls.get_ini_options()
         browser = BrowserDetector(
             name=options['browser'].capitalize(),
             user_agent=options['user-agent'].capitalize(),
+            lite=cls.get_flag(options, 'lite-mode', 'no'),
+            memory_limit=cls.get_count(options, 'memory-limit', 0),
         )  # type: ignore
-        new_browser_class = super().__new__(cls, name, (browser.klass,), attrs)
+        # webdriver base is replaced by the browser from options, mixins stay
+        bases = tuple(base for base in bases if not issubclass(base, WebDriver))
+        new_browser_class = super().__new__(cls, name, bases + (browser.klass,), attrs)
         new_browser_class.hash = options.get('hash', 'None')
-        new_browser_class.service = browser.service
-        new_browser_class.options = browser.options
+        new_browser_class.detector = browser
         new_browser_class.browser_name = options['browser'].capitalize()
+        if 'manager' not in attrs:
+            # telegram client is created on first access, not on import
+            new_browser_class.manager = LazyStorage(lambda: cls.get_storage(options))
+        new_browser_class.probe = cls.get_probe(options, new_browser_class.url_main)
+        new_browser_class.poll_bounds = (cls.get_float(options, 'poll-min', 0.5), cls.get_float(options, 'poll-max', 5))
+        new_browser_class.pool_size = cls.get_count(options, 'pool-size', 0)
+        new_browser_class.pool_idle_timeout = cls.get_float(options, 'pool-idle-timeout', 300)
+        new_browser_class.keepalive = cls.get_keepalive(options)
+        new_browser_class.lease = cls.get_lease(options, new_browser_class.keepalive)
+        new_browser_class.cookie_events_enabled = cls.get_flag(options, 'cookie-events', 'no')
+        new_browser_class.batched_probe = cls.get_flag(options, 'batched-probe', 'no')
+        if new_browser_class.cookie_events_enabled:
+            browser.bidi = True
         return new_browser_class
 
     @classmethod
-    def get_ini_options(cls) -> SectionProxy:
-        """Get and check that ini options is correct.
+    def get_probe(cls, options: Mapping, url: str) -> Optional[CookieProbe]:
+        """Create HTTP cookie probe if it is turned on in ini options.
+
+        Args:
+            options: ini options.
+            url: office page url.
 
         Returns:
-            SectionProxy instance (like dict) with hash, user-agent and browser fields.
+            CookieProbe instance or None.
         """
-        ini_options = ConfigParser()
-        ini_content = ini_options.read(filenames=INI_PATH, encoding='UTF-8')
-        # нет файла
-        if not ini_content:
-            raise NoIniFileError(NoIniFileError.msg)
-        try:
-            options = ini_options['options']
-        except KeyError:
-            raise NoIniOptionsError(NoIniFileError.msg)
-        for field, field_content in options.items():
-            if field not in {'hash', 'browser', 'user-agent', 'proxy-server'}:
-                raise InvalidIniFieldError(InvalidIniFieldError.msg.format(field=field))
-            if not options.get(field):
-                raise InvalidIniValueError(InvalidIniValueError.msg.format(field=field, value=field_content))
-        return options
+        if not cls.get_flag(options, 'http-probe', 'no'):
+            return None
+        return CookieProbe(url=url, user_agent=options['user-agent'], marker=options.get('probe-marker', LOGIN_MARKER))
 
+    @classmethod
+    def get_keepalive(cls, options: Mapping) -> Optional[KeepAlive]:
+        """Create session keep-alive if it is turned on in ini options.
 
-class ResoBrowser(Firefox, metaclass=BrowserMeta):
-    """Main Webdriver class."""
+        Args:
+            options: ini options.
+
+        Returns:
+            KeepAlive instance or None.
+        """
+        if not cls.get_flag(options, 'keepalive', 'no'):
+            return None
+        return KeepAlive(
+            idle_timeout=cls.get_float(options, 'keepalive-idle', 1200),
+            margin=cls.get_float(options, 'keepalive-margin', 120),
+        )
+
+    @classmethod
+    def get_lease(cls, options: Mapping, keepalive: Optional[KeepAlive]) -> Optional[AccountLease]:
+        """Create account lease if rotated cookies are published by one client or keep-alive is on.
+
+        Args:
+            options: ini options.
+            keepalive: session keep-alive, its lease must end while the idle session is still alive.
+
+        Returns:
+            AccountLease instance or None.
+        """
+        ttl = cls.get_float(options, 'lease-ttl', 300)
+        if keepalive:
+            return AccountLease(ttl=min(ttl, keepalive.idle_timeout / 2))
+        if cls.get_flag(options, 'write-lease', 'yes'):
+            return AccountLease(ttl=ttl)
+        return None
+
+class ResoSession(object):
+    """Sync logic of one account session, mixed into the webdriver class by BrowserMeta."""
 
     url_main = 'https://office.reso.ru/'
-    manager = MessageManager()
 
     # will fill in meta:
+    manager: StorageBackend
+    probe: Optional[CookieProbe]
+    # (minimum, maximum) poll interval in seconds
+    poll_bounds: Tuple[float, float]
+    # number of warm browsers kept for this session and seconds before idle one reloads the page
+    pool_size: int
+    pool_idle_timeout: float
+    keepalive: Optional[KeepAlive] = None
+    lease: Optional[AccountLease] = None
+    # digest of storage cookies when the holder of the lease was left to publish, they are older than the browser ones
+    followed_digest: Optional[str] = None
+    cookie_events_enabled = False
+    cookie_events: Optional[CookieEvents] = None
+    batched_probe = False
     hash: str
+    detector: BrowserDetector
     service: FirefoxService
     options: FirefoxOptions
     browser_name: str
 
+    @classmethod
+    def session_class(cls, options: Mapping, manager: StorageBackend) -> Type['ResoSession']:
+        """Create webdriver class for a session with its own hash and browser.
+
+        Args:
+            options: session options with hash, browser and user-agent fields.
+            manager: storage shared between sessions.
+
+        Returns:
+            ResoBrowser-like class.
+        """
+        attrs = {'manager': manager, '__module__': __name__}
+        return BrowserMeta(ResoBrowser.__name__, (ResoSession,), attrs, options=options)
+
     def __init__(self) -> None:
         """Initialize method for class."""
+        # у каждого браузера свой сервис: общий порт драйвера закрывал бы все браузеры пула при quit
+        self.service, self.options = self.detector.setup()
         #browser in ini file is correct, but not installed in system
         try:
-            super().__init__(service=self.service, options=self.options)
+            cached = driver_cache.apply(self.browser_name, self.service, self.options)
+            profiler.mark('driver resolution')
+            try:
+                super().__init__(service=self.service, options=self.options)
+            except SessionNotCreatedException:
+                if not cached:
+                    raise
+                # браузер обновился после кэширования путей, ищем их заново
+                driver_cache.forget(self.browser_name)
+                # путь драйвера нельзя сбросить в None: сервис превратит его в строку 'None'
+                self.service, self.options = self.detector.setup()
+                driver_cache.apply(self.browser_name, self.service, self.options)
+                super().__init__(service=self.service, options=self.options)
         except NoSuchDriverException:
             raise BrowserNotInstalled(f'Браузер {self.browser_name} не установлен в системе')
+        profiler.mark('browser launch')
+        footprint.track(self)
+        if self.cookie_events_enabled:
+            self.cookie_events = CookieEvents(on_change=self.manager.notify_change)
+            self.cookie_events.attach(self)
         self.need_to_set_telegram_cookies = False
         self.last_cookies = self.manager.get_telegram_cookies(self.hash)
+        # account cookies from storage and their digest, the full entry is read again only when the digest moves
+        self.storage_digest = cookie_digest(self.last_cookies)
+        self.storage_cookies = self.last_cookies
+        profiler.mark('storage')
+        self.poller = AdaptivePoller(*self.poll_bounds)
+        self.was_logged_in: Optional[bool] = None
+
+    def execute(self, driver_command: str, params: Optional[Dict] = None) -> Dict:
+        """Send command to webdriver and measure its duration.
+
+        Args:
+            driver_command: webdriver command name.
+            params: command parameters.
+
+        Returns:
+            Webdriver response.
+        """
+        with metrics.timer('webdriver_command_seconds', command=driver_command):
+            return super().execute(driver_command, params)
+
+    def get(self, url: str) -> None:
+        """Load page, it resets the idle timer of the office session.
+
+        Args:
+            url: page url.
+        """
+        super().get(url)
+        if self.keepalive:
+            self.keepalive.touch(self.hash)
+
+    def keep_alive(self) -> None:
+        """Refresh office session in background shortly before it ends, if this client is elected for the account.
+
+        Rotated cookies are published by the next tick like any other change made by the server.
+        """
+        due = self.keepalive.due(self.hash, self.last_cookies)
+        if due:
+            # известные сроки могли устареть: пользователь открывал страницы, офис продлевал куки
+            due = self.refresh_due()
+        if self.lease.needs_request(self.hash, due):
+            try:
+                self.lease.acquire(self.manager, self.hash)
+            except TelegramError:
+                # keep-alive is not worth stopping sync, the lease is asked again on the next tick
+                metrics.inc('keepalive_lease_errors_total')
+                return
+        if due and self.lease.holds(self.hash):
+            self.refresh_session()
+            self.keepalive.refreshed(self.hash)
+            self.poller.reset()
+
+    def refresh_due(self) -> bool:
+        """Check that session must be refreshed by the page load time and cookie expiry from the browser.
+
+        Returns:
+            True if session ends soon.
+        """
+        try:
+            loaded = self.execute_script(LOADED_SCRIPT)
+        except JavascriptException:
+            loaded = None
+        if loaded:
+            self.keepalive.touch(self.hash, loaded)
+        cookies = self.get_browser_cookies()
+        if cookies and cookie_digest(cookies) == cookie_digest(self.last_cookies):
+            # те же куки, но со сроком из браузера, иначе сессия считалась бы истекающей на каждом тике
+            self.last_cookies = cookies
+        return self.keepalive.due(self.hash, cookies)
+
+    def refresh_session(self) -> None:
+        """Request office page with browser cookies in background, the page is reloaded only if the request fails."""
+        try:
+            status = self.execute_async_script(REFRESH_SCRIPT, self.url_main)
+        except (JavascriptException, TimeoutException):
+            status = 0
+        if status:
+            metrics.inc('keepalive_refreshes_total', mode='fetch')
+            return
+        # страница другого сайта не может запросить офис с его куками
+        self.get(self.url_main)
+        metrics.inc('keepalive_refreshes_total', mode='page')
+
+    def release_lease(self) -> None:
+        """Give lease of the account back, so another client takes it without waiting for its end."""
+        if self.lease:
+            with suppress(TelegramError):
+                self.lease.release(self.manager, self.hash)
+
+    def quit(self) -> None:
+        """Write queued cookies, give account lease back and close browser."""
+        with suppress(TelegramError):
+            # отложенная запись кук берет аренду снова, поэтому она уходит до возврата аренды
+            self.manager.flush_writes()
+        self.release_lease()
+        super().quit()
+
+    def get_storage_cookies(self) -> List:
+        """Get account cookies from storage, the full entry is fetched only if its digest has moved.
+
+        Returns:
+            List with dict cookies.
+        """
+        digest, cookies = self.manager.get_moved_cookies({self.hash: self.storage_digest})[self.hash]
+        if cookies is not None:
+            self.storage_digest, self.storage_cookies = digest, cookies
+        return self.storage_cookies
 
     def delete_reso_cookies(self) -> None:
         """Delete only necessary reso cookies."""
@@ -143,9 +463,52 @@ class ResoBrowser(Firefox, metaclass=BrowserMeta):
 
     def insert_cookies(self, tele_cookies: List) -> None:
         """Get cookies from telegram and insert them in browser."""
+        if self.batched_probe and self.replace_cookies(tele_cookies):
+            return
         self.delete_reso_cookies()
         for line in tele_cookies:
             self.add_cookie(line)
+        metrics.inc('cookie_replace_total', mode='webdriver')
+
+    def replace_cookies(self, cookies: List) -> bool:
+        """Replace cookies in one round trip: over CDP in Chrome and Edge, by script if none of them is HttpOnly.
+
+        Reso cookies of the office host are deleted first, otherwise a host-only cookie and a domain cookie
+        with the same name would both stay in the browser.
+
+        Args:
+            cookies: selenium cookie dictionaries.
+
+        Returns:
+            True if cookies were replaced, False if they need a webdriver call per cookie.
+        """
+        if hasattr(self, 'execute_cdp_cmd'):
+            for name in RESO_COOKIES:
+                # удаляет куки с этим именем для любого домена, подходящего адресу офиса
+                self.execute_cdp_cmd('Network.deleteCookies', {'name': name, 'url': self.url_main})
+            params = []
+            for cookie in cookies:
+                fields = ('name', 'value', 'path', 'secure', 'httpOnly', 'sameSite')
+                param = {key: cookie[key] for key in fields if key in cookie}
+                if cookie.get('domain'):
+                    param['domain'] = cookie['domain']
+                else:
+                    param['url'] = self.url_main
+                if cookie.get('expiry'):
+                    param['expires'] = cookie['expiry']
+                params.append(param)
+            self.execute_cdp_cmd('Network.setCookies', {'cookies': params})
+            metrics.inc('cookie_replace_total', mode='cdp')
+            return True
+        if any(cookie.get('httpOnly') for cookie in cookies):
+            # скрипт не видит HttpOnly куки и не может их перезаписать
+            return False
+        try:
+            self.execute_script(REPLACE_SCRIPT, cookies)
+        except JavascriptException:
+            return False
+        metrics.inc('cookie_replace_total', mode='script')
+        return True
 
     def auth_complete(self) -> bool:
         """Check is authentication was complete.
@@ -155,7 +518,7 @@ class ResoBrowser(Firefox, metaclass=BrowserMeta):
         """
         try:
             # welcome message
-            self.find_element(By.XPATH, '/html/body/form/div[4]/div[1]/div[7]/div/div/div/div/div[1]')
+            self.find_element(By.XPATH, WELCOME_XPATH)
         except NoSuchElementException:
             return True
         return False
@@ -175,50 +538,198 @@ class ResoBrowser(Firefox, metaclass=BrowserMeta):
             return cookies
         return None
 
-    def logged_in(self) -> None:
-        """Logic when browser is logged in service."""
-        tele_cookies = self.manager.get_telegram_cookies(self.hash)
-        browser_cookies = self.get_browser_cookies()
+    def probe_browser(self) -> Tuple[bool, Optional[List]]:
+        """Get login state and cookies in one script call, cookies are asked again only if the script can not see them.
 
+        Unchanged cookies visible to the script are taken from last_cookies. HttpOnly cookies are hidden from scripts,
+        then all cookies come with one more webdriver call.
+
+        Returns:
+            Login state and browser cookies, None if some of them are absent.
+        """
+        try:
+            logged_in, jar = self.execute_script(PROBE_SCRIPT, WELCOME_XPATH)
+        except JavascriptException:
+            metrics.inc('browser_probes_total', mode='webdriver')
+            return self.auth_complete(), self.get_browser_cookies()
+        if not logged_in:
+            # куки вышедшего браузера не сравниваются
+            metrics.inc('browser_probes_total', mode='script')
+            return False, None
+        values = dict(pair.strip().split('=', 1) for pair in (jar or '').split(';') if '=' in pair)
+        known = {cookie['name']: cookie['value'] for cookie in self.last_cookies or [] if cookie}
+        if all(name in values and values[name] == known.get(name) for name in RESO_COOKIES):
+            metrics.inc('browser_probes_total', mode='script')
+            return logged_in, self.last_cookies
+        metrics.inc('browser_probes_total', mode='script_and_cookies')
+        by_name = {cookie['name']: cookie for cookie in self.get_cookies()}
+        cookies = [by_name.get(name) for name in RESO_COOKIES]
+        return logged_in, cookies if all(cookies) else None
+
+    def logged_in(self, tele_cookies: Optional[List] = None, browser_cookies: Optional[List] = None) -> bool:
+        """Logic when browser is logged in service.
+
+        Args:
+            tele_cookies: cookies from storage if they are already fetched.
+            browser_cookies: cookies from browser if they are already fetched.
+
+        Returns:
+            True if browser cookies were written to storage.
+        """
+        if tele_cookies is None:
+            tele_cookies = self.get_storage_cookies()
+        if browser_cookies is None:
+            browser_cookies = self.get_browser_cookies()
+        # only names and values are compared, expiry and field order of the browser do not matter
+        browser_digest, tele_digest = cookie_digest(browser_cookies), cookie_digest(tele_cookies)
+        last_digest = cookie_digest(self.last_cookies)
+
+        waiting = self.followed_digest == tele_digest
+        if (browser_digest != tele_digest and not waiting) or last_digest != browser_digest:
+            # что-то меняется, следующие проверки нужны быстро
+            self.poller.reset()
         if browser_cookies and self.need_to_set_telegram_cookies:
             # зашел текущий клиент, у него теперь другие куки и нужно поменять в телеге
             self.manager.set_telegram_cookies(cookies=browser_cookies, hsh=self.hash)
             self.need_to_set_telegram_cookies = False
             self.last_cookies = browser_cookies
-        elif browser_cookies and self.last_cookies != browser_cookies:
+            metrics.inc('sync_decisions_total', branch='publish_own_login')
+            return True
+        elif browser_cookies and last_digest != browser_digest:
             # я залогинен, но ресо сервер изменил мне куки
-            self.manager.set_telegram_cookies(cookies=browser_cookies, hsh=self.hash)
             self.last_cookies = browser_cookies
-        elif browser_cookies != tele_cookies:
+            if not self.lease:
+                self.manager.set_telegram_cookies(cookies=browser_cookies, hsh=self.hash)
+            elif not self.lease.publish(self.manager, browser_cookies, self.hash):
+                # куки публикует держатель аренды, их возьмем из хранилища, когда он их запишет
+                self.followed_digest = tele_digest
+                metrics.inc('sync_decisions_total', branch='follow_holder')
+                return False
+            metrics.inc('sync_decisions_total', branch='publish_server_change')
+            return True
+        elif browser_digest != tele_digest and waiting:
+            # в хранилище все еще куки старше моих, жду держателя, пока его аренда не кончится
+            if not self.lease.publish(self.manager, browser_cookies, self.hash):
+                metrics.inc('sync_decisions_total', branch='wait_holder')
+                return False
+            self.followed_digest = None
+            metrics.inc('sync_decisions_total', branch='publish_server_change')
+            return True
+        elif browser_digest != tele_digest:
+            if self.probe and browser_cookies and self.probe.is_valid(tele_cookies) is False:
+                # в хранилище лежат мертвые куки, а мои рабочие, так что возвращаю свои
+                self.manager.set_telegram_cookies(cookies=browser_cookies, hsh=self.hash)
+                self.last_cookies = browser_cookies
+                metrics.inc('sync_decisions_total', branch='publish_over_dead')
+                return True
             # другой клиент изменил кукисы на свои, рабочие, но при этом я тоже залогинен, так что нужно унифицировать
             self.insert_cookies(tele_cookies)
             self.last_cookies = tele_cookies
+            self.followed_digest = None
+            metrics.inc('sync_decisions_total', branch='adopt_storage')
+        else:
+            metrics.inc('sync_decisions_total', branch='in_sync')
+        return False
 
-    def logged_out(self) -> None:
-        """Logic, when browser is logged out from service."""
-        tele_cookies = self.manager.get_telegram_cookies(self.hash)
-        if self.last_cookies == tele_cookies:
+    def logged_out(self, tele_cookies: Optional[List] = None) -> None:
+        """Logic, when browser is logged out from service.
+
+        Args:
+            tele_cookies: cookies from storage if they are already fetched.
+        """
+        if tele_cookies is None:
+            tele_cookies = self.get_storage_cookies()
+        if cookie_digest(self.last_cookies) == cookie_digest(tele_cookies):
             # в телеге лежат неверные куки, которые я пытался использовать
             self.need_to_set_telegram_cookies = True
+            metrics.inc('sync_decisions_total', branch='wait_login')
+        elif self.probe and self.probe.is_valid(tele_cookies) is False:
+            # кто-то изменил куки, но они тоже не рабочие, нет смысла перезагружать страницу
+            self.need_to_set_telegram_cookies = True
+            self.last_cookies = tele_cookies
+            metrics.inc('sync_decisions_total', branch='skip_dead')
         else:
             # кто-то изменил куки и они рабочие с высокой вероятностью
             self.need_to_set_telegram_cookies = False
+            self.poller.reset()
             self.insert_cookies(tele_cookies)
             self.get(self.url_main)
+            metrics.inc('sync_decisions_total', branch='insert_storage')
 
     @exception_run_handler
-    def run(self) -> None:
-        """Run main logic."""
+    def start(self) -> None:
+        """Open office page with cookies from storage."""
         # if it will be removed, don't forget about implicitly wait
         self.get(self.url_main)
         self.insert_cookies(self.last_cookies)
         self.get(self.url_main)
+        profiler.mark('first page')
+
+    @exception_run_handler
+    def switch(self, hsh: Optional[str] = None) -> None:
+        """Take account into browser that is already opened on the office page.
+
+        Args:
+            hsh: user identification hash, the current one if not set.
+        """
+        if hsh is not None:
+            self.release_lease()
+            self.hash = hsh
+        self.storage_digest = None
+        self.last_cookies = self.get_storage_cookies()
+        self.need_to_set_telegram_cookies = False
+        self.was_logged_in = None
+        self.poller.reset()
+        self.insert_cookies(self.last_cookies)
+        self.get(self.url_main)
+
+    @exception_run_handler
+    @metrics.timed('tick_seconds')
+    def tick(self, tele_cookies: Optional[List] = None) -> bool:
+        """Check login state once and sync cookies.
+
+        Args:
+            tele_cookies: cookies from storage if they are already fetched.
+
+        Returns:
+            True if browser cookies were written to storage.
+        """
+        if self.cookie_events and not self.cookie_events.changed() and self.was_logged_in is not None:
+            # браузер не получал страниц и кук офиса с прошлой проверки, измениться могло только хранилище
+            if tele_cookies is None:
+                tele_cookies = self.get_storage_cookies()
+            if cookie_digest(tele_cookies) == cookie_digest(self.last_cookies):
+                metrics.inc('sync_decisions_total', branch='no_events')
+                if self.was_logged_in and self.keepalive:
+                    self.keep_alive()
+                return False
+        if self.batched_probe:
+            logged_in, browser_cookies = self.probe_browser()
+        else:
+            logged_in, browser_cookies = self.auth_complete(), None
+        if logged_in != self.was_logged_in:
+            self.poller.reset()
+        self.was_logged_in = logged_in
+        if logged_in:
+            published = self.logged_in(tele_cookies, browser_cookies)
+            if self.keepalive:
+                self.keep_alive()
+            return published
+        self.logged_out(tele_cookies)
+        return False
+
+    @exception_run_handler
+    def run(self) -> None:
+        """Run main logic."""
+        self.start()
+        profiler.report()
+        self.manager.watch()
         while True:
-            if self.auth_complete():
-                self.logged_in()
-            else:
-                self.logged_out()
-            time.sleep(1)
+            runtime_profiler.step()
+            self.tick()
+            # wakes up at once if another client has changed cookies
+            if self.manager.wait_for_change(timeout=self.poller.next_interval()):
+                self.poller.reset()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.quit()
@@ -236,6 +747,15 @@ class ResoBrowser(Firefox, metaclass=BrowserMeta):
         return False
 
 
+class ResoBrowser(ResoSession, Firefox, metaclass=BrowserMeta):
+    """Main Webdriver class."""
+
+
+profiler.mark('config')
+
+
 if __name__ == '__main__':
+    if METRICS_PORT:
+        serve(METRICS_PORT)
     with ResoBrowser() as driver:
         driver.run()
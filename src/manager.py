@@ -1,53 +1,378 @@
 """Pinned message manager module."""
 
-import json
-from functools import cached_property
-from typing import Dict, List
+import copy
+import threading
+import time
+from contextlib import suppress
+from http import HTTPStatus
+from typing import Callable, Dict, Generator, Iterable, List, NamedTuple, Optional, Tuple
 
 from telebot import TeleBot
 from telebot.apihelper import ApiTelegramException
 
-from src.exceptions import InvalidBotToken, InvalidHash, MessageTooLong
-from src.handlers import retry
-from src.settings import BOT_TOKEN, CHAT_ID, TELEGRAM_MSG_LIMIT, BASE_DIR
-import os
+from src.choiches import StorageFields
+from src.codec import JsonCodec, cookie_digest, decode, get_codec, stamp_digests
+from src.exceptions import InvalidBotToken, InvalidHash, MessageTooLong, TelegramError, WriteConflict
+from src.handlers import not_modified, retry
+from src.metrics import Instrumented, metrics
+from src.settings import (
+    BOT_TOKEN,
+    CACHE_TTL,
+    CHAT_ID,
+    STORAGE_CODEC,
+    TELEGRAM_MSG_LIMIT,
+    WRITE_ATTEMPTS,
+    WRITE_DEBOUNCE_LIMIT,
+)
+from src.storage import AccountsPlan, StorageBackend
 
-class MessageManager(object):
-    """Account manager class for manage pinned message data."""
 
-    @cached_property
-    def message_sample(self) -> Dict:
-        """Read json file with message sample.
+class PinnedCache(NamedTuple):
+    """Parsed pinned message snapshot."""
+
+    # (message_id, edit_date) of the pinned message
+    key: Tuple[int, Optional[int]]
+    text: str
+    data: Dict[str, List]
+    fetched_at: float
+
+
+def shard_chats(hashes: List[str], main: Dict) -> List[str]:
+    """Get shard chats that store some of the accounts.
+
+    Args:
+        hashes: user identification hashes.
+        main: main message content with the shard index.
+
+    Returns:
+        Chat ids without duplicates.
+    """
+    index = main.get(StorageFields.index, {})
+    return list({index[hsh] for hsh in hashes if hsh in index})
+
 
-            Returns:
-                JSON message sample.
-            """
-        with open(os.path.join(BASE_DIR, 'cookies_sample.json')) as f:
-            return json.loads(f.read())
+def messages_by_hash(hashes: List[str], main: Dict, shards: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Match accounts with the contents of messages that store them.
+
+    Args:
+        hashes: user identification hashes.
+        main: main message content with the shard index.
+        shards: shard message contents by chat, at least of shard_chats.
+
+    Returns:
+        Message content by hash.
+    """
+    index = main.get(StorageFields.index, {})
+    messages = {}
+    for hsh in hashes:
+        messages[hsh] = shards[index[hsh]] if hsh in index else main
+        if hsh not in messages[hsh]:
+            raise InvalidHash(InvalidHash.msg.format(hash=hsh))
+    return messages
+
+
+class MessageManager(StorageBackend):
+    """Account manager class for manage pinned message data."""
 
-    def __init__(self) -> None:
-        """Account manager initial method."""
-        self.bot = TeleBot(BOT_TOKEN)
+    def __init__(self, cache_ttl: float = CACHE_TTL, codec: Optional[JsonCodec] = None, write_delay: float = 0) -> None:
+        """Account manager initial method.
+
+        Args:
+            cache_ttl: seconds during which reads are served without requesting telegram.
+            codec: codec for writing pinned message, messages of any known codec are read.
+            write_delay: seconds cookie writes are queued to be merged into one edit, 0 writes at once.
+        """
+        super().__init__()
+        self.bot = Instrumented(TeleBot(BOT_TOKEN), metrics, 'telegram_call_seconds')
         self.chat = CHAT_ID
+        self.codec = codec or get_codec(STORAGE_CODEC)
+        self.cache_ttl = cache_ttl
+        # pinned messages by chat: the main chat holds the shard index, shards are other chats
+        self._cache: Dict[str, PinnedCache] = {}
+        self.write_delay = write_delay
+        # queued cookies and leases to renew with them by hash, monotonic time of the first change and of the write
+        self._queue_lock = threading.Condition()
+        self._pending: Dict[str, List] = {}
+        self._claims: Dict[str, Tuple[str, float]] = {}
+        self._since: Dict[str, float] = {}
+        self._due: Dict[str, float] = {}
+        self._flusher: Optional[threading.Thread] = None
+
+    def invalidate_cache(self, chat: Optional[str] = None) -> None:
+        """Drop cached pinned message, next read will request telegram.
+
+        Args:
+            chat: chat id, all chats if not set.
+        """
+        if chat is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(str(chat), None)
+
+    @retry
+    def refresh(self) -> None:
+        """Request main and already read shard messages whose cache has expired."""
+        for chat in {str(self.chat), *list(self._cache)}:
+            self._read_pinned(chat)
+
+    def _read_pinned(self, chat: Optional[str] = None, force: bool = False) -> Dict:
+        """Read pinned message content through the cache.
+
+        Message is parsed again only if its id, edit date or text has changed.
+
+        Args:
+            chat: chat id, the main chat if not set.
+            force: request telegram even if the cache is still fresh.
+
+        Returns:
+            Pinned message content as dictionary.
+        """
+        chat = str(chat or self.chat)
+        cache = self._cache.get(chat)
+        if not force and cache and time.monotonic() - cache.fetched_at < self.cache_ttl:
+            metrics.inc('storage_reads_total', source='cache')
+            return cache.data
+        metrics.inc('storage_reads_total', source='telegram')
+        try:
+            pinned = self.bot.get_chat(chat).pinned_message
+        except ApiTelegramException as error:
+            if error.error_code in {HTTPStatus.UNAUTHORIZED, HTTPStatus.NOT_FOUND}:
+                raise InvalidBotToken(InvalidBotToken.msg)
+            # rate limits and server errors are handled by retry
+            raise
+        if not pinned:
+            if chat == str(self.chat):
+                self.reinit()
+            else:
+                self._init_shard(chat)
+            pinned = self.bot.get_chat(chat).pinned_message
+        key = (pinned.message_id, pinned.edit_date)
+        # edit_date has a second resolution, so text comparison catches edits within one second
+        if cache and cache.key == key and cache.text == pinned.text:
+            data = cache.data
+        else:
+            data = decode(pinned.text)
+            self.notify_change()
+        self._cache[chat] = PinnedCache(key=key, text=pinned.text, data=data, fetched_at=time.monotonic())
+        return data
+
+    def _edit_pinned(self, chat: str, message_id: int, text: str) -> None:
+        """Write new text to pinned message and invalidate the cache.
+
+        Args:
+            chat: chat id.
+            message_id: pinned message id.
+            text: encoded message content.
+        """
+        self.invalidate_cache(chat)
+        try:
+            self.bot.edit_message_text(chat_id=chat, message_id=message_id, text=text)
+        except ApiTelegramException as error:
+            # в сообщении уже то, что мы хотели записать
+            if not not_modified('_edit_pinned', error):
+                raise
+
+    def _write_steps(
+        self,
+        mutate: Callable[[Dict], None],
+        base: Dict,
+    ) -> Generator[Optional[str], Optional[Dict], None]:
+        """Read-modify-write pinned message with optimistic concurrency, without I/O, so async manager shares it.
+
+        Every write increments the revision stored in the message. Telegram has no conditional edit,
+        so the message is read again just before editing: if its revision has moved since the base was read,
+        the change is applied on top of the fresh content. After editing the message is read back: if a concurrent
+        writer has overwritten our change, it is applied again, only touching the keys changed by mutate.
+
+        Args:
+            mutate: function that changes message content in place.
+            base: message content the change is made on.
+
+        Yields:
+            None to read the message ignoring the cache, the content must be sent back, or the text to edit it with.
+        """
+        def stamped(as_json: Dict) -> None:
+            mutate(as_json)
+            stamp_digests(as_json)
+
+        as_json = copy.deepcopy(base)
+        for _ in range(WRITE_ATTEMPTS):
+            revision = as_json.get(StorageFields.revision)
+            stamped(as_json)
+            current = yield None
+            if current.get(StorageFields.revision) != revision:
+                # сообщение изменили после чтения основы, изменение накладывается на свежее содержимое
+                metrics.inc('storage_write_rebases_total')
+                as_json = copy.deepcopy(current)
+                continue
+            as_json[StorageFields.revision] = (revision or 0) + 1
+            text = self.codec.encode(as_json)
+            if len(text) > TELEGRAM_MSG_LIMIT:
+                raise MessageTooLong(MessageTooLong.msg)
+            yield text
+            current = yield None
+            # a concurrent writer may have overwritten us even with the same revision, so compare content
+            as_json = copy.deepcopy(current)
+            stamped(as_json)
+            as_json[StorageFields.revision] = current.get(StorageFields.revision)
+            if self._normalize(as_json) == self._normalize(current):
+                return
+            metrics.inc('storage_write_conflicts_total')
+            # the read back content is the base of the next attempt
+            as_json = copy.deepcopy(current)
+        raise WriteConflict(WriteConflict.msg)
+
+    def _update(self, mutate: Callable[[Dict], None], chat: Optional[str] = None) -> None:
+        """Change pinned message, see _write_steps.
+
+        Args:
+            mutate: function that changes message content in place.
+            chat: chat id, the main chat if not set.
+        """
+        chat = str(chat or self.chat)
+        steps = self._write_steps(mutate, self._read_pinned(chat))
+        step = next(steps)
+        with suppress(StopIteration):
+            while True:
+                if step is None:
+                    step = steps.send(self._read_pinned(chat, force=True))
+                else:
+                    self._edit_pinned(chat, self._cache[chat].key[0], step)
+                    step = next(steps)
+
+    def _normalize(self, as_json: Dict) -> Dict:
+        """Drop everything the codec does not store, so contents can be compared.
+
+        Args:
+            as_json: storage content.
+
+        Returns:
+            Storage content as it would be read back.
+        """
+        return self.codec.decode(self.codec.encode(as_json))
+
+    def _chat_of(self, hsh: str) -> str:
+        """Get chat that stores account.
+
+        Args:
+            hsh: user identification hash.
+
+        Returns:
+            Shard chat id or the main chat id.
+        """
+        return str(self._read_pinned().get(StorageFields.index, {}).get(hsh, self.chat))
+
+    @retry
+    def get_accounts(self) -> List[str]:
+        """Get account hashes stored in pinned message and its shards.
+
+        Returns:
+            List with account hashes.
+        """
+        as_json = self._read_pinned()
+        accounts = [hsh for hsh in as_json if hsh not in StorageFields.service]
+        return accounts + list(as_json.get(StorageFields.index, {}))
+
+    def get_shards(self) -> List[str]:
+        """Get registered shard chats.
+
+        Returns:
+            List with shard chat ids.
+        """
+        return list(self._read_pinned(force=True).get(StorageFields.shards, []))
+
+    def _init_shard(self, chat: str) -> None:
+        """Send and pin empty storage message in shard chat.
+
+        Args:
+            chat: shard chat id.
+        """
+        msg = self.bot.send_message(chat_id=chat, text=self.codec.encode({}))
+        self.bot.pin_chat_message(chat_id=chat, message_id=msg.message_id)
+
+    @retry
+    def add_shard(self, chat: str) -> None:
+        """Register chat as a shard, the bot must be an admin there.
+
+        Args:
+            chat: shard chat id.
+        """
+        chat = str(chat)
+        if not self.bot.get_chat(chat).pinned_message:
+            self._init_shard(chat)
+
+        def register(as_json: Dict) -> None:
+            shards = as_json.setdefault(StorageFields.shards, [])
+            if chat not in shards:
+                shards.append(chat)
+
+        self._update(register)
+
+    def rebalance(self) -> Dict[str, int]:
+        """Spread accounts evenly over the main message and shards.
+
+        Every chat is written once: accounts are added to their new chats, then the index is
+        switched, then accounts are removed from old chats, so readers never lose an account.
+
+        Returns:
+            Dictionary with account count by chat id.
+        """
+        main = self._read_pinned(force=True)
+        index = main.get(StorageFields.index, {})
+        chats = [str(self.chat)] + list(main.get(StorageFields.shards, []))
+        placement = {hsh: str(self.chat) for hsh in main if hsh not in StorageFields.service}
+        placement.update({hsh: str(chat) for hsh, chat in index.items()})
+        target = {hsh: chats[num % len(chats)] for num, hsh in enumerate(sorted(placement))}
+        moves = {hsh: chat for hsh, chat in target.items() if placement[hsh] != chat}
+        cookies = {hsh: self._read_pinned(placement[hsh])[hsh] for hsh in moves}
+        for chat in set(moves.values()):
+            moved = {hsh: cookies[hsh] for hsh, target_chat in moves.items() if target_chat == chat}
+            self._update(lambda as_json, moved=moved: as_json.update(moved), chat)
+
+        def switch_index(as_json: Dict) -> None:
+            shards_index = {hsh: chat for hsh, chat in target.items() if chat != str(self.chat)}
+            for hsh in moves:
+                as_json.pop(hsh, None)
+            if shards_index:
+                as_json[StorageFields.index] = shards_index
+            else:
+                as_json.pop(StorageFields.index, None)
+
+        self._update(switch_index)
+        for chat in {placement[hsh] for hsh in moves} - {str(self.chat)}:
+            left = [hsh for hsh in moves if placement[hsh] == chat]
+            self._update(lambda as_json, left=left: [as_json.pop(hsh, None) for hsh in left], chat)
+        counts = {chat: 0 for chat in chats}
+        for chat in target.values():
+            counts[chat] += 1
+        return counts
 
     @retry
     def reinit(self) -> None:
         """Initialize or reinitialize pinned message."""
+        self.invalidate_cache()
         pinned = self.bot.get_chat(self.chat).pinned_message
         if pinned:
-            if pinned.text != json.dumps(self.message_sample):
-                self.bot.edit_message_text(
-                    chat_id=self.chat,
-                    message_id=pinned.message_id,
-                    text=json.dumps(self.message_sample),
-                )
+            as_json = decode(pinned.text)
+            accounts = {hsh: as_json[hsh] for hsh in as_json if hsh not in StorageFields.service}
+            if accounts != self.message_sample:
+                self._update(self._reset)
         else:
-            msg = self.bot.send_message(chat_id=self.chat, text=json.dumps(self.message_sample))
+            msg = self.bot.send_message(chat_id=self.chat, text=self.codec.encode(self.message_sample))
             self.bot.pin_chat_message(chat_id=self.chat, message_id=msg.message_id)
 
+    def _reset(self, as_json: Dict) -> None:
+        """Replace message content with message sample.
+
+        Args:
+            as_json: message content.
+        """
+        as_json.clear()
+        as_json.update(copy.deepcopy(self.message_sample))
+
     @retry
     def get_telegram_cookies(self, hsh: str) -> List:
-        """Get cookies by hash from pinned message.
+        """Get cookies by hash from pinned message or its shard.
 
         Args:
             hsh: user identification hash.
@@ -55,50 +380,441 @@ class MessageManager(object):
         Returns:
             Telegram cookies dictionary or None, if hash does not exist.
         """
+        queued = self._pending.get(hsh)
+        if queued is not None:
+            return queued
+        main = self._read_pinned()
+        chat = main.get(StorageFields.index, {}).get(hsh)
         try:
-            pinned = self.bot.get_chat(self.chat).pinned_message
-        except ApiTelegramException:
-            raise InvalidBotToken(InvalidBotToken.msg)
-        if not pinned:
-            self.reinit()
-        try:
-            return json.loads(pinned.text)[hsh]
+            return (self._read_pinned(chat) if chat else main)[hsh]
         except KeyError:
             raise InvalidHash(InvalidHash.msg.format(hash=hsh))
 
+    def _messages_of(self, hashes: Iterable[str]) -> Dict[str, Dict]:
+        """Get contents of messages that store accounts, reading the main message and every needed shard once.
+
+        Args:
+            hashes: user identification hashes.
+
+        Returns:
+            Message content by hash.
+        """
+        hashes = list(hashes)
+        main = self._read_pinned()
+        return messages_by_hash(hashes, main, {chat: self._read_pinned(chat) for chat in shard_chats(hashes, main)})
+
     @retry
+    def get_many_cookies(self, hashes: Iterable[str]) -> Dict[str, List]:
+        """Get cookies of several accounts reading the main message and every needed shard once.
+
+        Args:
+            hashes: user identification hashes.
+
+        Returns:
+            Dictionary with cookies by hash.
+        """
+        return {hsh: self._pending.get(hsh, message[hsh]) for hsh, message in self._messages_of(hashes).items()}
+
+    @retry
+    def get_moved_cookies(self, digests: Dict[str, Optional[str]]) -> Dict[str, Tuple[Optional[str], Optional[List]]]:
+        """Get current digests of accounts and cookies only of accounts whose digest has moved.
+
+        Digests are stored next to cookies, messages written without them are hashed on read.
+
+        Args:
+            digests: digests known to the caller by hash, None for unknown.
+
+        Returns:
+            Dictionary with (digest, cookies or None if digest is the known one) by hash.
+        """
+        moved = {}
+        for hsh, message in self._messages_of(digests).items():
+            queued = self._pending.get(hsh)
+            if queued is not None:
+                # queued cookies are read back before they are written
+                digest, cookies = cookie_digest(queued), queued
+            else:
+                cookies = message[hsh]
+                digest = message.get(StorageFields.digests, {}).get(hsh) or cookie_digest(cookies)
+            moved[hsh] = (digest, cookies if digest != digests[hsh] else None)
+        return moved
+
     def set_telegram_cookies(self, cookies: List, hsh: str) -> None:
-        """Set new cookies to pinned message by hash.
+        """Set new cookies to pinned message by hash, queue them if writes are delayed.
 
         Args:
             cookies: cookies dictionary that will be set.
             hsh: user identification hash.
         """
-        pinned = self.bot.get_chat(self.chat).pinned_message
-        as_json: Dict[str, List] = json.loads(pinned.text)
-        as_json[hsh] = cookies
-        self.bot.edit_message_text(chat_id=self.chat, message_id=pinned.message_id, text=json.dumps(as_json))
+        if self.write_delay:
+            self._queue(cookies, hsh)
+        else:
+            self._write_cookies(cookies, hsh)
+
+    @retry
+    def _write_cookies(self, cookies: List, hsh: str) -> None:
+        """Write cookies to the message of the account at once.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash.
+        """
+        self._update(lambda as_json: as_json.update({hsh: cookies}), self._chat_of(hsh))
+
+    def _queue(self, cookies: List, hsh: str, claim: Optional[Tuple[str, float]] = None) -> None:
+        """Queue cookies, the write is put off while the account keeps changing, but not longer than the limit.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash.
+            claim: (holder, ttl) of the lease renewed with the write, if cookies are published under it.
+        """
+        now = time.monotonic()
+        with self._queue_lock:
+            if hsh in self._pending:
+                metrics.inc('storage_coalesced_writes_total')
+            self._pending[hsh] = cookies
+            if claim:
+                self._claims[hsh] = claim
+            else:
+                self._claims.pop(hsh, None)
+            since = self._since.setdefault(hsh, now)
+            self._due[hsh] = min(now + self.write_delay, since + self.write_delay * WRITE_DEBOUNCE_LIMIT)
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop, name='storage-flusher', daemon=True)
+                self._flusher.start()
+            self._queue_lock.notify()
+
+    def _flush_loop(self) -> None:
+        """Write queued cookies when the first account is due, writes of other accounts go with it."""
+        while True:
+            with self._queue_lock:
+                while not self._due or min(self._due.values()) > time.monotonic():
+                    self._queue_lock.wait(min(self._due.values()) - time.monotonic() if self._due else None)
+            try:
+                self.flush_writes()
+            except TelegramError:
+                # failed cookies are queued again with a new delay
+                pass
+            except Exception:
+                # поток не должен умирать: иначе очередь больше никто не запишет
+                metrics.inc('storage_flusher_errors_total')
+
+    def flush_writes(self) -> None:
+        """Write all queued cookies now, one edit per message."""
+        with self._queue_lock:
+            pending, claims = self._pending, self._claims
+            self._pending, self._claims, self._since, self._due = {}, {}, {}, {}
+        if not pending:
+            return
+        try:
+            self._write_pending(pending, claims)
+        except (MessageTooLong, InvalidHash):
+            # повтор не поможет, такие записи выбрасываются
+            metrics.inc('storage_dropped_writes_total', len(pending))
+            raise
+        except Exception:
+            metrics.inc('storage_flush_errors_total')
+            with self._queue_lock:
+                # cookies queued meanwhile are newer
+                for hsh, cookies in pending.items():
+                    if hsh not in self._pending:
+                        self._pending[hsh] = cookies
+                        if hsh in claims:
+                            self._claims[hsh] = claims[hsh]
+                        self._since[hsh] = time.monotonic()
+                        self._due[hsh] = self._since[hsh] + self.write_delay
+            raise
+
+    @retry
+    def _write_pending(self, pending: Dict[str, List], claims: Dict[str, Tuple[str, float]]) -> None:
+        """Write queued cookies and renew their leases, the main message first.
+
+        Cookies published under a lease that another client has taken meanwhile are dropped.
+
+        Args:
+            pending: cookies by hash.
+            claims: (holder, ttl) of leases to renew by hash.
+        """
+        now = time.time()
+        main = str(self.chat)
+        chats: Dict[str, List[str]] = {}
+        for hsh in pending:
+            chats.setdefault(self._chat_of(hsh), []).append(hsh)
+
+        def allowed(leases: Dict, hsh: str) -> bool:
+            return hsh not in claims or leases.get(hsh, [None])[0] == claims[hsh][0]
+
+        def write_main(as_json: Dict) -> None:
+            if claims:
+                leases = {key: value for key, value in as_json.get(StorageFields.leases, {}).items() if value[1] > now}
+                for hsh, (holder, ttl) in claims.items():
+                    if leases.get(hsh, [holder])[0] == holder:
+                        leases[hsh] = [holder, round(now + ttl)]
+                as_json[StorageFields.leases] = leases
+            leases = as_json.get(StorageFields.leases, {})
+            as_json.update({hsh: pending[hsh] for hsh in chats.get(main, []) if allowed(leases, hsh)})
+
+        if claims or main in chats:
+            self._update(write_main)
+        leases = self._read_pinned().get(StorageFields.leases, {})
+        for chat, hashes in chats.items():
+            shard = {hsh: pending[hsh] for hsh in hashes if allowed(leases, hsh)}
+            if chat != main and shard:
+                self._update(lambda as_json: as_json.update(shard), chat)
+        metrics.inc('storage_flushed_cookies_total', len(pending))
 
     def add_account(self, hsh: str) -> None:
-        """Add new account to pinned message.
+        """Add new account to the main message or the first shard with free space.
 
         Args:
             hsh: user identification hash.
         """
-        pinned = self.bot.get_chat(self.chat).pinned_message
-        as_json = json.loads(pinned.text)
-        as_json[hsh] = self.message_sample['test']
-        if len(str(as_json)) >= TELEGRAM_MSG_LIMIT:
-            raise MessageTooLong(MessageTooLong.msg)
-        self.bot.edit_message_text(chat_id=self.chat, message_id=pinned.message_id, text=json.dumps(as_json))
+        cookies = copy.deepcopy(self.message_sample['test'])
+        chats = [str(self.chat)] + self.get_shards()
+        for chat in chats:
+            try:
+                self._update(lambda as_json: as_json.update({hsh: cookies}), chat)
+            except MessageTooLong:
+                continue
+            if chat != str(self.chat):
+                self._update(lambda as_json: as_json.setdefault(StorageFields.index, {}).update({hsh: chat}))
+            return
+        raise MessageTooLong(MessageTooLong.msg)
+
+    @retry
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew lease kept in the main message.
+
+        The message is edited only to take a free or ended lease, or to renew our lease after half of it is used,
+        so holding a lease costs two edits per ttl. Ended leases of others are dropped on the way.
+
+        Args:
+            name: lease name, like account hash.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if holder has the lease.
+        """
+        now = time.time()
+        lease = self._read_pinned().get(StorageFields.leases, {}).get(name)
+        if lease and lease[0] != holder and lease[1] > now:
+            return False
+        if lease and lease[0] == holder and lease[1] - now > ttl / 2:
+            return True
+
+        expires_at = round(now + ttl)
+
+        def take(as_json: Dict) -> None:
+            # the same result when applied again after a concurrent write, so it is not taken for a conflict
+            leases = {key: value for key, value in as_json.get(StorageFields.leases, {}).items() if value[1] > now}
+            current = leases.get(name)
+            if not current or current[0] == holder:
+                leases[name] = [holder, expires_at]
+            as_json[StorageFields.leases] = leases
+
+        self._update(take)
+        return self._read_pinned().get(StorageFields.leases, {}).get(name, [None])[0] == holder
+
+    def publish_cookies(self, cookies: List, hsh: str, holder: str, ttl: float) -> bool:
+        """Set cookies only if holder has or takes the account lease.
+
+        Lease and cookies of an account in the main message are written with one edit,
+        accounts of shards need one more edit of the main message for the lease.
+        Delayed writes renew the lease when they are flushed.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash, it is also the lease name.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if cookies were written, False if another client holds the lease.
+        """
+        if self.write_delay:
+            lease = self._read_pinned().get(StorageFields.leases, {}).get(hsh)
+            if lease and lease[0] != holder and lease[1] > time.time():
+                return False
+            # the lease is renewed with the queued write, if another client takes it first the cookies are dropped
+            self._queue(cookies, hsh, (holder, ttl))
+            return True
+        if self._chat_of(hsh) != str(self.chat):
+            return super().publish_cookies(cookies, hsh, holder, ttl)
+        return self._publish_with_lease(cookies, hsh, holder, ttl)
+
+    @retry
+    def _publish_with_lease(self, cookies: List, hsh: str, holder: str, ttl: float) -> bool:
+        """Renew lease and set cookies of an account in the main message with one edit.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash, it is also the lease name.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if cookies were written.
+        """
+        now = time.time()
+        lease = self._read_pinned().get(StorageFields.leases, {}).get(hsh)
+        if lease and lease[0] != holder and lease[1] > now:
+            return False
+        expires_at = round(now + ttl)
+
+        def publish(as_json: Dict) -> None:
+            leases = {key: value for key, value in as_json.get(StorageFields.leases, {}).items() if value[1] > now}
+            current = leases.get(hsh)
+            if not current or current[0] == holder:
+                leases[hsh] = [holder, expires_at]
+                as_json[hsh] = cookies
+            as_json[StorageFields.leases] = leases
+
+        self._update(publish)
+        return self._read_pinned().get(StorageFields.leases, {}).get(hsh, [None])[0] == holder
+
+    @retry
+    def release_lease(self, name: str, holder: str) -> None:
+        """Give lease back.
+
+        Args:
+            name: lease name.
+            holder: unique id of the client.
+        """
+        lease = self._read_pinned().get(StorageFields.leases, {}).get(name)
+        if not lease or lease[0] != holder:
+            return
+
+        def give_back(as_json: Dict) -> None:
+            leases = as_json.get(StorageFields.leases, {})
+            if leases.get(name, [None])[0] == holder:
+                del leases[name]
+            if not leases:
+                as_json.pop(StorageFields.leases, None)
+
+        self._update(give_back)
+
+    def _encoded_size(self, as_json: Dict) -> int:
+        """Get length of the message that would be written.
+
+        Args:
+            as_json: message content.
+
+        Returns:
+            Text length.
+        """
+        as_json = copy.deepcopy(as_json)
+        stamp_digests(as_json)
+        as_json[StorageFields.revision] = as_json.get(StorageFields.revision, 0) + 1
+        return len(self.codec.encode(as_json))
+
+    def apply_accounts(
+        self,
+        add: Iterable[str] = (),
+        remove: Iterable[str] = (),
+        dry_run: bool = False,
+    ) -> AccountsPlan:
+        """Add and remove many accounts with one write per touched chat.
+
+        New accounts take free space of the main message first, then of shards. Sizes of all messages are
+        checked before the first write, so nothing is changed if accounts do not fit.
+
+        Args:
+            add: hashes of new accounts, existing ones are skipped.
+            remove: hashes of accounts to remove, unknown ones are skipped.
+            dry_run: only make the plan, storage is not changed.
+
+        Returns:
+            Account changes.
+        """
+        main_chat = str(self.chat)
+        main = self._read_pinned(force=True)
+        chats = [main_chat] + [str(chat) for chat in main.get(StorageFields.shards, [])]
+        contents = {
+            chat: copy.deepcopy(main if chat == main_chat else self._read_pinned(chat, force=True)) for chat in chats
+        }
+        index = contents[main_chat].setdefault(StorageFields.index, {})
+        placement = {hsh: main_chat for hsh in main if hsh not in StorageFields.service}
+        placement.update({hsh: str(chat) for hsh, chat in index.items()})
+        remove = list(dict.fromkeys(remove))
+        removed = [hsh for hsh in remove if hsh in placement]
+        for hsh in removed:
+            contents[placement[hsh]].pop(hsh, None)
+            index.pop(hsh, None)
+        added: Dict[str, Optional[str]] = {}
+        cookies = self.message_sample['test']
+        for hsh in dict.fromkeys(add):
+            if hsh in placement and hsh not in removed:
+                continue
+            for chat in chats:
+                contents[chat][hsh] = copy.deepcopy(cookies)
+                if chat != main_chat:
+                    index[hsh] = chat
+                if all(self._encoded_size(contents[touched]) <= TELEGRAM_MSG_LIMIT for touched in {chat, main_chat}):
+                    added[hsh] = chat
+                    break
+                contents[chat].pop(hsh)
+                index.pop(hsh, None)
+            else:
+                raise MessageTooLong(MessageTooLong.msg)
+        if not index:
+            contents[main_chat].pop(StorageFields.index)
+        touched = {placement[hsh] for hsh in removed} | set(added.values())
+        if added.keys() & set(index) or any(placement[hsh] != main_chat for hsh in removed):
+            touched.add(main_chat)
+        plan = AccountsPlan(
+            added=added,
+            removed=removed,
+            existing=[hsh for hsh in dict.fromkeys(add) if hsh in placement and hsh not in removed],
+            missing=[hsh for hsh in remove if hsh not in placement],
+            sizes={chat: self._encoded_size(contents[chat]) for chat in chats if chat in touched},
+        )
+        if dry_run:
+            return plan
+
+        def change(chat: str) -> Callable[[Dict], None]:
+            def mutate(as_json: Dict) -> None:
+                for hsh in removed:
+                    if placement[hsh] == chat:
+                        as_json.pop(hsh, None)
+                for hsh, target in added.items():
+                    if target == chat:
+                        as_json[hsh] = copy.deepcopy(cookies)
+                if chat == main_chat:
+                    self._unindex(as_json, removed)
+                    shard_index = {hsh: target for hsh, target in added.items() if target != main_chat}
+                    if shard_index:
+                        as_json.setdefault(StorageFields.index, {}).update(shard_index)
+            return mutate
+
+        # shards first, so the index never points to a chat without the account
+        for chat in sorted(touched - {main_chat}):
+            self._update(change(chat), chat)
+        if main_chat in touched:
+            self._update(change(main_chat))
+        return plan
 
     def remove_account(self, hsh: str) -> None:
-        """Remove account from pinned message.
+        """Remove account from pinned message or its shard.
 
         Args:
             hsh: user identification hash.
         """
-        pinned = self.bot.get_chat(self.chat).pinned_message
-        as_json = json.loads(pinned.text)
-        as_json.pop(hsh)
-        self.bot.edit_message_text(chat_id=self.chat, message_id=pinned.message_id, text=json.dumps(as_json))
+        chat = self._chat_of(hsh)
+        self._update(lambda as_json: as_json.pop(hsh, None), chat)
+        if chat != str(self.chat):
+            self._update(lambda as_json: self._unindex(as_json, [hsh]))
+
+    def _unindex(self, as_json: Dict, hashes: List[str]) -> None:
+        """Remove accounts from shard index.
+
+        Args:
+            as_json: main message content.
+            hashes: account hashes.
+        """
+        index = as_json.get(StorageFields.index, {})
+        for hsh in hashes:
+            index.pop(hsh, None)
+        if not index:
+            as_json.pop(StorageFields.index, None)
@@ -1,19 +1,116 @@
-"""Console for manage pinned message."""
+"""Console for manage pinned message.
 
+Without arguments the console is interactive, bulk commands can be run from scripts:
+    python -m src.manager_console import accounts.csv --dry-run
+    python -m src.manager_console remove accounts.json
+    python -m src.manager_console export accounts.csv
+"""
+
+import argparse
+import csv
 import json
+import os
+import sys
 from http import HTTPStatus
-from typing import List
+from typing import List, Optional
 
 from telebot.apihelper import ApiTelegramException
 
-from src.exceptions import MessageTooLong
+from src.choiches import StorageFields
+from src.config import IniOptions
+from src.exceptions import AccountsFileError, MessageTooLong, NoIniFileError, NoIniOptionsError, ResoException
 from src.manager import MessageManager
+from src.storage import AccountsPlan, LazyStorage, StorageBackend
+
+# first cell of a csv header row
+CSV_HEADERS = frozenset({'account', 'hash', 'name'})
+
+
+def console_storage() -> StorageBackend:
+    """Create storage chosen in reso.ini like the sessions do, Telegram storage if reso.ini has no options.
+
+    Returns:
+        Shared storage without the local cookie cache, accounts are changed only in the shared one.
+    """
+    try:
+        options = IniOptions.get_ini_options()
+    except (NoIniFileError, NoIniOptionsError):
+        return MessageManager()
+    return IniOptions.get_remote_storage(options)
+
+
+def read_accounts(path: str) -> List[str]:
+    """Read account names from json list or object keys, or from the first csv column.
+
+    Args:
+        path: file path, format is taken from extension.
+
+    Returns:
+        Account names without duplicates in file order.
+    """
+    try:
+        with open(path, encoding='UTF-8', newline='') as accounts_file:
+            if path.lower().endswith('.json'):
+                names = json.load(accounts_file)
+                if not isinstance(names, (list, dict)) or not all(isinstance(name, str) for name in names):
+                    raise ValueError('нужен список названий')
+            else:
+                names = [row[0] for row in csv.reader(accounts_file) if row]
+                if names and names[0].strip().lower() in CSV_HEADERS:
+                    names = names[1:]
+    except (OSError, ValueError) as error:
+        raise AccountsFileError(AccountsFileError.msg.format(path=path, error=error))
+    names = [name.strip() for name in names if name.strip()]
+    service = [name for name in names if name in StorageFields.service]
+    if service:
+        raise AccountsFileError(AccountsFileError.msg.format(path=path, error='служебные ключи ' + ', '.join(service)))
+    return list(dict.fromkeys(names))
+
+
+def write_accounts(path: str, accounts: List[str]) -> None:
+    """Write account names as json list or csv column.
+
+    Args:
+        path: file path, format is taken from extension.
+        accounts: account names.
+    """
+    with open(path, 'w', encoding='UTF-8', newline='') as accounts_file:
+        if path.lower().endswith('.json'):
+            json.dump(accounts, accounts_file, ensure_ascii=False, indent=2)
+        else:
+            writer = csv.writer(accounts_file)
+            writer.writerow(['account'])
+            writer.writerows([hsh] for hsh in accounts)
+
+
+def format_plan(plan: AccountsPlan, dry_run: bool) -> str:
+    """Make bulk change readable.
+
+    Args:
+        plan: account changes.
+        dry_run: whether changes were only planned.
+
+    Returns:
+        Report text.
+    """
+    lines = ['Предпросмотр, сообщение не изменено:' if dry_run else 'Изменения применены:']
+    for hsh, chat in plan.added.items():
+        lines.append('+ {hsh} (чат {chat})'.format(hsh=hsh, chat=chat))
+    lines.extend('- {hsh}'.format(hsh=hsh) for hsh in plan.removed)
+    if plan.existing:
+        lines.append('Уже есть: {0}'.format(', '.join(plan.existing)))
+    if plan.missing:
+        lines.append('Не найдены: {0}'.format(', '.join(plan.missing)))
+    for chat, size in plan.sizes.items():
+        lines.append('Чат {chat}: {size} символов'.format(chat=chat, size=size))
+    return '\n'.join(lines)
 
 
 class Console(object):
     """Pinned message console class."""
 
-    manager = MessageManager()
+    # хранилище создается при первом обращении, импорт консоли никуда не подключается
+    manager = LazyStorage(console_storage)
     accounts: List
 
     @classmethod
@@ -45,18 +142,60 @@ class Console(object):
 
         elif command == '3':
             cls.manager.reinit()
-            cls.accounts = list(
-                json.loads(cls.manager.bot.get_chat(chat_id=cls.manager.chat).pinned_message.text).keys(),
-            )
+            cls.accounts = cls.manager.get_accounts()
             print('Сообщение сброшено к изначальным настройкам.')
 
+        elif command in {'4', '5'} and not isinstance(cls.manager, MessageManager):
+            print('Шарды есть только у хранилища в Telegram.')
+
+        elif command == '4':
+            chat = input('Айди чата для нового шарда (бот должен быть в нем администратором): ')
+            cls.manager.add_shard(chat)
+            print('Шард {chat} добавлен.'.format(chat=chat))
+
+        elif command == '5':
+            counts = cls.manager.rebalance()
+            for chat, count in counts.items():
+                print('Чат {chat}: {count} аккаунтов'.format(chat=chat, count=count))
+
+        elif command in {'6', '7'}:
+            path = input('Файл со списком аккаунтов (.csv или .json): ')
+            try:
+                names = read_accounts(path)
+            except AccountsFileError as error:
+                print(error)
+                return
+            changes = {'add': names} if command == '6' else {'remove': names}
+            try:
+                print(format_plan(cls.manager.apply_accounts(dry_run=True, **changes), dry_run=True))
+            except MessageTooLong:
+                print(MessageTooLong.msg)
+                return
+            if input('1 - Применить\n2 - Отмена\n') == '1':
+                cls._apply(cls.manager.apply_accounts(**changes))
+
+        elif command == '8':
+            path = input('Файл для списка аккаунтов (.csv или .json): ')
+            write_accounts(path, cls.accounts)
+            print('Аккаунты сохранены в {path}.'.format(path=os.path.abspath(path)))
+
+    @classmethod
+    def _apply(cls, plan: AccountsPlan) -> None:
+        """Print applied changes and update account list without reading the message again.
+
+        Args:
+            plan: applied account changes.
+        """
+        print(format_plan(plan, dry_run=False))
+        cls.accounts = [hsh for hsh in cls.accounts if hsh not in plan.removed] + list(plan.added)
+
     @classmethod
     def main(cls) -> None:
         """Console execution."""
         try:
-            cls.accounts = list(
-                json.loads(cls.manager.bot.get_chat(chat_id=cls.manager.chat).pinned_message.text).keys(),
-            )
+            cls.accounts = cls.manager.get_accounts()
+        except ResoException as error:
+            exit(str(error))
         except ApiTelegramException as error:
             cls._initial_error_handler(error.error_code)
         except AttributeError:
@@ -64,9 +203,14 @@ class Console(object):
         except Exception:
             cls._initial_error_handler(HTTPStatus.UNAUTHORIZED)
         command = ''
-        menu = '\nКоманды:\n1 - Добавить новый аккаунт\n2 - Удалить существующий аккаунт\n3 - Сбросить сообщение к изначальным настройкам\n4 - Выход'
+        menu = (
+            '\nКоманды:\n1 - Добавить новый аккаунт\n2 - Удалить существующий аккаунт\n'
+            '3 - Сбросить сообщение к изначальным настройкам\n4 - Добавить шард\n'
+            '5 - Перераспределить аккаунты по шардам\n6 - Добавить аккаунты из файла\n'
+            '7 - Удалить аккаунты из файла\n8 - Сохранить список аккаунтов в файл\n9 - Выход'
+        )
 
-        while command != '4':
+        while command != '9':
             cls._available_accounts_print()
             print(menu)
             command = input('Ввод: ')
@@ -98,14 +242,45 @@ class Console(object):
             command = input('1 - Да\n2 - Выход\n')
             if command == '1':
                 cls.manager.reinit()
-                cls.accounts = list(
-                    json.loads(cls.manager.bot.get_chat(chat_id=cls.manager.chat).pinned_message.text).keys(),
-                )
+                cls.accounts = cls.manager.get_accounts()
             else:
                 exit(0)
 
 
+def run_command(argv: Optional[List[str]] = None) -> int:
+    """Run bulk command without questions.
+
+    Args:
+        argv: command line arguments, sys.argv if not set.
+
+    Returns:
+        Exit code.
+    """
+    parser = argparse.ArgumentParser(description='Управление аккаунтами в закрепленном сообщении.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('import', 'добавить аккаунты из файла'), ('remove', 'удалить аккаунты из файла')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('path', help='.csv с названиями в первой колонке или .json со списком')
+        command.add_argument('--dry-run', action='store_true', help='только показать изменения')
+    commands.add_parser('export', help='сохранить список аккаунтов в файл').add_argument('path')
+    args = parser.parse_args(argv)
+    manager = Console.manager
+    try:
+        if args.command == 'export':
+            write_accounts(args.path, manager.get_accounts())
+            return 0
+        names = read_accounts(args.path)
+        changes = {'add': names} if args.command == 'import' else {'remove': names}
+        print(format_plan(manager.apply_accounts(dry_run=args.dry_run, **changes), args.dry_run))
+    except ResoException as error:
+        print(error)
+        return 1
+    return 0
+
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        exit(run_command())
     try:
         Console.main()
     except KeyboardInterrupt:
@@ -0,0 +1,352 @@
+"""Counters, timers and runtime profiling of the sync loop with a localhost endpoint."""
+
+import cProfile
+import inspect
+import io
+import json
+import math
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from src.handlers import retry_snapshot
+from src.settings import BASE_DIR
+
+# metric name and sorted label pairs
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Metrics(object):
+    """Thread-safe registry of counters and timers."""
+
+    def __init__(self, prefix: str = 'reso') -> None:
+        """Create empty registry.
+
+        Args:
+            prefix: prefix of every exported metric name.
+        """
+        self.prefix = prefix
+        self.counters: Dict[MetricKey, float] = {}
+        # count, sum and max of observed seconds
+        self.timers: Dict[MetricKey, List[float]] = {}
+        self.collectors: List[Callable[[], List[Tuple[str, Dict[str, str], float]]]] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name: str, labels: Dict[str, Any]) -> MetricKey:
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        """Increase counter.
+
+        Args:
+            name: counter name.
+            amount: value to add.
+            labels: counter labels.
+        """
+        key = self.key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        """Add duration to timer.
+
+        Args:
+            name: timer name.
+            seconds: measured duration.
+            labels: timer labels.
+        """
+        key = self.key(name, labels)
+        with self._lock:
+            timer = self.timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """Measure duration of the block, failed blocks are counted too.
+
+        Args:
+            name: timer name.
+            labels: timer labels.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels: Any) -> Callable:
+        """Decorator that measures duration of every call.
+
+        Args:
+            name: timer name.
+            labels: timer labels.
+
+        Returns:
+            Decorator.
+        """
+
+        def decorator(fn: Callable) -> Callable:
+            @wraps(fn)
+            def inner(*args: Any, **kwargs: Any) -> Any:
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return inner
+        return decorator
+
+    def collector(self, fn: Callable[[], List[Tuple[str, Dict[str, str], float]]]) -> Callable:
+        """Register function that returns counters kept elsewhere as (name, labels, value).
+
+        Args:
+            fn: collector function.
+
+        Returns:
+            The same function, so it can be used as decorator.
+        """
+        self.collectors.append(fn)
+        return fn
+
+    def samples(self) -> Tuple[List[Tuple[str, Dict[str, str], float]], Dict[MetricKey, List[float]]]:
+        """Get consistent copy of all counters and timers.
+
+        Returns:
+            Counters as (name, labels, value) and timers by key.
+        """
+        with self._lock:
+            counters = [(name, dict(labels), value) for (name, labels), value in self.counters.items()]
+            timers = {key: list(timer) for key, timer in self.timers.items()}
+        for collect in self.collectors:
+            counters.extend(collect())
+        return counters, timers
+
+    def to_json(self) -> str:
+        """Export metrics as json.
+
+        Returns:
+            Json text with counters and timers.
+        """
+        counters, timers = self.samples()
+        return json.dumps({
+            'counters': [{'name': name, 'labels': labels, 'value': value} for name, labels, value in counters],
+            'timers': [
+                {'name': name, 'labels': dict(labels), 'count': count, 'sum': total, 'max': longest}
+                for (name, labels), (count, total, longest) in timers.items()
+            ],
+        }, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Export metrics in Prometheus text format, timers are summaries with max gauges.
+
+        Returns:
+            Metrics text.
+        """
+        counters, timers = self.samples()
+        lines = []
+        typed = set()
+
+        def line(name: str, kind: str, labels: Dict[str, str], value: float) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {name} {kind}'.format(name=name, kind=kind))
+            text = ','.join('{0}="{1}"'.format(label, value.replace('"', '\\"')) for label, value in labels.items())
+            lines.append('{name}{{{labels}}} {value}'.format(name=name, labels=text, value=value))
+
+        for name, labels, value in sorted(counters, key=lambda sample: sample[0]):
+            line('{0}_{1}'.format(self.prefix, name), 'counter', labels, value)
+        for (name, labels), (count, total, longest) in sorted(timers.items()):
+            full_name = '{0}_{1}'.format(self.prefix, name)
+            line(full_name + '_count', 'counter', dict(labels), count)
+            line(full_name + '_sum', 'counter', dict(labels), total)
+            line(full_name + '_max', 'gauge', dict(labels), longest)
+        return '\n'.join(lines) + '\n'
+
+
+class Instrumented(object):
+    """Proxy that times every method call of the wrapped object, coroutines are timed until they are awaited."""
+
+    def __init__(self, target: Any, registry: Metrics, name: str) -> None:
+        """Wrap object.
+
+        Args:
+            target: object with methods to measure.
+            registry: metrics registry.
+            name: timer name, method name is the label.
+        """
+        self._target = target
+        self._registry = registry
+        self._name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        value = getattr(self._target, attr)
+        if not callable(value):
+            return value
+
+        @wraps(value)
+        def inner(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                result = value(*args, **kwargs)
+            except Exception:
+                self._finish(attr, started, failed=True)
+                raise
+            if inspect.isawaitable(result):
+                return self._awaited(attr, result, started)
+            self._finish(attr, started)
+            return result
+        return inner
+
+    async def _awaited(self, attr: str, awaitable: Awaitable, started: float) -> Any:
+        try:
+            result = await awaitable
+        except Exception:
+            self._finish(attr, started, failed=True)
+            raise
+        self._finish(attr, started)
+        return result
+
+    def _finish(self, attr: str, started: float, failed: bool = False) -> None:
+        self._registry.observe(self._name, time.perf_counter() - started, method=attr)
+        if failed:
+            self._registry.inc(self._name.replace('_seconds', '_errors_total'), method=attr)
+
+
+class RuntimeProfiler(object):
+    """cProfile that is switched on for a while by request from another thread.
+
+    cProfile sees only the thread that enables it, so the sync loop calls step on every iteration.
+    """
+
+    def __init__(self, folder: str = BASE_DIR) -> None:
+        """Create idle profiler.
+
+        Args:
+            folder: folder for .prof files.
+        """
+        self.folder = folder
+        self.report: Optional[str] = None
+        self._requested: Optional[float] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._until = 0.0
+        self._lock = threading.Lock()
+
+    def request(self, seconds: float) -> None:
+        """Ask sync loop to profile itself.
+
+        Args:
+            seconds: profiling duration.
+        """
+        with self._lock:
+            self._requested = seconds
+
+    def step(self) -> None:
+        """Start or finish requested profiling, called by the sync loop thread."""
+        with self._lock:
+            requested, self._requested = self._requested, None
+        if requested and self._profile is None:
+            self._profile = cProfile.Profile()
+            self._until = time.monotonic() + requested
+            self._profile.enable()
+        elif self._profile is not None and time.monotonic() >= self._until:
+            self._profile.disable()
+            path = os.path.join(self.folder, 'profile-{0}.prof'.format(int(time.time())))
+            self._profile.dump_stats(path)
+            text = io.StringIO()
+            pstats.Stats(self._profile, stream=text).sort_stats('cumulative').print_stats(30)
+            self.report = text.getvalue()
+            self._profile = None
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Routes: /metrics, /metrics.json, /profile?seconds=N to start profiling, /profile for its report."""
+
+    registry: Metrics
+    profiler: RuntimeProfiler
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            self.reply(self.registry.to_prometheus(), 'text/plain; version=0.0.4')
+        elif url.path == '/metrics.json':
+            self.reply(self.registry.to_json(), 'application/json')
+        elif url.path == '/profile':
+            seconds = parse_qs(url.query).get('seconds')
+            if seconds:
+                try:
+                    duration = float(seconds[0])
+                except ValueError:
+                    duration = -1
+                if not 0 < duration < math.inf:
+                    self.reply('seconds must be a positive number\n', 'text/plain', HTTPStatus.BAD_REQUEST)
+                    return
+                self.profiler.request(duration)
+                self.reply('profiling for {0} s\n'.format(duration), 'text/plain', HTTPStatus.ACCEPTED)
+            elif self.profiler.report:
+                self.reply(self.profiler.report, 'text/plain')
+            else:
+                self.reply('no profile yet\n', 'text/plain', HTTPStatus.NOT_FOUND)
+        else:
+            self.reply('not found\n', 'text/plain', HTTPStatus.NOT_FOUND)
+
+    def reply(self, text: str, content_type: str, status: HTTPStatus = HTTPStatus.OK) -> None:
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        # requests are not printed into the console of the program
+        pass
+
+
+def serve(
+    port: int,
+    registry: Optional[Metrics] = None,
+    profiler: Optional[RuntimeProfiler] = None,
+) -> ThreadingHTTPServer:
+    """Start metrics endpoint on localhost in background thread.
+
+    Args:
+        port: port number, 0 picks a free one.
+        registry: metrics registry, the global one by default.
+        profiler: runtime profiler, the global one by default.
+
+    Returns:
+        Running server, server_address holds the port.
+    """
+    handler = type('MetricsHandler', (MetricsHandler,), {
+        'registry': registry or metrics,
+        'profiler': profiler or runtime_profiler,
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+metrics = Metrics()
+runtime_profiler = RuntimeProfiler()
+
+
+@metrics.collector
+def collect_retry_stats() -> List[Tuple[str, Dict[str, str], float]]:
+    """Export retry decorator counters by function.
+
+    Returns:
+        Counters as (name, labels, value).
+    """
+    samples = []
+    for key, value in retry_snapshot().items():
+        if ':' in key:
+            counter, function = key.split(':', 1)
+            samples.append(('telegram_retry_{0}'.format(counter), {'function': function}, value))
+    return samples
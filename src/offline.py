@@ -0,0 +1,334 @@
+"""Local cookie cache that keeps sessions working while the shared storage is unreachable."""
+
+import copy
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.codec import cookie_digest
+from src.exceptions import LocalStorageError, TelegramUnavailable, WriteConflict
+from src.metrics import metrics
+from src.settings import BASE_DIR
+from src.storage import AccountsPlan, StorageBackend
+
+CACHE_PATH = os.path.join(BASE_DIR, 'cookies-cache.json')
+# errors after which the storage is treated as unreachable, other errors are real and raised
+OFFLINE_ERRORS = (TelegramUnavailable, WriteConflict, LocalStorageError)
+
+
+class CachedStorage(StorageBackend):
+    """Shared storage with cookies mirrored to a local file and writes queued while it is unreachable.
+
+    Cached accounts are served from the file until the background watcher reaches the shared storage,
+    so start does not wait for telegram. Queued writes are pushed when the storage is reachable again,
+    unless another client has changed the account meanwhile.
+    """
+
+    def __init__(self, remote: StorageBackend, path: str = CACHE_PATH) -> None:
+        """Load cache file.
+
+        Args:
+            remote: shared storage.
+            path: cache file path.
+        """
+        super().__init__()
+        self.remote = remote
+        self.path = path
+        self.online = False
+        self._lock = threading.RLock()
+        state = self._load()
+        # last known cookies, remote digests they are based on, and writes not pushed yet
+        self.cookies: Dict[str, List] = state.get('cookies', {})
+        self.digests: Dict[str, Optional[str]] = state.get('digests', {})
+        self.pending: Dict[str, List] = state.get('pending', {})
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.path, encoding='UTF-8') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self) -> None:
+        """Write cache file atomically, a crash leaves the previous version."""
+        state = {'cookies': self.cookies, 'digests': self.digests, 'pending': self.pending}
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='UTF-8') as cache_file:
+                json.dump(state, cache_file)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # cache is a convenience, the session keeps working without it
+            pass
+
+    def _go_offline(self) -> None:
+        if self.online:
+            metrics.inc('storage_offline_total')
+        self.online = False
+
+    def _remember(self, moved: Dict[str, Tuple[Optional[str], Optional[List]]]) -> None:
+        """Put fresh remote entries into the cache, accounts with queued writes keep local cookies.
+
+        Args:
+            moved: result of remote get_moved_cookies.
+        """
+        changed = False
+        with self._lock:
+            for hsh, (digest, cookies) in moved.items():
+                if cookies is None or hsh in self.pending:
+                    continue
+                changed = changed or self.digests.get(hsh) != digest or hsh not in self.cookies
+                self.cookies[hsh] = cookies
+                self.digests[hsh] = digest
+            if changed:
+                self._save()
+
+    def get_moved_cookies(self, digests: Dict[str, Optional[str]]) -> Dict[str, Tuple[Optional[str], Optional[List]]]:
+        """Get moved cookies from shared storage, from the cache while it is unreachable.
+
+        Args:
+            digests: digests known to the caller by hash, None for unknown.
+
+        Returns:
+            Dictionary with (digest, cookies or None if digest is the known one) by hash.
+        """
+        if self.online or not set(digests) <= set(self.cookies):
+            try:
+                moved = self.remote.get_moved_cookies({hsh: self.digests.get(hsh) for hsh in digests})
+            except OFFLINE_ERRORS:
+                if not set(digests) <= set(self.cookies):
+                    raise
+                self._go_offline()
+            else:
+                self.online = True
+                self._remember(moved)
+        with self._lock:
+            local = {hsh: copy.deepcopy(self.cookies[hsh]) for hsh in digests}
+        result = {}
+        for hsh, cookies in local.items():
+            digest = cookie_digest(cookies)
+            result[hsh] = (digest, cookies if digest != digests[hsh] else None)
+        return result
+
+    def get_many_cookies(self, hashes: Iterable[str]) -> Dict[str, List]:
+        """Get cookies of several accounts.
+
+        Args:
+            hashes: user identification hashes.
+
+        Returns:
+            Dictionary with cookies by hash.
+        """
+        return {hsh: cookies for hsh, (_, cookies) in self.get_moved_cookies(dict.fromkeys(hashes)).items()}
+
+    def get_telegram_cookies(self, hsh: str) -> List:
+        """Get cookies by hash.
+
+        Args:
+            hsh: user identification hash.
+
+        Returns:
+            Cookies list.
+        """
+        return self.get_many_cookies([hsh])[hsh]
+
+    def set_telegram_cookies(self, cookies: List, hsh: str) -> None:
+        """Set cookies in shared storage, queue them if it is unreachable.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash.
+        """
+        with self._lock:
+            self.cookies[hsh] = copy.deepcopy(cookies)
+            direct = self.online and not self.pending
+        # the lock is not held during the request, other sessions keep reading the cache
+        if direct:
+            try:
+                self.remote.set_telegram_cookies(cookies, hsh)
+            except OFFLINE_ERRORS:
+                self._go_offline()
+            else:
+                with self._lock:
+                    self.digests[hsh] = cookie_digest(cookies)
+                    self._save()
+                return
+        with self._lock:
+            self.pending[hsh] = copy.deepcopy(cookies)
+            self._save()
+
+    def publish_cookies(self, cookies: List, hsh: str, holder: str, ttl: float) -> bool:
+        """Publish cookies under the account lease, queue them if shared storage is unreachable.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash, it is also the lease name.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if cookies were written or queued, False if another client holds the lease.
+        """
+        with self._lock:
+            direct = self.online and not self.pending
+        if direct:
+            try:
+                published = self.remote.publish_cookies(cookies, hsh, holder, ttl)
+            except OFFLINE_ERRORS:
+                self._go_offline()
+            else:
+                if published:
+                    with self._lock:
+                        self.cookies[hsh] = copy.deepcopy(cookies)
+                        self.digests[hsh] = cookie_digest(cookies)
+                        self._save()
+                return published
+        # clients can not agree without shared storage, the queued write is checked for changes on flush
+        self.set_telegram_cookies(cookies, hsh)
+        return True
+
+    def flush(self) -> None:
+        """Push queued writes of accounts that nobody else has changed meanwhile."""
+        with self._lock:
+            pending = dict(self.pending)
+        if not pending:
+            return
+        moved = self.remote.get_moved_cookies({hsh: self.digests.get(hsh) for hsh in pending})
+        for hsh, cookies in pending.items():
+            pushed = moved[hsh][1] is None
+            if pushed:
+                self.remote.set_telegram_cookies(cookies, hsh)
+            elif moved[hsh][0] != cookie_digest(cookies):
+                # the write is dropped: another client has changed the account, or it was queued before
+                # the account was ever read from the shared storage and nobody can tell which cookies are newer
+                reason = 'changed' if self.digests.get(hsh) else 'unknown_digest'
+                metrics.inc('cache_dropped_writes_total', reason=reason)
+            with self._lock:
+                if pushed:
+                    self.digests[hsh] = cookie_digest(cookies)
+                if self.pending.get(hsh) is cookies:
+                    del self.pending[hsh]
+                self._save()
+        # accounts changed by others take their remote cookies
+        self._remember(moved)
+        self.notify_change()
+
+    def flush_writes(self) -> None:
+        """Write changes queued by shared storage now, writes queued while it is unreachable wait for it."""
+        try:
+            self.remote.flush_writes()
+        except OFFLINE_ERRORS:
+            self._go_offline()
+
+    def refresh(self) -> None:
+        """Reach shared storage, push queued writes and pass its change notifications on."""
+        try:
+            self.flush()
+            self.remote.refresh()
+        except OFFLINE_ERRORS:
+            self._go_offline()
+            return
+        if not self.online:
+            # came back online, sessions must reconcile with the shared storage
+            self.online = True
+            self.notify_change()
+        if self.remote.wait_for_change(0):
+            self.notify_change()
+
+    def add_account(self, hsh: str) -> None:
+        """Add new account in shared storage.
+
+        Args:
+            hsh: user identification hash.
+        """
+        self.remote.add_account(hsh)
+
+    def remove_account(self, hsh: str) -> None:
+        """Remove account from shared storage and cache.
+
+        Args:
+            hsh: user identification hash.
+        """
+        self.remote.remove_account(hsh)
+        with self._lock:
+            for entries in (self.cookies, self.digests, self.pending):
+                entries.pop(hsh, None)
+            self._save()
+
+    def apply_accounts(
+        self,
+        add: Iterable[str] = (),
+        remove: Iterable[str] = (),
+        dry_run: bool = False,
+    ) -> AccountsPlan:
+        """Add and remove many accounts in shared storage, removed ones are dropped from the cache.
+
+        Args:
+            add: hashes of new accounts.
+            remove: hashes of accounts to remove.
+            dry_run: only make the plan, storage is not changed.
+
+        Returns:
+            Account changes.
+        """
+        plan = self.remote.apply_accounts(add, remove, dry_run)
+        if not dry_run:
+            with self._lock:
+                for hsh in plan.removed:
+                    for entries in (self.cookies, self.digests, self.pending):
+                        entries.pop(hsh, None)
+                self._save()
+        return plan
+
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew lease in shared storage.
+
+        Args:
+            name: lease name, like account hash.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if holder has the lease, also while the storage is unreachable: clients can not agree then,
+            and a job done by several of them is better than a job not done.
+        """
+        try:
+            return self.remote.acquire_lease(name, holder, ttl)
+        except OFFLINE_ERRORS:
+            self._go_offline()
+            return True
+
+    def release_lease(self, name: str, holder: str) -> None:
+        """Give lease back, it ends by itself if storage is unreachable.
+
+        Args:
+            name: lease name.
+            holder: unique id of the client.
+        """
+        try:
+            self.remote.release_lease(name, holder)
+        except OFFLINE_ERRORS:
+            self._go_offline()
+
+    def get_accounts(self) -> List[str]:
+        """Get stored account hashes.
+
+        Returns:
+            List with account hashes.
+        """
+        return self.remote.get_accounts()
+
+    def reinit(self) -> None:
+        """Reinitialize shared storage and drop the cache."""
+        self.remote.reinit()
+        with self._lock:
+            self.cookies, self.digests, self.pending = {}, {}, {}
+            self._save()
+
+    def __getattr__(self, attr: str) -> object:
+        # backend specific methods like add_shard of the console
+        if attr == 'remote':
+            raise AttributeError(attr)
+        return getattr(self.remote, attr)
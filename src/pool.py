@@ -0,0 +1,117 @@
+"""Pool of launched browsers that are ready to take an account."""
+
+import threading
+import time
+from contextlib import suppress
+from http.client import RemoteDisconnected
+from typing import List, Optional, Tuple, Type
+
+from selenium.common.exceptions import WebDriverException
+
+from src.exceptions import ResoException
+
+
+class BrowserPool(object):
+    """Browsers launched in background and opened on the office page, without account cookies."""
+
+    def __init__(self, klass: Type, size: int, idle_timeout: float) -> None:
+        """Create empty pool, call fill to launch browsers.
+
+        Args:
+            klass: ResoSession class that is launched.
+            size: number of browsers kept ready.
+            idle_timeout: seconds after which an unused browser reloads the office page.
+        """
+        self.klass = klass
+        self.size = size
+        self.idle_timeout = idle_timeout
+        # (browser, time of the last office page load)
+        self._idle: List[Tuple[object, float]] = []
+        self._lock = threading.Lock()
+        self._filler: Optional[threading.Thread] = None
+        self._closed = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    def launch(self) -> object:
+        """Launch browser and open office page.
+
+        Returns:
+            ResoSession instance.
+        """
+        browser = self.klass()
+        browser.get(browser.url_main)
+        return browser
+
+    def fill(self) -> None:
+        """Launch missing browsers in background thread."""
+        if self._filler and self._filler.is_alive():
+            return
+        self._filler = threading.Thread(target=self._fill_loop, daemon=True)
+        self._filler.start()
+
+    def _fill_loop(self) -> None:
+        """Filler thread body."""
+        while True:
+            with self._lock:
+                if self._closed or len(self._idle) >= self.size:
+                    return
+            try:
+                browser = self.launch()
+            except (ResoException, WebDriverException, RemoteDisconnected):
+                # browser can not be launched now, next acquire will try again
+                return
+            with self._lock:
+                if self._closed:
+                    self._quit(browser)
+                    return
+                self._idle.append((browser, time.monotonic()))
+
+    def acquire(self) -> object:
+        """Take ready browser, launch it if pool is empty.
+
+        Returns:
+            ResoSession instance opened on the office page, call switch to insert account cookies.
+        """
+        with self._lock:
+            browser = self._idle.pop(0)[0] if self._idle else None
+        self.fill()
+        if browser is None:
+            browser = self.launch()
+        return browser
+
+    def maintain(self) -> None:
+        """Reload office page in browsers idle for too long, replace dead ones."""
+        now = time.monotonic()
+        with self._lock:
+            stale = [item for item in self._idle if now - item[1] > self.idle_timeout]
+        for item in stale:
+            browser = item[0]
+            try:
+                browser.get(browser.url_main)
+            except (WebDriverException, RemoteDisconnected):
+                with self._lock:
+                    if item in self._idle:
+                        self._idle.remove(item)
+                self._quit(browser)
+                continue
+            with self._lock:
+                if item in self._idle:
+                    self._idle[self._idle.index(item)] = (browser, time.monotonic())
+        if stale:
+            self.fill()
+
+    def close(self) -> None:
+        """Quit all ready browsers."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for browser, _ in idle:
+            self._quit(browser)
+
+    @staticmethod
+    def _quit(browser: object) -> None:
+        with suppress(WebDriverException, RemoteDisconnected):
+            browser.quit()
@@ -0,0 +1,66 @@
+"""Browser-less check of reso cookies."""
+
+import time
+from typing import Dict, List, Optional, Tuple
+
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+
+from src.choiches import CookieFields
+
+# text of the login page, it is absent when cookies are valid
+LOGIN_MARKER = 'type="password"'
+
+
+class CookieProbe(object):
+    """Check whether session cookies are still valid with a plain HTTP request."""
+
+    def __init__(self, url: str, user_agent: str, marker: str = LOGIN_MARKER, ttl: float = 5) -> None:
+        """Create pooled HTTP session.
+
+        Args:
+            url: office page that shows login form for invalid cookies.
+            user_agent: string User-Agent value, the same as in browser.
+            marker: text that is present only on the login page.
+            ttl: seconds during which the result for the same cookies is reused.
+        """
+        self.url = url
+        self.marker = marker
+        self.ttl = ttl
+        self.session = Session()
+        # keep-alive connection is reused by every probe
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.headers['User-Agent'] = user_agent
+        self._results: Dict[Tuple, Tuple[bool, float]] = {}
+
+    def is_valid(self, cookies: Optional[List]) -> Optional[bool]:
+        """Check cookies against office page.
+
+        Args:
+            cookies: list with selenium cookie dictionaries.
+
+        Returns:
+            True or False, None if office is unreachable and the result is unknown.
+        """
+        values = {
+            cookie['name']: cookie['value']
+            for cookie in cookies or []
+            if cookie and cookie['name'] in {CookieFields.aspnet, CookieFields.reso_office60}
+        }
+        if len(values) < 2:
+            return False
+        key = tuple(sorted(values.items()))
+        cached = self._results.get(key)
+        if cached and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        try:
+            response = self.session.get(self.url, cookies=values, timeout=10)
+        except RequestException:
+            return None
+        finally:
+            # cookies set by the office must not leak into the next probe
+            self.session.cookies.clear()
+        valid = self.marker not in response.text
+        # only the latest result is kept, it is the one asked again on the next ticks
+        self._results = {key: (valid, time.monotonic())}
+        return valid
@@ -0,0 +1,147 @@
+"""Run several account sessions in one process."""
+
+from contextlib import suppress
+from http.client import RemoteDisconnected
+from typing import Dict, List, Mapping, Optional, Type
+
+from selenium.common.exceptions import InvalidSessionIdException, WebDriverException
+
+from src.exceptions import TelegramError
+from src.main import BrowserMeta, ResoBrowser, ResoSession
+from src.metrics import metrics, runtime_profiler, serve
+from src.pool import BrowserPool
+from src.settings import METRICS_PORT
+from src.startup import profiler
+from src.storage import StorageBackend
+
+
+class SessionRunner(object):
+    """Sessions with own hashes and browsers that share one storage read per tick."""
+
+    def __init__(self, sessions_options: List[Mapping], manager: StorageBackend) -> None:
+        """Create session classes.
+
+        Args:
+            sessions_options: options of every session.
+            manager: storage shared between sessions.
+        """
+        self.manager = manager
+        self.classes = [ResoSession.session_class(options, manager) for options in sessions_options]
+        self.sessions: List[ResoSession] = []
+        # storage cookies and their digests by hash, entries are read again only when digests move
+        self.digests: Dict[str, Optional[str]] = {}
+        self.cookies: Dict[str, List] = {}
+        self.pools: Dict[Type[ResoSession], BrowserPool] = {
+            klass: BrowserPool(klass, klass.pool_size, klass.pool_idle_timeout)
+            for klass in self.classes
+            if klass.pool_size
+        }
+
+    def start(self) -> None:
+        """Launch browsers and open office page in each of them."""
+        for klass in self.classes:
+            session = klass()
+            self.sessions.append(session)
+            session.start()
+        profiler.report()
+        # spare browsers are launched after the working ones
+        for pool in self.pools.values():
+            pool.fill()
+
+    def tick(self) -> None:
+        """Read storage once and sync every session with it."""
+        moved = self.manager.get_moved_cookies({
+            session.hash: self.digests.get(session.hash) for session in self.sessions
+        })
+        for hsh, (digest, fresh) in moved.items():
+            if fresh is not None:
+                self.digests[hsh], self.cookies[hsh] = digest, fresh
+        cookies = {hsh: self.cookies[hsh] for hsh in moved}
+        for session in list(self.sessions):
+            try:
+                if session.tick(cookies[session.hash]):
+                    # next sessions of the same account must not roll back just published cookies
+                    cookies[session.hash] = session.last_cookies
+            except (InvalidSessionIdException, RemoteDisconnected):
+                # browser of the session was closed, others keep working
+                self.close(session)
+                self.recover(session)
+
+    def recover(self, session: ResoSession, hsh: Optional[str] = None) -> Optional[ResoSession]:
+        """Continue session account in a warm browser from the pool.
+
+        Args:
+            session: closed or replaced session.
+            hsh: account hash for the new session, the same as in the old one if not set.
+
+        Returns:
+            New session or None if session class has no pool.
+        """
+        pool = self.pools.get(type(session))
+        if pool is None:
+            return None
+        fresh = pool.acquire()
+        fresh.switch(hsh or session.hash)
+        self.sessions.append(fresh)
+        return fresh
+
+    def switch_account(self, session: ResoSession, hsh: str) -> ResoSession:
+        """Move session to another account, a warm browser is taken if session has a pool.
+
+        Args:
+            session: working session.
+            hsh: new account hash.
+
+        Returns:
+            Session of the new account.
+        """
+        if type(session) not in self.pools:
+            session.switch(hsh)
+            return session
+        self.close(session)
+        return self.recover(session, hsh)
+
+    def close(self, session: ResoSession) -> None:
+        """Quit session browser and stop syncing it.
+
+        Args:
+            session: session to close.
+        """
+        self.sessions.remove(session)
+        with suppress(WebDriverException, RemoteDisconnected):
+            session.quit()
+
+    def run(self) -> None:
+        """Run sessions until all browsers are closed."""
+        self.start()
+        self.manager.watch()
+        try:
+            while self.sessions:
+                runtime_profiler.step()
+                with metrics.timer('runner_tick_seconds'):
+                    self.tick()
+                # the most active session decides, wakes up at once if another client has changed cookies
+                timeout = min(session.poller.next_interval() for session in self.sessions) if self.sessions else 0
+                if self.manager.wait_for_change(timeout=timeout):
+                    for session in self.sessions:
+                        session.poller.reset()
+                for pool in self.pools.values():
+                    pool.maintain()
+        finally:
+            # queued cookies are written before the sessions give their leases back
+            with suppress(TelegramError):
+                self.manager.flush_writes()
+            for session in list(self.sessions):
+                self.close(session)
+            for pool in self.pools.values():
+                pool.close()
+
+
+if __name__ == '__main__':
+    if METRICS_PORT:
+        serve(METRICS_PORT)
+    runner = SessionRunner(
+        sessions_options=BrowserMeta.get_sessions_options(),
+        manager=ResoBrowser.manager,
+    )
+    runner.run()
@@ -0,0 +1,36 @@
+"""Adaptive polling intervals for the sync loop."""
+
+import random
+
+
+class AdaptivePoller(object):
+    """Poll interval that is short after a state transition and grows while state is stable."""
+
+    def __init__(self, minimum: float = 0.5, maximum: float = 5, factor: float = 1.5, jitter: float = 0.2) -> None:
+        """Create poller with the shortest interval.
+
+        Args:
+            minimum: interval in seconds right after a transition.
+            maximum: interval ceiling in seconds.
+            factor: interval multiplier for every stable tick.
+            jitter: random share of interval, so many clients do not poll in lockstep.
+        """
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.factor = factor
+        self.jitter = jitter
+        self.interval = minimum
+
+    def reset(self) -> None:
+        """Something has happened, poll quickly again."""
+        self.interval = self.minimum
+
+    def next_interval(self) -> float:
+        """Get interval before the next poll and back off the following one.
+
+        Returns:
+            Seconds to wait.
+        """
+        interval = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.interval = min(self.interval * self.factor, self.maximum)
+        return interval
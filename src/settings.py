@@ -19,5 +19,28 @@ load_dotenv()
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 CHAT_ID = os.environ.get('CHAT_ID')
 TELEGRAM_MSG_LIMIT = 4096
+# codec for writing pinned message: json or compact, messages of both formats are read by new clients,
+# clients older than compact read only json, so compact is turned on after all clients are updated
+STORAGE_CODEC = os.environ.get('STORAGE_CODEC', 'json')
+# attempts to write pinned message when other clients edit it at the same moment
+WRITE_ATTEMPTS = 3
+# queued cookie write waits at most this many write delays while the account keeps changing
+WRITE_DEBOUNCE_LIMIT = 4
+# seconds during which pinned message reads are served from memory
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 2))
+# seconds between background checks of the storage for changes right after a change, the cache lifetime by default
+WATCH_INTERVAL = float(os.environ.get('WATCH_INTERVAL', CACHE_TTL))
+# ceiling in seconds the background check backs off to while nothing changes
+WATCH_MAX_INTERVAL = float(os.environ.get('WATCH_MAX_INTERVAL', 10))
+# telegram requests: attempts and exponential backoff bounds in seconds
+RETRY_ATTEMPTS = 6
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 10
+# sync hub: port, shared secret of its clients and seconds a client waits for a change in one request
+HUB_PORT = int(os.environ.get('HUB_PORT', 8765))
+HUB_TOKEN = os.environ.get('HUB_TOKEN')
+HUB_POLL_TIMEOUT = 25
+# localhost port of metrics and profiling endpoint, 0 turns it off
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
 BASE_DIR = get_base_dir()
 INI_PATH = os.path.join(BASE_DIR, 'reso.ini')
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""Startup helpers: launch timing report and cache of resolved driver paths."""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from selenium.webdriver.common.driver_finder import DriverFinder
+from selenium.webdriver.common.options import ArgOptions
+from selenium.webdriver.common.service import Service
+
+from src import STARTED_AT
+from src.settings import BASE_DIR
+
+DRIVERS_CACHE_PATH = os.path.join(BASE_DIR, 'drivers.json')
+PROFILE_PATH = os.path.join(BASE_DIR, 'startup-profile.txt')
+
+
+class StartupProfiler(object):
+    """Collect durations of launch phases, turned on with --profile-startup argument."""
+
+    def __init__(self) -> None:
+        """Create profiler, time is counted from src package import."""
+        self.enabled = '--profile-startup' in sys.argv
+        self.phases: List[Tuple[str, float]] = []
+        self._last = STARTED_AT
+
+    def mark(self, name: str) -> None:
+        """Record phase that has lasted since the previous mark.
+
+        Args:
+            name: phase name.
+        """
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def report(self) -> str:
+        """Print and save timing report if profiling is turned on.
+
+        Returns:
+            Report text.
+        """
+        lines = [
+            '{name:<32} {seconds:8.3f} s'.format(name=name, seconds=seconds)
+            for name, seconds in self.phases
+            if seconds >= 0.001
+        ]
+        lines.append('{name:<32} {seconds:8.3f} s'.format(name='total', seconds=self._last - STARTED_AT))
+        text = '\n'.join(lines)
+        if self.enabled:
+            print(text)
+            with open(PROFILE_PATH, 'w', encoding='UTF-8') as report_file:
+                report_file.write(text + '\n')
+        return text
+
+
+class DriverCache(object):
+    """Driver and browser binary paths resolved by Selenium Manager, kept on disk between launches."""
+
+    def __init__(self, path: str = DRIVERS_CACHE_PATH) -> None:
+        """Create cache.
+
+        Args:
+            path: json file path.
+        """
+        self.path = path
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        try:
+            with open(self.path, encoding='UTF-8') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, paths: Dict[str, Dict[str, str]]) -> None:
+        # written atomically, several sessions may start at once
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='UTF-8') as cache_file:
+            json.dump(paths, cache_file)
+        os.replace(tmp_path, self.path)
+
+    def get(self, browser: str) -> Optional[Dict[str, str]]:
+        """Get cached paths if binaries still exist.
+
+        Args:
+            browser: browser name.
+
+        Returns:
+            Dictionary with driver_path and browser_path or None.
+        """
+        paths = self._load().get(browser)
+        if paths and all(os.path.isfile(path) for path in paths.values() if path):
+            return paths
+        return None
+
+    def forget(self, browser: str) -> None:
+        """Drop cached paths, for example after browser update.
+
+        Args:
+            browser: browser name.
+        """
+        paths = self._load()
+        if paths.pop(browser, None):
+            self._save(paths)
+
+    def apply(self, browser: str, service: Service, options: ArgOptions) -> bool:
+        """Put driver and browser paths into service and options, resolve them if they are not cached.
+
+        Selenium does not start Selenium Manager when service already has a driver path.
+
+        Args:
+            browser: browser name.
+            service: browser service.
+            options: browser options.
+
+        Returns:
+            True if paths were taken from cache.
+        """
+        paths = self.get(browser)
+        cached = paths is not None
+        if not cached:
+            finder = DriverFinder(service, options)
+            paths = {'driver_path': finder.get_driver_path(), 'browser_path': finder.get_browser_path()}
+            stored = self._load()
+            stored[browser] = paths
+            try:
+                self._save(stored)
+            except OSError:
+                # read-only folder, paths will be resolved again next time
+                pass
+        service.path = paths['driver_path']
+        if paths['browser_path']:
+            options.binary_location = paths['browser_path']
+        return cached
+
+
+profiler = StartupProfiler()
+driver_cache = DriverCache()
@@ -0,0 +1,520 @@
+"""Shared cookie storage backends."""
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import cached_property
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from src.codec import cookie_digest
+from src.exceptions import InvalidHash, LocalStorageError, ResoException
+from src.scheduler import AdaptivePoller
+from src.settings import BASE_DIR, WATCH_INTERVAL, WATCH_MAX_INTERVAL
+
+
+class AccountsPlan(NamedTuple):
+    """Result or preview of a bulk account change."""
+
+    # new account hash to chat id, None for storages without chats
+    added: Dict[str, Optional[str]]
+    removed: List[str]
+    # hashes to add that already exist and hashes to remove that do not
+    existing: List[str]
+    missing: List[str]
+    # message length after the change by chat id
+    sizes: Dict[str, int]
+
+
+class StorageBackend(ABC):
+    """Interface of the shared storage with cookies by account hash."""
+
+    @cached_property
+    def message_sample(self) -> Dict:
+        """Read json file with message sample.
+
+            Returns:
+                JSON message sample.
+            """
+        with open(os.path.join(BASE_DIR, 'cookies_sample.json')) as f:
+            return json.loads(f.read())
+
+    def __init__(self) -> None:
+        """Storage initial method."""
+        self._changed = threading.Event()
+        # notifications so far, the watcher polls quickly again after each of them
+        self._change_count = 0
+        self._watcher: Optional[threading.Thread] = None
+
+    @abstractmethod
+    def get_telegram_cookies(self, hsh: str) -> List:
+        """Get cookies by hash.
+
+        Args:
+            hsh: user identification hash.
+        """
+
+    def get_many_cookies(self, hashes: Iterable[str]) -> Dict[str, List]:
+        """Get cookies of several accounts with as few storage reads as possible.
+
+        Args:
+            hashes: user identification hashes.
+
+        Returns:
+            Dictionary with cookies by hash.
+        """
+        return {hsh: self.get_telegram_cookies(hsh) for hsh in hashes}
+
+    def get_moved_cookies(self, digests: Dict[str, Optional[str]]) -> Dict[str, Tuple[Optional[str], Optional[List]]]:
+        """Get current digests of accounts and cookies only of accounts whose digest has moved.
+
+        Args:
+            digests: digests known to the caller by hash, None for unknown.
+
+        Returns:
+            Dictionary with (digest, cookies or None if digest is the known one) by hash.
+        """
+        moved = {}
+        for hsh, cookies in self.get_many_cookies(digests).items():
+            digest = cookie_digest(cookies)
+            moved[hsh] = (digest, cookies if digest != digests[hsh] else None)
+        return moved
+
+    @abstractmethod
+    def set_telegram_cookies(self, cookies: List, hsh: str) -> None:
+        """Set new cookies by hash.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash.
+        """
+
+    @abstractmethod
+    def add_account(self, hsh: str) -> None:
+        """Add new account with sample cookies.
+
+        Args:
+            hsh: user identification hash.
+        """
+
+    @abstractmethod
+    def remove_account(self, hsh: str) -> None:
+        """Remove account.
+
+        Args:
+            hsh: user identification hash.
+        """
+
+    @abstractmethod
+    def get_accounts(self) -> List[str]:
+        """Get stored account hashes."""
+
+    def apply_accounts(
+        self,
+        add: Iterable[str] = (),
+        remove: Iterable[str] = (),
+        dry_run: bool = False,
+    ) -> AccountsPlan:
+        """Add and remove many accounts at once.
+
+        Args:
+            add: hashes of new accounts, existing ones are skipped.
+            remove: hashes of accounts to remove, unknown ones are skipped.
+            dry_run: only make the plan, storage is not changed.
+
+        Returns:
+            Account changes.
+        """
+        accounts = set(self.get_accounts())
+        remove = list(dict.fromkeys(remove))
+        plan = AccountsPlan(
+            added={hsh: None for hsh in dict.fromkeys(add) if hsh not in accounts or hsh in remove},
+            removed=[hsh for hsh in remove if hsh in accounts],
+            existing=[hsh for hsh in dict.fromkeys(add) if hsh in accounts and hsh not in remove],
+            missing=[hsh for hsh in remove if hsh not in accounts],
+            sizes={},
+        )
+        if not dry_run:
+            for hsh in plan.removed:
+                self.remove_account(hsh)
+            for hsh in plan.added:
+                self.add_account(hsh)
+        return plan
+
+    @abstractmethod
+    def reinit(self) -> None:
+        """Initialize or reinitialize storage with message sample."""
+
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew lease, so only one client does the job.
+
+        Storages that are not shared between computers have one client, it always holds the lease.
+
+        Args:
+            name: lease name, like account hash.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if holder has the lease.
+        """
+        return True
+
+    def publish_cookies(self, cookies: List, hsh: str, holder: str, ttl: float) -> bool:
+        """Set cookies only if holder has or takes the account lease, the write renews the lease.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash, it is also the lease name.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if cookies were written, False if another client holds the lease.
+        """
+        if not self.acquire_lease(hsh, holder, ttl):
+            return False
+        self.set_telegram_cookies(cookies, hsh)
+        return True
+
+    def release_lease(self, name: str, holder: str) -> None:
+        """Give lease back, so other clients do not wait for its end.
+
+        Args:
+            name: lease name.
+            holder: unique id of the client.
+        """
+
+    def flush_writes(self) -> None:
+        """Write queued changes now, storages that write at once have nothing to do."""
+
+    @abstractmethod
+    def refresh(self) -> None:
+        """Check storage for changes, call notify_change if something has changed."""
+
+    def notify_change(self) -> None:
+        """Wake up everybody who waits for a change."""
+        self._change_count += 1
+        self._changed.set()
+
+    def watch(self, interval: float = WATCH_INTERVAL) -> None:
+        """Start background watcher that notifies about changes.
+
+        Only one watcher is started per storage, so all sessions sharing it make a single request per interval.
+        The interval grows up to WATCH_MAX_INTERVAL while the storage does not change.
+
+        Args:
+            interval: seconds between storage checks right after a change.
+        """
+        if self._watcher and self._watcher.is_alive():
+            return
+        self._watcher = threading.Thread(target=self._watch_loop, args=(interval,), daemon=True)
+        self._watcher.start()
+
+    def _watch_loop(self, interval: float) -> None:
+        """Watcher thread body.
+
+        Args:
+            interval: seconds between storage checks right after a change.
+        """
+        poller = AdaptivePoller(interval, max(interval, WATCH_MAX_INTERVAL))
+        while True:
+            seen = self._change_count
+            try:
+                self.refresh()
+            except ResoException:
+                # main thread will face the same error on its own read
+                pass
+            if self._change_count != seen:
+                poller.reset()
+            time.sleep(poller.next_interval())
+
+    def wait_for_change(self, timeout: float) -> bool:
+        """Block until storage is changed by anybody or timeout is over.
+
+        Args:
+            timeout: maximum seconds to wait.
+
+        Returns:
+            True if storage has changed since the previous call.
+        """
+        changed = self._changed.wait(timeout)
+        self._changed.clear()
+        return changed
+
+
+class LazyStorage(object):
+    """Class attribute that creates storage on first access, so importing does not connect anywhere."""
+
+    def __init__(self, factory: Callable[[], StorageBackend]) -> None:
+        """Remember storage factory.
+
+        Args:
+            factory: function that creates storage.
+        """
+        self.factory = factory
+        self.storage: Optional[StorageBackend] = None
+        self._lock = threading.Lock()
+
+    def __get__(self, instance: object, owner: type) -> StorageBackend:
+        """Create storage once and return it.
+
+        Args:
+            instance: owner instance or None.
+            owner: owner class.
+
+        Returns:
+            Storage instance.
+        """
+        with self._lock:
+            if self.storage is None:
+                self.storage = self.factory()
+        return self.storage
+
+
+class SQLiteStorage(StorageBackend):
+    """Storage in a local or shared SQLite file."""
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS accounts (hash TEXT PRIMARY KEY, cookies TEXT NOT NULL, digest TEXT)',
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)',
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('revision', 0)",
+    )
+
+    def __init__(self, path: str) -> None:
+        """Open storage file, create tables if file is new.
+
+        Args:
+            path: database file path, relative paths are resolved from reso.ini folder.
+        """
+        super().__init__()
+        self.path = os.path.join(BASE_DIR, path)
+        self._revision: Optional[int] = None
+        with self._connect() as conn:
+            for statement in self.schema:
+                conn.execute(statement)
+            if 'digest' not in [row[1] for row in conn.execute('PRAGMA table_info(accounts)')]:
+                # file created before digests, they are filled on the next writes
+                conn.execute('ALTER TABLE accounts ADD COLUMN digest TEXT')
+            empty = not conn.execute('SELECT 1 FROM accounts LIMIT 1').fetchone()
+        if empty:
+            self.reinit()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open connection with a transaction, connections are not shared between threads.
+
+        Yields:
+            Connection object.
+        """
+        try:
+            conn = sqlite3.connect(self.path, timeout=10)
+        except sqlite3.Error as error:
+            raise LocalStorageError(LocalStorageError.msg.format(path=self.path, error=error))
+        try:
+            with conn:
+                yield conn
+        except sqlite3.OperationalError as error:
+            # file is locked by other clients longer than timeout or is not reachable
+            raise LocalStorageError(LocalStorageError.msg.format(path=self.path, error=error))
+        finally:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection) -> None:
+        """Increment storage revision inside write transaction.
+
+        Args:
+            conn: connection with open transaction.
+        """
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+
+    def refresh(self) -> None:
+        """Check storage revision."""
+        with self._connect() as conn:
+            revision = conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+        if revision != self._revision:
+            self._revision = revision
+            self.notify_change()
+
+    def get_telegram_cookies(self, hsh: str) -> List:
+        """Get cookies by hash.
+
+        Args:
+            hsh: user identification hash.
+
+        Returns:
+            Cookies list.
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT cookies FROM accounts WHERE hash = ?', (hsh,)).fetchone()
+        if not row:
+            raise InvalidHash(InvalidHash.msg.format(hash=hsh))
+        return json.loads(row[0])
+
+    def get_many_cookies(self, hashes: Iterable[str]) -> Dict[str, List]:
+        """Get cookies of several accounts with one query.
+
+        Args:
+            hashes: user identification hashes.
+
+        Returns:
+            Dictionary with cookies by hash.
+        """
+        hashes = set(hashes)
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT hash, cookies FROM accounts WHERE hash IN ({marks})'.format(marks=','.join('?' * len(hashes))),
+                tuple(hashes),
+            ).fetchall()
+        cookies = {hsh: json.loads(value) for hsh, value in rows}
+        for hsh in hashes - set(cookies):
+            raise InvalidHash(InvalidHash.msg.format(hash=hsh))
+        return cookies
+
+    def get_moved_cookies(self, digests: Dict[str, Optional[str]]) -> Dict[str, Tuple[Optional[str], Optional[List]]]:
+        """Get current digests of accounts with one query, cookies are read only for moved digests.
+
+        Args:
+            digests: digests known to the caller by hash, None for unknown.
+
+        Returns:
+            Dictionary with (digest, cookies or None if digest is the known one) by hash.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT hash, digest FROM accounts WHERE hash IN ({marks})'.format(marks=','.join('?' * len(digests))),
+                tuple(digests),
+            ).fetchall()
+        current = dict(rows)
+        for hsh in set(digests) - set(current):
+            raise InvalidHash(InvalidHash.msg.format(hash=hsh))
+        # rows written before digests have none and are always read
+        moved = [hsh for hsh, digest in current.items() if digest is None or digest != digests[hsh]]
+        cookies = self.get_many_cookies(moved) if moved else {}
+        return {
+            hsh: (cookie_digest(cookies[hsh]), cookies[hsh]) if hsh in cookies else (digest, None)
+            for hsh, digest in current.items()
+        }
+
+    def set_telegram_cookies(self, cookies: List, hsh: str) -> None:
+        """Set new cookies by hash.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE accounts SET cookies = ?, digest = ? WHERE hash = ?',
+                (json.dumps(cookies), cookie_digest(cookies), hsh),
+            )
+            self._write(conn)
+
+    def add_account(self, hsh: str) -> None:
+        """Add new account with sample cookies.
+
+        Args:
+            hsh: user identification hash.
+        """
+        with self._connect() as conn:
+            cookies = self.message_sample['test']
+            conn.execute(
+                'INSERT OR REPLACE INTO accounts (hash, cookies, digest) VALUES (?, ?, ?)',
+                (hsh, json.dumps(cookies), cookie_digest(cookies)),
+            )
+            self._write(conn)
+
+    def remove_account(self, hsh: str) -> None:
+        """Remove account.
+
+        Args:
+            hsh: user identification hash.
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM accounts WHERE hash = ?', (hsh,))
+            self._write(conn)
+
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Take or renew lease in one transaction, leases do not change the revision.
+
+        Args:
+            name: lease name, like account hash.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if holder has the lease.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT holder, expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)', (name, holder, now + ttl),
+            )
+        return True
+
+    def publish_cookies(self, cookies: List, hsh: str, holder: str, ttl: float) -> bool:
+        """Check lease, renew it and set cookies in one transaction.
+
+        Args:
+            cookies: cookies dictionary that will be set.
+            hsh: user identification hash, it is also the lease name.
+            holder: unique id of the client.
+            ttl: seconds until the lease ends if it is not renewed.
+
+        Returns:
+            True if cookies were written, False if another client holds the lease.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT holder, expires_at FROM leases WHERE name = ?', (hsh,)).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)', (hsh, holder, now + ttl),
+            )
+            conn.execute(
+                'UPDATE accounts SET cookies = ?, digest = ? WHERE hash = ?',
+                (json.dumps(cookies), cookie_digest(cookies), hsh),
+            )
+            self._write(conn)
+        return True
+
+    def release_lease(self, name: str, holder: str) -> None:
+        """Give lease back.
+
+        Args:
+            name: lease name.
+            holder: unique id of the client.
+        """
+        with self._connect() as conn:
+            conn.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+
+    def get_accounts(self) -> List[str]:
+        """Get stored account hashes.
+
+        Returns:
+            List with account hashes.
+        """
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute('SELECT hash FROM accounts ORDER BY rowid')]
+
+    def reinit(self) -> None:
+        """Replace all accounts with message sample."""
+        sample = copy.deepcopy(self.message_sample)
+        with self._connect() as conn:
+            conn.execute('DELETE FROM accounts')
+            conn.executemany(
+                'INSERT INTO accounts (hash, cookies, digest) VALUES (?, ?, ?)',
+                [(hsh, json.dumps(cookies), cookie_digest(cookies)) for hsh, cookies in sample.items()],
+            )
+            self._write(conn)
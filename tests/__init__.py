@@ -1 +1,10 @@
 """Test module for src."""
+
+import os
+
+from dotenv import load_dotenv
+
+# hermetic tests do not talk to telegram, but settings need a well-formed token
+load_dotenv()
+os.environ.setdefault('BOT_TOKEN', '123456:hermetic-test-token')
+os.environ.setdefault('CHAT_ID', '-100')
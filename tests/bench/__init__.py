@@ -0,0 +1 @@
+"""Hermetic benchmarks: local fake Bot API, fake office and scenarios with concurrent clients."""
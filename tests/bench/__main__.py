@@ -0,0 +1,33 @@
+"""Run benchmark scenario: python -m tests.bench --clients 5 --duration 60."""
+
+import argparse
+import json
+
+from tests.bench.scenario import format_report, run_scenario
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Hermetic cookie sync benchmark.')
+    parser.add_argument('--clients', type=int, default=3)
+    parser.add_argument('--accounts', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--login-interval', type=float, default=5)
+    parser.add_argument('--api-latency', type=float, default=0.05)
+    parser.add_argument('--edits-per-minute', type=int, default=20, help='0 turns the limit off')
+    parser.add_argument('--cookie-ttl', type=float, default=None)
+    parser.add_argument('--json', action='store_true', help='print report as json for comparison between runs')
+    args = parser.parse_args()
+    report = run_scenario(
+        clients=args.clients,
+        accounts=args.accounts,
+        duration=args.duration,
+        login_interval=args.login_interval,
+        api_latency=args.api_latency,
+        edits_per_minute=args.edits_per_minute or None,
+        cookie_ttl=args.cookie_ttl,
+    )
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Benchmark client: ResoSession sync logic over a plain HTTP browser, one process per client."""
+
+import copy
+import threading
+import time
+from collections import Counter
+from multiprocessing import Queue
+from typing import Dict, List, Optional, Set, Tuple
+
+from requests import Session
+from selenium.common.exceptions import NoSuchElementException
+from telebot import apihelper
+
+from src.choiches import CookieFields
+from src.exceptions import ResoException
+from src.main import ResoSession
+from src.manager import MessageManager
+from src.metrics import metrics
+from src.probe import LOGIN_MARKER
+from src.scheduler import AdaptivePoller
+
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+COOKIE_TEMPLATE = {'path': '/', 'secure': False, 'httpOnly': True, 'sameSite': 'None', 'domain': '.reso.ru'}
+
+
+class HttpBrowser(object):
+    """The part of WebDriver that ResoSession uses, backed by requests and a cookie dictionary."""
+
+    def __init__(self, office_url: str) -> None:
+        self.office_url = office_url
+        self.http = Session()
+        self.jar: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> str:
+        values = {name: cookie['value'] for name, cookie in list(self.jar.items())}
+        return self.http.get(self.office_url, cookies=values, timeout=10).text
+
+    def get(self, url: str) -> None:
+        self.load()
+
+    def find_element(self, by: str, value: str) -> str:
+        # the office page shows login form as soon as the session has ended
+        if LOGIN_MARKER in self.load():
+            return value
+        raise NoSuchElementException(value)
+
+    def get_cookie(self, name: str) -> Optional[Dict]:
+        return copy.deepcopy(self.jar.get(name))
+
+    def add_cookie(self, cookie: Dict) -> None:
+        self.jar[cookie['name']] = dict(cookie)
+
+    def delete_cookie(self, name: str) -> None:
+        self.jar.pop(name, None)
+
+    def login(self, account: str) -> str:
+        """Log in like a person does, new cookies end sessions of other clients.
+
+        Args:
+            account: office account.
+
+        Returns:
+            New ASP.NET_SessionId value.
+        """
+        values = self.http.post(self.office_url, params={'account': account}, timeout=10).json()
+        for name, value in values.items():
+            self.jar[name] = dict(COOKIE_TEMPLATE, name=name, value=value)
+        return values[CookieFields.aspnet]
+
+    def quit(self) -> None:
+        self.http.close()
+
+
+class BenchSession(ResoSession, HttpBrowser):
+    """ResoSession without a real browser."""
+
+    def __init__(self, manager: MessageManager, hsh: str, office_url: str, poll_bounds: Tuple[float, float]) -> None:
+        HttpBrowser.__init__(self, office_url)
+        self.manager = manager
+        self.hash = hsh
+        self.url_main = office_url
+        self.probe = None
+        self.need_to_set_telegram_cookies = False
+        self.last_cookies = manager.get_telegram_cookies(hsh)
+        self.storage_digest = None
+        self.storage_cookies = self.last_cookies
+        self.poller = AdaptivePoller(*poll_bounds)
+        self.was_logged_in = None
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_client(
+    index: int, account: str, api_url: str, office_url: str, duration: float, poll_bounds: Tuple[float, float],
+    commands: Queue, results: Queue,
+) -> None:
+    """Process body: sync one session until duration is over, logins come from commands queue.
+
+    Args:
+        index: client number.
+        account: account hash.
+        api_url: fake Bot API url template.
+        office_url: fake office url.
+        duration: seconds of syncing.
+        poll_bounds: poller interval bounds.
+        commands: queue with "login" commands from scenario.
+        results: queue for "ready" message and the final result.
+    """
+    apihelper.API_URL = api_url
+    manager = MessageManager()
+    session = BenchSession(manager, account, office_url, poll_bounds)
+    session.start()
+    manager.watch()
+    own: Set[str] = set()
+    seen: List[Tuple[str, float]] = []
+    errors: Counter = Counter()
+
+    def login_loop() -> None:
+        while True:
+            if commands.get() != 'login':
+                return
+            with session.lock:
+                own.add(session.login(account))
+            session.poller.reset()
+
+    threading.Thread(target=login_loop, daemon=True).start()
+    results.put(('ready', index))
+    cpu_started = time.process_time()
+    deadline = time.monotonic() + duration
+    last_value = None
+    while time.monotonic() < deadline:
+        try:
+            session.tick()
+        except ResoException as error:
+            errors[type(error).__name__] += 1
+        with session.lock:
+            value = (session.get_cookie(CookieFields.aspnet) or {}).get('value')
+            if value != last_value and value not in own:
+                seen.append((value, time.time()))
+            last_value = value
+        if manager.wait_for_change(timeout=session.poller.next_interval()):
+            session.poller.reset()
+    counters, _ = metrics.samples()
+    results.put(('done', {
+        'index': index,
+        'account': account,
+        'final': last_value,
+        'seen': seen,
+        'own': sorted(own),
+        'errors': dict(errors),
+        'write_conflicts': sum(value for name, _, value in counters if name == 'storage_write_conflicts_total'),
+        'cpu_seconds': time.process_time() - cpu_started,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
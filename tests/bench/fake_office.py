@@ -0,0 +1,94 @@
+"""Local office page that issues and expires the two reso cookies."""
+
+import json
+import secrets
+import threading
+import time
+from http import HTTPStatus
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from src.choiches import CookieFields
+from src.probe import LOGIN_MARKER
+
+OFFICE_PAGE = '<div id="office">office</div>'
+LOGIN_PAGE = '<form><input {marker}></form>'.format(marker=LOGIN_MARKER)
+
+
+class FakeOffice(object):
+    """One valid session per account: a new login ends the previous one, like office.reso.ru does."""
+
+    def __init__(self, ttl: Optional[float] = None) -> None:
+        """Create server, call start to serve.
+
+        Args:
+            ttl: seconds after which a session expires, never if not set.
+        """
+        self.ttl = ttl
+        # account -> (ASP.NET_SessionId, ResoOffice60, issue time)
+        self.sessions: Dict[str, Tuple[str, str, float]] = {}
+        # ASP.NET_SessionId value -> wall clock issue time, for latency of other processes
+        self.issued: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        office = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                cookie = SimpleCookie(self.headers.get('Cookie', ''))
+                values = {name: morsel.value for name, morsel in cookie.items()}
+                valid = office.is_valid(values.get(CookieFields.aspnet), values.get(CookieFields.reso_office60))
+                self.reply(OFFICE_PAGE if valid else LOGIN_PAGE, 'text/html')
+
+            def do_POST(self) -> None:
+                url = urlparse(self.path)
+                account = parse_qs(url.query).get('account', ['default'])[0]
+                self.reply(json.dumps(office.login(account)), 'application/json')
+
+            def reply(self, text: str, content_type: str) -> None:
+                body = text.encode()
+                self.send_response(HTTPStatus.OK)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+
+    def start(self) -> 'FakeOffice':
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def login(self, account: str) -> Dict[str, str]:
+        """Start new session of the account.
+
+        Args:
+            account: account name.
+
+        Returns:
+            Cookie values by name.
+        """
+        aspnet, office = secrets.token_hex(12), secrets.token_hex(48).upper()
+        with self._lock:
+            self.sessions[account] = (aspnet, office, time.monotonic())
+            self.issued[aspnet] = time.time()
+        return {CookieFields.aspnet: aspnet, CookieFields.reso_office60: office}
+
+    def is_valid(self, aspnet: Optional[str], office: Optional[str]) -> bool:
+        with self._lock:
+            for session_aspnet, session_office, issued_at in self.sessions.values():
+                if (aspnet, office) == (session_aspnet, session_office):
+                    return self.ttl is None or time.monotonic() - issued_at < self.ttl
+        return False
@@ -0,0 +1,152 @@
+"""Local stand-in for the Bot API methods used by MessageManager."""
+
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from src.settings import TELEGRAM_MSG_LIMIT
+
+
+class FakeBotApi(object):
+    """getChat, sendMessage, pinChatMessage and editMessageText over HTTP, every chat exists."""
+
+    def __init__(self, latency: float = 0, edits_per_minute: Optional[int] = None) -> None:
+        """Create server, call start to serve.
+
+        Args:
+            latency: seconds added to every response, like a round trip to telegram.
+            edits_per_minute: edits allowed per chat, 429 with retry_after when exceeded.
+        """
+        self.latency = latency
+        self.edits_per_minute = edits_per_minute
+        self.calls: Counter = Counter()
+        # tcp connections accepted, fewer than calls when clients keep connections alive
+        self.connections = 0
+        self.messages: Dict[str, Dict[int, Dict]] = defaultdict(dict)
+        self.pinned: Dict[str, int] = {}
+        self._edits: Dict[str, Deque[float]] = defaultdict(deque)
+        self._next_id = 1
+        self._lock = threading.Lock()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self) -> None:
+                super().setup()
+                with api._lock:
+                    api.connections += 1
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                query = url.query
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    # the async bot sends parameters as a form
+                    query = '&'.join(filter(None, [query, self.rfile.read(length).decode()]))
+                params = {key: values[0] for key, values in parse_qs(query, keep_blank_values=True).items()}
+                time.sleep(api.latency)
+                status, body = api.call(url.path.rsplit('/', 1)[-1], params)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_POST = do_GET
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+
+    @property
+    def api_url(self) -> str:
+        """Value for telebot.apihelper.API_URL."""
+        return 'http://127.0.0.1:{0}/bot{{0}}/{{1}}'.format(self.server.server_port)
+
+    def start(self) -> 'FakeBotApi':
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def error(code: int, description: str, **parameters: Any) -> Tuple[int, Dict]:
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return code, body
+
+    def call(self, method: str, params: Dict[str, str]) -> Tuple[int, Dict]:
+        """Run Bot API method.
+
+        Args:
+            method: method name from url.
+            params: query parameters.
+
+        Returns:
+            HTTP status and response body.
+        """
+        with self._lock:
+            self.calls[method] += 1
+            handler = getattr(self, 'api_' + method, None)
+            if handler is None:
+                return self.error(HTTPStatus.NOT_FOUND, 'Not Found: method not found')
+            return handler(**params)
+
+    def chat(self, chat_id: str) -> Dict:
+        return {'id': int(chat_id), 'type': 'supergroup', 'title': 'bench'}
+
+    def api_getChat(self, chat_id: str, **_: str) -> Tuple[int, Dict]:
+        result = self.chat(chat_id)
+        if chat_id in self.pinned:
+            result['pinned_message'] = self.messages[chat_id][self.pinned[chat_id]]
+        return HTTPStatus.OK, {'ok': True, 'result': result}
+
+    def api_sendMessage(self, chat_id: str, text: str, **_: str) -> Tuple[int, Dict]:
+        message = {'message_id': self._next_id, 'date': int(time.time()), 'chat': self.chat(chat_id), 'text': text}
+        self._next_id += 1
+        self.messages[chat_id][message['message_id']] = message
+        return HTTPStatus.OK, {'ok': True, 'result': message}
+
+    def api_pinChatMessage(self, chat_id: str, message_id: str, **_: str) -> Tuple[int, Dict]:
+        if int(message_id) not in self.messages[chat_id]:
+            return self.error(HTTPStatus.BAD_REQUEST, 'Bad Request: message to pin not found')
+        self.pinned[chat_id] = int(message_id)
+        return HTTPStatus.OK, {'ok': True, 'result': True}
+
+    def api_editMessageText(self, chat_id: str, message_id: str, text: str, **_: str) -> Tuple[int, Dict]:
+        message = self.messages[chat_id].get(int(message_id))
+        if message is None:
+            return self.error(HTTPStatus.BAD_REQUEST, 'Bad Request: message to edit not found')
+        if len(text) > TELEGRAM_MSG_LIMIT:
+            return self.error(HTTPStatus.BAD_REQUEST, 'Bad Request: MESSAGE_TOO_LONG')
+        if self.edits_per_minute:
+            edits, now = self._edits[chat_id], time.monotonic()
+            while edits and now - edits[0] > 60:
+                edits.popleft()
+            if len(edits) >= self.edits_per_minute:
+                retry_after = int(60 - (now - edits[0])) + 1
+                return self.error(
+                    HTTPStatus.TOO_MANY_REQUESTS, 'Too Many Requests: retry after {0}'.format(retry_after),
+                    retry_after=retry_after,
+                )
+            edits.append(now)
+        if message['text'] == text:
+            return self.error(
+                HTTPStatus.BAD_REQUEST,
+                'Bad Request: message is not modified: specified new message content and reply markup are exactly '
+                'the same as a current content and reply markup of the message',
+            )
+        message['text'] = text
+        message['edit_date'] = int(time.time())
+        return HTTPStatus.OK, {'ok': True, 'result': message}
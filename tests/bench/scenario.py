@@ -0,0 +1,176 @@
+"""Scenario with N concurrent clients and its report."""
+
+import multiprocessing
+import statistics
+import time
+from typing import Dict, List, Optional, Tuple
+
+from telebot import apihelper
+
+from src.manager import MessageManager
+from tests.bench.client import run_client
+from tests.bench.fake_office import FakeOffice
+from tests.bench.fake_telegram import FakeBotApi
+
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def run_scenario(
+    clients: int = 3,
+    accounts: int = 1,
+    duration: float = 30,
+    login_interval: float = 5,
+    api_latency: float = 0.05,
+    edits_per_minute: Optional[int] = 20,
+    cookie_ttl: Optional[float] = None,
+    poll_bounds: Tuple[float, float] = (0.5, 5),
+) -> Dict:
+    """Run clients against fake telegram and office, a person logs in at one of them every login_interval.
+
+    Clients are spread over accounts round-robin, every client is a separate process like on real computers.
+
+    Args:
+        clients: number of client processes.
+        accounts: number of office accounts.
+        duration: seconds of syncing.
+        login_interval: seconds between logins.
+        api_latency: seconds of every Bot API round trip.
+        edits_per_minute: Bot API edit limit per chat, None for no limit.
+        cookie_ttl: office session lifetime, None for endless sessions.
+        poll_bounds: poller interval bounds of clients.
+
+    Returns:
+        Report dictionary.
+    """
+    api = FakeBotApi(latency=api_latency, edits_per_minute=edits_per_minute).start()
+    office = FakeOffice(ttl=cookie_ttl).start()
+    previous_url, apihelper.API_URL = apihelper.API_URL, api.api_url
+    try:
+        manager = MessageManager()
+        manager.reinit()
+        hashes = ['bench-{0}'.format(number) for number in range(accounts)]
+        for hsh in hashes:
+            manager.add_account(hsh)
+    finally:
+        apihelper.API_URL = previous_url
+    api.calls.clear()
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    queues = [context.Queue() for _ in range(clients)]
+    processes = [
+        context.Process(
+            target=run_client,
+            args=(
+                index, hashes[index % accounts], api.api_url, office.url, duration, poll_bounds, queues[index], results,
+            ),
+            daemon=True,
+        )
+        for index in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        results.get(timeout=60)
+    started = time.monotonic()
+    # the last logins must have time to propagate
+    logins = max(1, int((duration - login_interval) // login_interval) + 1)
+    for number in range(logins):
+        queues[number % clients].put('login')
+        time.sleep(login_interval)
+    sessions = [results.get(timeout=duration + 60)[1] for _ in processes]
+    elapsed = time.monotonic() - started
+    for queue in queues:
+        queue.put('stop')
+    for process in processes:
+        process.join(10)
+    api.stop()
+    office.stop()
+    return build_report(sessions, api, office, elapsed)
+
+
+def build_report(sessions: List[Dict], api: FakeBotApi, office: FakeOffice, elapsed: float) -> Dict:
+    """Count latency, telegram load, conflicts and resources.
+
+    Args:
+        sessions: results of clients.
+        api: stopped fake Bot API.
+        office: stopped fake office.
+        elapsed: scenario seconds.
+
+    Returns:
+        Report dictionary.
+    """
+    latencies = [
+        seen_at - office.issued[value]
+        for session in sessions
+        for value, seen_at in session['seen']
+        if value in office.issued
+    ]
+    latest = {account: session[0] for account, session in office.sessions.items()}
+    calls = sum(api.calls.values())
+    return {
+        'clients': len(sessions),
+        'logins': len(office.issued),
+        'propagation': {
+            'deliveries': len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'max': max(latencies) if latencies else None,
+            'mean': statistics.mean(latencies) if latencies else None,
+        },
+        # clients that ended with cookies of the last login of their account
+        'converged': sum(session['final'] == latest.get(session['account']) for session in sessions),
+        'telegram': {
+            'calls': calls,
+            'calls_per_minute': calls * 60 / elapsed,
+            'by_method': dict(api.calls),
+        },
+        'write_conflicts': sum(session['write_conflicts'] for session in sessions),
+        'errors': sum(sum(session['errors'].values()) for session in sessions),
+        'sessions': [
+            {'index': session['index'], 'cpu_seconds': session['cpu_seconds'], 'peak_rss_mb': session['peak_rss_mb']}
+            for session in sorted(sessions, key=lambda session: session['index'])
+        ],
+    }
+
+
+def format_report(report: Dict) -> str:
+    """Make report readable in console.
+
+    Args:
+        report: report dictionary.
+
+    Returns:
+        Report text.
+    """
+    def seconds(value: Optional[float]) -> str:
+        return '-' if value is None else '{0:.3f} s'.format(value)
+
+    propagation = report['propagation']
+    lines = [
+        'clients: {clients}, logins: {logins}, converged: {converged}/{clients}'.format(**report),
+        'propagation: p50 {0}, p95 {1}, max {2}, deliveries {3}'.format(
+            seconds(propagation['p50']), seconds(propagation['p95']), seconds(propagation['max']),
+            propagation['deliveries'],
+        ),
+        'telegram: {calls} calls, {per_minute:.1f} per minute, {methods}'.format(
+            calls=report['telegram']['calls'],
+            per_minute=report['telegram']['calls_per_minute'],
+            methods=', '.join('{0} {1}'.format(*item) for item in sorted(report['telegram']['by_method'].items())),
+        ),
+        'write conflicts: {write_conflicts}, errors: {errors}'.format(**report),
+    ]
+    for session in report['sessions']:
+        memory = session['peak_rss_mb']
+        lines.append('session {index}: cpu {cpu:.3f} s, peak rss {memory}'.format(
+            index=session['index'],
+            cpu=session['cpu_seconds'],
+            memory='-' if memory is None else '{0:.1f} MB'.format(memory),
+        ))
+    return '\n'.join(lines)
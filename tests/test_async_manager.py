@@ -0,0 +1,130 @@
+"""Test module for async pinned message manager."""
+
+import asyncio
+import unittest
+from typing import Any, Awaitable, Callable
+
+from telebot import apihelper, asyncio_helper
+
+from src.async_manager import AsyncMessageManager, LoopStorage
+from src.async_runner import AsyncSessionRunner
+from src.exceptions import TelegramUnavailable
+from src.manager import MessageManager
+from tests.bench.fake_telegram import FakeBotApi
+from tests.test_manager import sample_cookies
+from tests.test_runner import FakeSession
+
+
+class AsyncManagerTestCase(unittest.TestCase):
+    """Async manager over the fake Bot API."""
+
+    def setUp(self) -> None:
+        """Start fake Bot API with two accounts."""
+        self.api = FakeBotApi().start()
+        self.addCleanup(self.api.stop)
+        for helper in (apihelper, asyncio_helper):
+            self.addCleanup(setattr, helper, 'API_URL', helper.API_URL)
+            helper.API_URL = self.api.api_url
+        manager = MessageManager(cache_ttl=0)
+        manager.add_account('a')
+        manager.add_account('b')
+        self.api.calls.clear()
+        self.api.latency = 0.05
+
+    def run_with_manager(self, scenario: Callable[[AsyncMessageManager], Awaitable]) -> Any:
+        async def main() -> Any:
+            manager = AsyncMessageManager(cache_ttl=0)
+            try:
+                return await scenario(manager)
+            finally:
+                await manager.close()
+        return asyncio.run(main())
+
+    def test_concurrent_reads_share_request(self) -> None:
+        """Reads of one chat in flight at the same time make a single request."""
+        async def scenario(manager: AsyncMessageManager) -> Any:
+            return await asyncio.gather(*(manager.get_telegram_cookies(hsh) for hsh in 'abab'))
+
+        self.assertEqual(len(self.run_with_manager(scenario)), 4)
+        self.assertEqual(self.api.calls['getChat'], 1)
+
+    def test_write_over_kept_alive_connections(self) -> None:
+        """Writes are read back by both managers and requests reuse connections."""
+        async def scenario(manager: AsyncMessageManager) -> Any:
+            await manager.set_telegram_cookies(sample_cookies('a1'), 'a')
+            await manager.set_telegram_cookies(sample_cookies('b1'), 'b')
+            return await manager.get_moved_cookies({'a': None, 'b': None})
+
+        connections = self.api.connections
+        moved = self.run_with_manager(scenario)
+        self.assertEqual(moved['a'][1], sample_cookies('a1'))
+        self.assertEqual(MessageManager().get_telegram_cookies('b'), sample_cookies('b1'))
+        self.assertLess(self.api.connections - connections, sum(self.api.calls.values()) - 1)
+
+    def test_loop_storage_from_thread(self) -> None:
+        """Session code in a worker thread uses the async manager through the loop."""
+        async def scenario(manager: AsyncMessageManager) -> Any:
+            storage = LoopStorage(manager, asyncio.get_running_loop())
+            await asyncio.to_thread(storage.set_telegram_cookies, sample_cookies('a2'), 'a')
+            return await asyncio.to_thread(storage.get_telegram_cookies, 'a')
+
+        self.assertEqual(self.run_with_manager(scenario), sample_cookies('a2'))
+
+    def test_loop_storage_shares_change_event(self) -> None:
+        """Change noticed in a worker thread, like a cookie event, wakes up the runner waiting on the loop."""
+        async def scenario(manager: AsyncMessageManager) -> Any:
+            storage = LoopStorage(manager, asyncio.get_running_loop())
+            manager._changed.clear()
+            await asyncio.to_thread(storage.notify_change)
+            return await manager.wait_for_change(timeout=1), await asyncio.to_thread(storage.wait_for_change, 0.05)
+
+        self.assertEqual(self.run_with_manager(scenario), (True, False))
+
+    def test_watcher_backs_off(self) -> None:
+        """Failed checks are retried less and less often, a programming error ends the watcher."""
+        async def scenario(manager: AsyncMessageManager) -> Any:
+            calls = []
+
+            async def refresh() -> None:
+                calls.append(len(calls))
+                raise TelegramUnavailable()
+
+            manager.refresh = refresh
+            manager.watch(interval=0.01)
+            await asyncio.sleep(0.3)
+            failed = len(calls)
+            manager._watcher.cancel()
+            await asyncio.gather(manager._watcher, return_exceptions=True)
+
+            async def broken() -> None:
+                raise ZeroDivisionError()
+
+            manager.refresh = broken
+            manager.watch(interval=0.01)
+            await asyncio.sleep(0.05)
+            return failed, manager._watcher.done() and isinstance(manager._watcher.exception(), ZeroDivisionError)
+
+        failed, stopped = self.run_with_manager(scenario)
+        self.assertLess(failed, 15)
+        self.assertTrue(stopped)
+
+    def test_runner_tick(self) -> None:
+        """Accounts are synced in worker threads, published cookies are passed to the next session of the account."""
+        async def scenario(manager: AsyncMessageManager) -> Any:
+            runner = AsyncSessionRunner([], manager)
+            runner.manager.loop = asyncio.get_running_loop()
+            writer = FakeSession(hash='a', manager=runner.manager, publish=sample_cookies('a3'))
+            reader = FakeSession(hash='a', manager=runner.manager, publish=None)
+            other = FakeSession(hash='b', manager=runner.manager, publish=None)
+            runner.sessions = [writer, reader, other]
+            await runner.tick_async()
+            return writer, reader, other
+
+        writer, reader, other = self.run_with_manager(scenario)
+        self.assertEqual(reader.seen, sample_cookies('a3'))
+        self.assertEqual(other.seen, writer.seen)
+        self.assertEqual(MessageManager().get_telegram_cookies('a'), sample_cookies('a3'))
+
+
+if __name__ == '__main__':
+    unittest.main()
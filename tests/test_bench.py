@@ -0,0 +1,41 @@
+"""Test module for benchmark harness."""
+
+import unittest
+from unittest import mock
+
+from telebot import apihelper
+
+from src.manager import MessageManager
+from tests.bench.fake_telegram import FakeBotApi
+from tests.bench.scenario import run_scenario
+from tests.test_manager import sample_cookies
+
+
+class BenchTestCase(unittest.TestCase):
+    """Fake Bot API and a short scenario keep working."""
+
+    def test_manager_over_fake_api(self) -> None:
+        """Real telebot requests are served by the fake Bot API."""
+        api = FakeBotApi().start()
+        self.addCleanup(api.stop)
+        previous_url, apihelper.API_URL = apihelper.API_URL, api.api_url
+        self.addCleanup(setattr, apihelper, 'API_URL', previous_url)
+        manager = MessageManager(cache_ttl=0)
+        manager.add_account('bench')
+        manager.set_telegram_cookies(sample_cookies('a1'), 'bench')
+        manager.set_telegram_cookies(sample_cookies('a1'), 'bench')
+        self.assertEqual(MessageManager().get_telegram_cookies('bench'), sample_cookies('a1'))
+        self.assertEqual(api.calls['sendMessage'], 1)
+
+    def test_scenario(self) -> None:
+        """Every client ends with cookies of the last login."""
+        # client processes read settings from the environment, the last login must reach them within the short run
+        with mock.patch.dict('os.environ', {'CACHE_TTL': '0.5', 'WATCH_INTERVAL': '0.5', 'WATCH_MAX_INTERVAL': '1'}):
+            report = run_scenario(clients=2, duration=4, login_interval=2, api_latency=0)
+        self.assertEqual(report['converged'], 2)
+        self.assertTrue(report['propagation']['deliveries'])
+        self.assertEqual(report['errors'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
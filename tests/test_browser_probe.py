@@ -0,0 +1,83 @@
+"""Test module for batched browser probe and cookie replace."""
+
+import unittest
+from typing import Any, Dict, List, Optional
+
+from src.main import PROBE_SCRIPT, WELCOME_XPATH, ResoSession
+from tests.test_manager import sample_cookies
+
+
+class ScriptedBrowser(ResoSession):
+    """ResoSession over a browser that records webdriver calls."""
+
+    batched_probe = True
+    url_main = 'https://office.reso.ru/'
+
+    def __init__(self, jar: str, cookies: List[Dict]) -> None:
+        self.jar = jar
+        self.cookies = cookies
+        self.last_cookies = sample_cookies('a1')
+        self.calls: List[str] = []
+
+    def execute_script(self, script: str, *args: Any) -> Optional[List]:
+        self.calls.append('execute_script')
+        if script == PROBE_SCRIPT:
+            self.probe_args = args
+            return [True, self.jar]
+        self.replaced = args[0]
+        return None
+
+    def get_cookies(self) -> List[Dict]:
+        self.calls.append('get_cookies')
+        return self.cookies
+
+    def delete_cookie(self, name: str) -> None:
+        self.calls.append('delete_cookie')
+
+    def add_cookie(self, cookie: Dict) -> None:
+        self.calls.append('add_cookie')
+
+
+class ChromiumBrowser(ScriptedBrowser):
+    """Browser with CDP."""
+
+    def execute_cdp_cmd(self, cmd: str, params: Dict) -> Dict:
+        self.calls.append(cmd)
+        if cmd == 'Network.setCookies':
+            self.replaced = params['cookies']
+        return {}
+
+
+class BrowserProbeTestCase(unittest.TestCase):
+    """Probe and replace cost one webdriver call when they can."""
+
+    def test_unchanged_visible_cookies(self) -> None:
+        """Login state and unchanged cookies come from one script call."""
+        browser = ScriptedBrowser('ResoOffice60=A1; ASP.NET_SessionId=a1; other=x', [])
+        self.assertEqual(browser.probe_browser(), (True, sample_cookies('a1')))
+        self.assertEqual(browser.calls, ['execute_script'])
+        self.assertEqual(browser.probe_args, (WELCOME_XPATH,))
+
+    def test_http_only_cookies(self) -> None:
+        """Cookies hidden from the script come with one more call."""
+        cookies = [dict(cookie, httpOnly=True) for cookie in sample_cookies('a2')]
+        browser = ScriptedBrowser('other=x', cookies + [{'name': 'other', 'value': 'x'}])
+        self.assertEqual(browser.probe_browser(), (True, cookies))
+        self.assertEqual(browser.calls, ['execute_script', 'get_cookies'])
+
+    def test_replace(self) -> None:
+        """CDP replaces any cookies, the script only those that are not HttpOnly, otherwise a call per cookie."""
+        chromium = ChromiumBrowser('', [])
+        chromium.insert_cookies([dict(cookie, httpOnly=True, expiry=100) for cookie in sample_cookies('a2')])
+        self.assertEqual(chromium.calls, ['Network.deleteCookies'] * 2 + ['Network.setCookies'])
+        self.assertEqual(chromium.replaced[0]['expires'], 100)
+        firefox = ScriptedBrowser('', [])
+        firefox.insert_cookies(sample_cookies('a2'))
+        self.assertEqual((firefox.calls, firefox.replaced), (['execute_script'], sample_cookies('a2')))
+        firefox.calls.clear()
+        firefox.insert_cookies([dict(cookie, httpOnly=True) for cookie in sample_cookies('a2')])
+        self.assertEqual(firefox.calls, ['delete_cookie'] * 2 + ['add_cookie'] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Test module for storage codecs."""
+
+import json
+import os
+import unittest
+
+from src.choiches import StorageFields
+from src.codec import CompactCodec, JsonCodec, cookie_digest, decode, stamp_digests
+from src.settings import BASE_DIR, TELEGRAM_MSG_LIMIT
+
+
+class CodecTestCase(unittest.TestCase):
+    """Storage codecs test case."""
+
+    def setUp(self) -> None:
+        """Load message sample."""
+        with open(os.path.join(BASE_DIR, 'cookies_sample.json')) as sample:
+            self.cookies = json.load(sample)['test']
+
+    def test_compact_round_trip(self) -> None:
+        """Compact codec restores cookies exactly."""
+        cookies = [dict(self.cookies[0], expiry=1700000000), dict(self.cookies[1], domain='office.reso.ru')]
+        del cookies[1]['sameSite']
+        content = {'first': cookies, StorageFields.revision: 7}
+        text = CompactCodec().encode(content)
+        # digests are not stored, but decoded content has them
+        stamp_digests(content)
+        self.assertEqual(decode(text), content)
+        self.assertEqual(text, CompactCodec().encode(content))
+
+    def test_digest_ignores_noise(self) -> None:
+        """Only cookie names and values change the digest."""
+        noisy = [dict(self.cookies[1], expiry=1700000000), dict(self.cookies[0], secure=True)]
+        self.assertEqual(cookie_digest(noisy), cookie_digest(self.cookies))
+        changed = [dict(self.cookies[0], value='x'), self.cookies[1]]
+        self.assertNotEqual(cookie_digest(changed), cookie_digest(self.cookies))
+        self.assertIsNone(cookie_digest(None))
+
+    def test_legacy_json_is_decoded(self) -> None:
+        """Messages written in the original format are still read."""
+        content = {'first': self.cookies}
+        self.assertEqual(decode(JsonCodec().encode(content)), content)
+
+    def test_compact_fits_more_accounts(self) -> None:
+        """Compact codec stores several times more accounts in one message."""
+        def capacity(codec: JsonCodec) -> int:
+            content = {}
+            while len(codec.encode(content)) <= TELEGRAM_MSG_LIMIT:
+                cookies = [dict(cookie, value=os.urandom(len(cookie['value']) // 2).hex()) for cookie in self.cookies]
+                content['account_{num}'.format(num=len(content))] = cookies
+            return len(content) - 1
+
+        self.assertGreaterEqual(capacity(CompactCodec()), 3 * capacity(JsonCodec()))
+
+
+if __name__ == '__main__':
+    unittest.main()
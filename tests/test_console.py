@@ -0,0 +1,82 @@
+"""Test module for bulk account commands of the console."""
+
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from src.exceptions import AccountsFileError
+from src.manager import MessageManager
+from src.manager_console import Console, console_storage, read_accounts, run_command, write_accounts
+from src.storage import SQLiteStorage
+
+
+class ConsoleTestCase(unittest.TestCase):
+    """Account files and non-interactive commands over local storage."""
+
+    def setUp(self) -> None:
+        """Create storage with sample account."""
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.addCleanup(setattr, Console, 'manager', Console.__dict__['manager'])
+        Console.manager = SQLiteStorage(os.path.join(self.folder.name, 'cookies.sqlite3'))
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.folder.name, name)
+
+    def run_command(self, *argv: str) -> int:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return run_command(list(argv))
+
+    def test_account_files(self) -> None:
+        """Names survive export and import in both formats, csv header and duplicates are skipped."""
+        for name in ('accounts.csv', 'accounts.json'):
+            write_accounts(self.path(name), ['first', 'second'])
+            self.assertEqual(read_accounts(self.path(name)), ['first', 'second'])
+        with open(self.path('team.csv'), 'w') as team:
+            team.write('hash,comment\nfirst,a\n\nsecond,b\nfirst,c\n')
+        self.assertEqual(read_accounts(self.path('team.csv')), ['first', 'second'])
+        with open(self.path('service.json'), 'w') as service:
+            service.write('["__rev__"]')
+        with self.assertRaises(AccountsFileError):
+            read_accounts(self.path('service.json'))
+
+    def test_import_and_remove(self) -> None:
+        """Dry run changes nothing, import and remove apply the file."""
+        write_accounts(self.path('team.csv'), ['first', 'second'])
+        self.assertEqual(self.run_command('import', self.path('team.csv'), '--dry-run'), 0)
+        self.assertEqual(Console.manager.get_accounts(), ['test'])
+        self.assertEqual(self.run_command('import', self.path('team.csv')), 0)
+        self.assertEqual(Console.manager.get_accounts(), ['test', 'first', 'second'])
+        self.assertEqual(self.run_command('remove', self.path('team.csv')), 0)
+        self.assertEqual(self.run_command('export', self.path('left.json')), 0)
+        self.assertEqual(read_accounts(self.path('left.json')), ['test'])
+        self.assertEqual(self.run_command('import', self.path('missing.csv')), 1)
+
+    def test_storage_from_ini(self) -> None:
+        """Console uses the storage chosen in reso.ini without the local cookie cache."""
+        with open(self.path('reso.ini'), 'w') as ini_file:
+            ini_file.write(
+                '[options]\nhash = test\nbrowser = firefox\nuser-agent = agent\n'
+                'storage = sqlite\nstorage-path = {path}\n'.format(path=self.path('shared.sqlite3'))
+            )
+        with mock.patch('src.config.INI_PATH', self.path('reso.ini')):
+            storage = console_storage()
+        self.assertIsInstance(storage, SQLiteStorage)
+        self.assertEqual(storage.path, self.path('shared.sqlite3'))
+
+    def test_storage_without_ini(self) -> None:
+        """Console starts without reso.ini and falls back to Telegram storage."""
+        with mock.patch('src.config.INI_PATH', self.path('missing.ini')):
+            self.assertIsInstance(console_storage(), MessageManager)
+        # the browser module reads reso.ini on import, the console must not import it
+        code = 'import sys, src.manager_console; sys.exit("src.main" in sys.modules)'
+        self.assertEqual(subprocess.run([sys.executable, '-c', code]).returncode, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
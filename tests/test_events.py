@@ -0,0 +1,109 @@
+"""Test module for browser cookie events."""
+
+import unittest
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.bidi.network import NetworkEvent
+
+from src.events import RESPONSE_COMPLETED, CookieEvents
+from src.main import ResoSession
+from src.scheduler import AdaptivePoller
+from tests.test_manager import sample_cookies
+
+
+def response(url: str, set_cookie: Optional[str] = None, navigation: Optional[str] = None) -> NetworkEvent:
+    headers = [{'name': 'Content-Type', 'value': {'type': 'string', 'value': 'text/html'}}]
+    if set_cookie:
+        headers.append({'name': 'Set-Cookie', 'value': {'type': 'string', 'value': set_cookie}})
+    return NetworkEvent(
+        RESPONSE_COMPLETED, navigation=navigation, request={'url': url}, response={'url': url, 'headers': headers},
+    )
+
+
+class Clock(object):
+    """Monotonic clock moved by hand."""
+
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ProbedSession(ResoSession):
+    """ResoSession that counts browser probes, storage and browser always agree."""
+
+    def __init__(self, events: CookieEvents) -> None:
+        self.cookie_events = events
+        self.manager = SimpleNamespace(get_moved_cookies=self.moved)
+        self.hash = 'first'
+        self.storage_digest = None
+        self.storage_cookies: List[Dict] = []
+        self.last_cookies = sample_cookies('a1')
+        self.need_to_set_telegram_cookies = False
+        self.poller = AdaptivePoller()
+        self.was_logged_in: Optional[bool] = None
+        self.probes = 0
+
+    def moved(self, digests: Dict) -> Dict:
+        return {'first': (None, sample_cookies('a1'))}
+
+    def auth_complete(self) -> bool:
+        self.probes += 1
+        return True
+
+    def get_browser_cookies(self) -> List[Dict]:
+        return sample_cookies('a1')
+
+
+class CookieEventsTestCase(unittest.TestCase):
+    """Events decide when the browser is probed."""
+
+    def setUp(self) -> None:
+        """Create events that are attached."""
+        self.clock = Clock()
+        self.events = CookieEvents(clock=self.clock)
+        self.events.active = True
+
+    def test_only_office_cookie_changes_count(self) -> None:
+        """Navigations and watched Set-Cookie headers of office hosts wake the loop, other responses do not."""
+        self.assertTrue(self.events.changed())
+        self.events.on_response(response('https://office.reso.ru/img.png', set_cookie='other=1; path=/'))
+        self.events.on_response(response('https://reso.ru.example.com/', navigation='n1'))
+        self.events.on_response(response('https://cdn.example.com/', set_cookie='ResoOffice60=1'))
+        self.assertFalse(self.events.changed())
+        self.events.on_response(response('https://office.reso.ru/api', set_cookie='ASP.NET_SessionId=x; HttpOnly'))
+        self.assertTrue(self.events.changed())
+        self.events.on_response(response('https://office.reso.ru/', navigation='n2'))
+        self.assertTrue(self.events.changed())
+        self.assertFalse(self.events.changed())
+        self.clock.now += 30
+        self.assertTrue(self.events.changed())
+
+    def test_polling_without_bidi(self) -> None:
+        """Browser without websocket url keeps polling."""
+        class Browser(object):
+            @property
+            def network(self) -> None:
+                raise WebDriverException('Unable to find url to connect to from capabilities')
+
+        events = CookieEvents()
+        self.assertFalse(events.attach(Browser()))
+        self.assertTrue(events.changed())
+        self.assertTrue(events.changed())
+
+    def test_tick_skips_probe_without_events(self) -> None:
+        """Quiet browser is not probed while storage does not change."""
+        session = ProbedSession(self.events)
+        for _ in range(3):
+            session.tick()
+        self.assertEqual(session.probes, 1)
+        self.events.on_response(response('https://office.reso.ru/', set_cookie='ResoOffice60=2'))
+        session.tick()
+        self.assertEqual(session.probes, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
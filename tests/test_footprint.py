@@ -0,0 +1,72 @@
+"""Test module for the lite browser mode and browser resource usage."""
+
+import base64
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from src import footprint
+from src.main import BrowserDetector
+
+
+class LiteModeTestCase(unittest.TestCase):
+    """Lite mode options of every browser."""
+
+    def test_firefox(self) -> None:
+        """Firefox is headless, skips images and fonts, and sends requests through the office-only PAC."""
+        options = BrowserDetector('Firefox', 'agent', lite=True, memory_limit=256).options
+        self.assertIn('-headless', options.arguments)
+        self.assertEqual(options.preferences['permissions.default.image'], 2)
+        self.assertFalse(options.preferences['gfx.downloadable_fonts.enabled'])
+        self.assertEqual(options.preferences['network.proxy.autoconfig_url'], BrowserDetector.pac_url())
+        self.assertEqual(options.preferences['javascript.options.mem.max'], 256 * 1024)
+
+    def test_chromium(self) -> None:
+        """Chrome and Edge get the same switches, full mode stays untouched."""
+        for name in ('Chrome', 'Edge'):
+            arguments = BrowserDetector(name, 'agent', lite=True).options.arguments
+            self.assertIn('--headless=new', arguments)
+            self.assertIn('--blink-settings=imagesEnabled=false', arguments)
+            self.assertIn('--proxy-pac-url={0}'.format(BrowserDetector.pac_url()), arguments)
+            self.assertFalse([argument for argument in arguments if argument.startswith('--js-flags')])
+        self.assertNotIn('--headless=new', BrowserDetector('Chrome', 'agent').options.arguments)
+
+    def test_pac_allows_only_office(self) -> None:
+        """PAC script sends office and local hosts directly and the rest to the dead proxy."""
+        script = base64.b64decode(BrowserDetector.pac_url().split(',', 1)[1]).decode()
+        self.assertIn('dnsDomainIs(host, ".reso.ru")', script)
+        self.assertIn('isPlainHostName(host)', script)
+        self.assertIn('PROXY 127.0.0.1:9', script)
+
+
+@unittest.skipIf(footprint.psutil is None and not os.path.isdir(footprint.PROC), 'neither psutil nor /proc')
+class ResourceUsageTestCase(unittest.TestCase):
+    """Usage of tracked sessions is exported as metrics."""
+
+    def test_usage_of_tracked_session(self) -> None:
+        """Current process stands for the webdriver process."""
+        class Session(object):
+            hash = 'first'
+            service = SimpleNamespace(process=SimpleNamespace(pid=os.getpid()))
+
+        session = Session()
+        footprint.track(session)
+        usage = footprint.collect_browser_usage()
+        samples = {name: value for name, labels, value in usage if labels['hash'] == 'first'}
+        self.assertGreater(samples['browser_rss_bytes'], 0)
+        self.assertGreaterEqual(samples['browser_processes'], 1)
+
+    @unittest.skipUnless(os.path.isdir(footprint.PROC), '/proc is not available')
+    def test_proc_fallback(self) -> None:
+        """Without psutil usage of the process tree is read from /proc."""
+        with mock.patch.object(footprint, 'psutil', None):
+            usage = footprint.process_tree_usage(os.getpid())
+        self.assertGreater(usage.rss, 0)
+        self.assertGreater(usage.cpu, 0)
+        self.assertGreaterEqual(usage.processes, 1)
+        self.assertIsNone(footprint.proc_tree_usage(2 ** 22 + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
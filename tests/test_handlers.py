@@ -0,0 +1,107 @@
+"""Test module for retry decorator."""
+
+import unittest
+from typing import Dict, List
+from unittest import mock
+
+from requests import ConnectionError as ConnectionErrorRequests
+from telebot.apihelper import ApiTelegramException
+
+from src.exceptions import TelegramError
+from src.handlers import retry, retry_stats
+from src.manager import MessageManager
+from src.settings import RETRY_ATTEMPTS
+from tests.test_manager import FakeBot, sample_cookies
+
+
+def telegram_error(code: int, description: str, **parameters: int) -> ApiTelegramException:
+    """Build telegram exception like the API returns.
+
+    Args:
+        code: error code.
+        description: error description.
+        parameters: response parameters.
+
+    Returns:
+        ApiTelegramException instance.
+    """
+    result_json: Dict = {'ok': False, 'error_code': code, 'description': description}
+    if parameters:
+        result_json['parameters'] = parameters
+    return ApiTelegramException('editMessageText', None, result_json)
+
+
+class RetryTestCase(unittest.TestCase):
+    """Retry decorator test case, sleeps are recorded instead of waited."""
+
+    def run_failing(self, errors: List[Exception]) -> List[float]:
+        """Run function that raises errors one by one and then succeeds.
+
+        Args:
+            errors: errors to raise.
+
+        Returns:
+            Sleep durations.
+        """
+        errors = list(errors)
+
+        @retry
+        def edit() -> str:
+            if errors:
+                raise errors.pop(0)
+            return 'done'
+
+        with mock.patch('src.handlers.time.sleep') as sleep:
+            self.assertEqual(edit(), 'done')
+        return [call.args[0] for call in sleep.call_args_list]
+
+    def test_not_modified_is_left_to_the_edit(self) -> None:
+        """Generic wrapper does not turn "not modified" into None, only the pinned message edit treats it as success."""
+        @retry
+        def acquire() -> bool:
+            raise telegram_error(400, 'Bad Request: message is not modified')
+
+        with mock.patch('src.handlers.time.sleep') as sleep, self.assertRaises(ApiTelegramException):
+            acquire()
+        sleep.assert_not_called()
+        manager = MessageManager(cache_ttl=0)
+        manager.bot = FakeBot({'first': sample_cookies('a1')})
+        unchanged = telegram_error(400, 'Bad Request: message is not modified')
+        manager.bot.edit_message_text = mock.Mock(side_effect=unchanged)
+        manager._edit_pinned(manager.chat, 1, 'text')
+        manager.bot.edit_message_text.assert_called_once()
+
+    def test_permanent_error_fails_fast(self) -> None:
+        """Bad request is raised without retries."""
+        @retry
+        def edit() -> None:
+            raise telegram_error(400, 'Bad Request: chat not found')
+
+        with mock.patch('src.handlers.time.sleep') as sleep, self.assertRaises(ApiTelegramException):
+            edit()
+        sleep.assert_not_called()
+
+    def test_rate_limit_waits_retry_after(self) -> None:
+        """Rate limit is retried after the time telegram asks for."""
+        before = retry_stats['rate_limited']
+        self.assertEqual(self.run_failing([telegram_error(429, 'Too Many Requests', retry_after=7)]), [7])
+        self.assertEqual(retry_stats['rate_limited'], before + 1)
+
+    def test_network_errors_back_off(self) -> None:
+        """Network errors are retried with growing delays and give up with TelegramError."""
+        delays = self.run_failing([ConnectionErrorRequests()] * 3)
+        self.assertEqual(len(delays), 3)
+        self.assertLess(delays[0], delays[2])
+
+        @retry
+        def edit() -> None:
+            raise ConnectionErrorRequests()
+
+        with mock.patch('src.handlers.time.sleep') as sleep, self.assertRaises(TelegramError):
+            edit()
+        # no sleep after the last attempt
+        self.assertEqual(sleep.call_count, RETRY_ATTEMPTS - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Test module for the sync hub and its clients."""
+
+import os
+import tempfile
+import unittest
+
+from src.exceptions import HubError, InvalidHash, TelegramUnavailable
+from src.hub import HubStorage, SyncHub
+from src.storage import SQLiteStorage
+from tests.test_manager import sample_cookies
+
+
+class SyncHubTestCase(unittest.TestCase):
+    """Clients share local storage through the hub."""
+
+    def setUp(self) -> None:
+        """Serve SQLite storage on a free port."""
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.hub = SyncHub(SQLiteStorage(os.path.join(self.folder.name, 'cookies.sqlite3')), token='secret')
+        self.server = self.hub.serve(port=0)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+    def client(self, token: str = 'secret') -> HubStorage:
+        return HubStorage(self.url, token=token)
+
+    def test_change_reaches_other_client(self) -> None:
+        """Cookies set by one client wake up the watcher of another one."""
+        writer, reader = self.client(), self.client()
+        reader.watch(interval=0.05)
+        reader.get_telegram_cookies('test')
+        while reader.version is None:
+            reader.wait_for_change(timeout=0.05)
+        writer.set_telegram_cookies(sample_cookies('a1'), 'test')
+        self.assertTrue(reader.wait_for_change(timeout=5))
+        digest, cookies = reader.get_moved_cookies({'test': None})['test']
+        self.assertEqual(cookies, sample_cookies('a1'))
+        self.assertEqual(reader.get_moved_cookies({'test': digest})['test'], (digest, None))
+
+    def test_leases_and_errors(self) -> None:
+        """Leases are kept by the hub storage, storage errors are raised again by clients."""
+        first, second = self.client(), self.client()
+        self.assertTrue(first.publish_cookies(sample_cookies('a1'), 'test', 'one', 60))
+        self.assertFalse(second.publish_cookies(sample_cookies('b1'), 'test', 'two', 60))
+        first.release_lease('test', 'one')
+        self.assertTrue(second.acquire_lease('test', 'two', 60))
+        with self.assertRaises(InvalidHash):
+            first.get_telegram_cookies('missing')
+        with self.assertRaises(HubError):
+            self.client(token='wrong').get_accounts()
+        with self.assertRaises(TelegramUnavailable):
+            HubStorage('http://127.0.0.1:9', timeout=1).get_accounts()
+        for query in ('since=x', 'timeout=x', 'timeout=-1', 'timeout=nan'):
+            with self.assertRaises(HubError):
+                first._call('GET', '/changes?' + query)
+        self.assertIn('version', first._call('GET', '/changes?since=-1&timeout=0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""Test module for session keep-alive and leases."""
+
+import os
+import tempfile
+import time
+import unittest
+from typing import Dict, List, Optional
+
+from src.keepalive import KeepAlive
+from src.lease import AccountLease
+from src.main import ResoSession
+from src.manager import MessageManager
+from src.scheduler import AdaptivePoller
+from src.storage import SQLiteStorage
+from tests.test_manager import FakeBot, sample_cookies
+
+
+class Clock(object):
+    """Wall clock moved by hand."""
+
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class PageBrowser(object):
+    """Browser that records page loads and background requests."""
+
+    def __init__(self) -> None:
+        self.loads: List[str] = []
+        self.fetches: List[str] = []
+        self.fetch_status = 200
+        self.loaded_at = 0.0
+        self.jar: Dict[str, Dict] = {cookie['name']: cookie for cookie in sample_cookies('a1')}
+
+    def get(self, url: str) -> None:
+        self.loads.append(url)
+
+    def execute_script(self, script: str, *args) -> float:
+        return self.loaded_at
+
+    def execute_async_script(self, script: str, *args) -> int:
+        self.fetches.append(args[0])
+        return self.fetch_status
+
+    def get_cookie(self, name: str) -> Optional[Dict]:
+        return self.jar.get(name)
+
+
+class KeepAliveSession(ResoSession, PageBrowser):
+    """ResoSession with the keep-alive part only."""
+
+    def __init__(self, manager: SQLiteStorage, keepalive: Optional[KeepAlive] = None) -> None:
+        PageBrowser.__init__(self)
+        self.manager = manager
+        self.hash = 'first'
+        self.last_cookies = sample_cookies('a1')
+        self.poller = AdaptivePoller()
+        # storage leases are compared with the real clock, so the timeout is short
+        self.keepalive = keepalive or KeepAlive(idle_timeout=0.4, margin=0.1)
+        self.lease = AccountLease(ttl=0.2)
+
+
+class KeepAliveTestCase(unittest.TestCase):
+    """Expiry tracking and election of one refreshing client."""
+
+    def setUp(self) -> None:
+        """Create shared storage."""
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.storage = SQLiteStorage(os.path.join(self.folder.name, 'cookies.sqlite3'))
+        self.clock = Clock()
+
+    def test_expiry(self) -> None:
+        """Session is due before the idle timeout or the earliest cookie expiry."""
+        keepalive = KeepAlive(idle_timeout=1200, margin=120, clock=self.clock)
+        keepalive.touch('first')
+        self.assertFalse(keepalive.due('first', sample_cookies('a1')))
+        self.clock.now += 1081
+        self.assertTrue(keepalive.due('first', sample_cookies('a1')))
+        keepalive.touch('first')
+        cookies = sample_cookies('a1')
+        cookies[1]['expiry'] = int(self.clock.now) + 60
+        self.assertTrue(keepalive.due('first', cookies))
+        keepalive.refreshed('first')
+        self.clock.now += 60
+        self.assertFalse(keepalive.due('first', cookies))
+        self.clock.now += 60
+        self.assertTrue(keepalive.due('first', cookies))
+
+    def test_browser_state(self) -> None:
+        """Pages opened by the user put the refresh off, refreshes are requested in background and rate limited."""
+        session = KeepAliveSession(self.storage, KeepAlive(idle_timeout=1200, margin=120, clock=self.clock))
+        session.loaded_at = self.clock.now - 1150
+        session.keep_alive()
+        self.assertEqual(len(session.fetches), 1)
+        self.clock.now += 1100
+        session.loaded_at = self.clock.now - 10
+        session.keep_alive()
+        self.assertEqual(len(session.fetches), 1)
+        # the office rotates the cookie with a short expiry and does not prolong it
+        session.jar['ResoOffice60'] = dict(session.jar['ResoOffice60'], expiry=int(self.clock.now) + 60)
+        session.last_cookies = list(session.jar.values())
+        session.keep_alive()
+        self.assertEqual(len(session.fetches), 2)
+        self.clock.now += 60
+        session.keep_alive()
+        self.assertEqual(len(session.fetches), 2)
+        self.clock.now += 61
+        session.fetch_status = 0
+        session.keep_alive()
+        self.assertEqual((len(session.fetches), len(session.loads)), (3, 1))
+        # now the office prolongs it, known expiry is taken from the browser
+        session.jar['ResoOffice60'] = dict(session.jar['ResoOffice60'], expiry=int(self.clock.now) + 3600)
+        self.clock.now += 121
+        session.keep_alive()
+        self.assertEqual(len(session.fetches), 3)
+        self.assertEqual(session.last_cookies[1]['expiry'], session.jar['ResoOffice60']['expiry'])
+
+    def test_one_client_refreshes(self) -> None:
+        """Only the lease holder refreshes the session, another client takes over when it goes silent."""
+        sessions = [KeepAliveSession(self.storage) for _ in range(2)]
+        for session in sessions:
+            session.keep_alive()
+        self.assertEqual([len(session.fetches) for session in sessions], [1, 0])
+        for _ in range(3):
+            time.sleep(0.35)
+            for session in sessions:
+                session.keep_alive()
+        self.assertEqual([len(session.fetches) for session in sessions], [4, 0])
+        # the holder is closed without giving the lease back
+        time.sleep(0.25)
+        sessions[1].keep_alive()
+        self.assertEqual(len(sessions[1].fetches), 1)
+        self.assertEqual([session.loads for session in sessions], [[], []])
+
+    def test_released_lease_is_taken_at_once(self) -> None:
+        """Lease given back on quit is taken by the next due client."""
+        first, second = KeepAliveSession(self.storage), KeepAliveSession(self.storage)
+        first.keep_alive()
+        first.release_lease()
+        second.keep_alive()
+        self.assertEqual(len(second.fetches), 1)
+
+    def test_message_lease(self) -> None:
+        """Pinned message lease is written only to take or renew it after half of it."""
+        manager = MessageManager(cache_ttl=0)
+        manager.bot = FakeBot({'first': sample_cookies('a1')})
+        self.assertTrue(manager.acquire_lease('first', 'one', 600))
+        self.assertFalse(manager.acquire_lease('first', 'two', 600))
+        self.assertTrue(manager.acquire_lease('first', 'one', 600))
+        self.assertEqual(manager.bot.calls['edit_message_text'], 1)
+        manager.release_lease('first', 'one')
+        self.assertTrue(manager.acquire_lease('first', 'two', 600))
+        self.assertEqual(manager.get_accounts(), ['first'])
+
+
+if __name__ == '__main__':
+    unittest.main()
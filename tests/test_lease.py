@@ -0,0 +1,108 @@
+"""Test module for the account write lease."""
+
+import os
+import tempfile
+import time
+import unittest
+from typing import Dict, List
+
+from src.choiches import StorageFields
+from src.lease import AccountLease
+from src.main import ResoSession
+from src.manager import MessageManager
+from src.scheduler import AdaptivePoller
+from src.storage import SQLiteStorage
+from tests.test_manager import FakeBot, sample_cookies
+
+
+class RotatedSession(ResoSession):
+    """Logged in ResoSession whose browser cookies are set by hand."""
+
+    probe = None
+
+    def __init__(self, manager: SQLiteStorage) -> None:
+        self.manager = manager
+        self.hash = 'test'
+        self.storage_digest = None
+        self.storage_cookies: List[Dict] = []
+        self.last_cookies = manager.get_telegram_cookies(self.hash)
+        self.browser_cookies = self.last_cookies
+        self.need_to_set_telegram_cookies = False
+        self.poller = AdaptivePoller()
+        # storage leases are compared with the real clock, so the ttl is short
+        self.lease = AccountLease(ttl=0.2)
+
+    def get_browser_cookies(self) -> List[Dict]:
+        return self.browser_cookies
+
+    def insert_cookies(self, tele_cookies: List) -> None:
+        self.browser_cookies = tele_cookies
+
+
+class ClosedBrowser(object):
+    """Browser that is already closed."""
+
+    def quit(self) -> None:
+        pass
+
+
+class QuitSession(RotatedSession, ClosedBrowser):
+    """Rotated session that can be quit."""
+
+
+class AccountLeaseTestCase(unittest.TestCase):
+    """One client publishes cookies rotated by the office."""
+
+    def setUp(self) -> None:
+        """Create shared storage."""
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.storage = SQLiteStorage(os.path.join(self.folder.name, 'cookies.sqlite3'))
+
+    def test_followers_take_holder_cookies(self) -> None:
+        """Only the holder publishes a rotation, the follower takes the next one, the lease moves on when it ends."""
+        holder, follower = RotatedSession(self.storage), RotatedSession(self.storage)
+        holder.browser_cookies, follower.browser_cookies = sample_cookies('h1'), sample_cookies('f1')
+        self.assertTrue(holder.logged_in())
+        self.assertFalse(follower.logged_in())
+        # storage cookies are not newer than the rotation of the follower, it waits for the holder
+        self.assertFalse(follower.logged_in())
+        self.assertEqual(follower.browser_cookies, sample_cookies('f1'))
+        holder.browser_cookies = sample_cookies('h2')
+        self.assertTrue(holder.logged_in())
+        self.assertFalse(follower.logged_in())
+        self.assertEqual(follower.browser_cookies, sample_cookies('h2'))
+        self.assertEqual(self.storage.get_telegram_cookies('test'), sample_cookies('h2'))
+        follower.browser_cookies = sample_cookies('f2')
+        self.assertFalse(follower.logged_in())
+        # the holder stops publishing and its lease ends
+        time.sleep(0.25)
+        self.assertTrue(follower.logged_in())
+        self.assertEqual(self.storage.get_telegram_cookies('test'), sample_cookies('f2'))
+
+    def test_message_publish(self) -> None:
+        """Lease and cookies of an account in the main message are written with one edit."""
+        manager = MessageManager(cache_ttl=0)
+        manager.bot = FakeBot({'first': sample_cookies('a1')})
+        self.assertTrue(manager.publish_cookies(sample_cookies('a2'), 'first', 'one', 600))
+        self.assertEqual(manager.bot.calls['edit_message_text'], 1)
+        self.assertFalse(manager.publish_cookies(sample_cookies('a3'), 'first', 'two', 600))
+        self.assertEqual(manager.bot.calls['edit_message_text'], 1)
+        self.assertEqual(manager.get_telegram_cookies('first'), sample_cookies('a2'))
+        self.assertEqual(manager._read_pinned()[StorageFields.leases]['first'][0], 'one')
+
+    def test_quit_writes_before_release(self) -> None:
+        """Queued cookies are written on quit and the lease they take is given back."""
+        manager = MessageManager(cache_ttl=0, write_delay=60)
+        manager.bot = FakeBot({'test': sample_cookies('a1')})
+        session = QuitSession(manager)
+        session.browser_cookies = sample_cookies('a2')
+        self.assertTrue(session.logged_in())
+        session.quit()
+        manager.flush_writes()
+        self.assertEqual(manager.get_telegram_cookies('test'), sample_cookies('a2'))
+        self.assertNotIn('test', manager._read_pinned().get(StorageFields.leases, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
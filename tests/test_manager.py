@@ -0,0 +1,317 @@
+"""Hermetic test module for MessageManager."""
+
+import json
+import os
+import time
+import unittest
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+from src.choiches import StorageFields
+from src.codec import JsonCodec, decode
+from src.exceptions import MessageTooLong
+from src.manager import MessageManager
+
+
+class FakeBot(object):
+    """In-memory stand-in for TeleBot that keeps pinned messages by chat."""
+
+    def __init__(self, content: Dict[str, List]) -> None:
+        """Create main chat with pinned message.
+
+        Args:
+            content: pinned message content.
+        """
+        self.chats: Dict[str, Optional[SimpleNamespace]] = {}
+        self.sent: Dict[int, SimpleNamespace] = {}
+        self.calls: Dict[str, int] = {}
+        self.clock = 0
+        # called once with the text before edit, to emulate a concurrent writer
+        self.on_edit: Optional[Callable[[str], str]] = None
+        message = self.send_message(os.environ['CHAT_ID'], json.dumps(content))
+        self.pin_chat_message(os.environ['CHAT_ID'], message.message_id)
+        self.calls.clear()
+
+    @property
+    def pinned(self) -> SimpleNamespace:
+        return self.chats[os.environ['CHAT_ID']]
+
+    def _count(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def get_chat(self, chat_id: Any) -> SimpleNamespace:
+        self._count('get_chat')
+        pinned = self.chats.get(str(chat_id))
+        return SimpleNamespace(pinned_message=pinned and SimpleNamespace(**vars(pinned)))
+
+    def edit_message_text(self, chat_id: Any, message_id: int, text: str) -> SimpleNamespace:
+        self._count('edit_message_text')
+        self.clock += 1
+        message = self.sent[message_id]
+        previous, message.text = message.text, text
+        if self.on_edit:
+            on_edit, self.on_edit = self.on_edit, None
+            message.text = on_edit(previous)
+        message.edit_date = self.clock
+        return SimpleNamespace(**vars(message))
+
+    def send_message(self, chat_id: Any, text: str) -> SimpleNamespace:
+        self._count('send_message')
+        message = SimpleNamespace(message_id=len(self.sent) + 1, text=text, edit_date=None)
+        self.sent[message.message_id] = message
+        return message
+
+    def pin_chat_message(self, chat_id: Any, message_id: int) -> None:
+        self._count('pin_chat_message')
+        self.chats[str(chat_id)] = self.sent[message_id]
+
+
+def sample_cookies(value: str) -> List[Dict]:
+    """Build cookies list like browser returns.
+
+    Args:
+        value: ASP.NET_SessionId value.
+
+    Returns:
+        List with two cookie dictionaries.
+    """
+    return [
+        {'name': 'ASP.NET_SessionId', 'value': value, 'path': '/', 'domain': '.reso.ru'},
+        {'name': 'ResoOffice60', 'value': value.upper(), 'path': '/', 'domain': '.reso.ru'},
+    ]
+
+
+class MessageManagerTestCase(unittest.TestCase):
+    """MessageManager test case with fake telegram bot."""
+
+    def make_manager(self, cache_ttl: float = 60, codec: Optional[JsonCodec] = None) -> MessageManager:
+        manager = MessageManager(cache_ttl=cache_ttl, codec=codec)
+        manager.bot = FakeBot({'first': sample_cookies('a1'), 'second': sample_cookies('b1')})
+        return manager
+
+    def test_reads_are_cached(self) -> None:
+        """Reads within ttl do not request telegram."""
+        manager = self.make_manager()
+        for _ in range(5):
+            self.assertEqual(manager.get_telegram_cookies('first'), sample_cookies('a1'))
+        self.assertEqual(manager.bot.calls['get_chat'], 1)
+
+    def test_unchanged_message_is_not_parsed_again(self) -> None:
+        """Expired cache with the same message keeps parsed data."""
+        manager = self.make_manager(cache_ttl=0)
+        first = manager.get_telegram_cookies('first')
+        self.assertIs(manager.get_telegram_cookies('first'), first)
+        self.assertEqual(manager.bot.calls['get_chat'], 2)
+
+    def test_own_write_invalidates_cache(self) -> None:
+        """Cookies written by manager are visible on next read."""
+        manager = self.make_manager()
+        manager.get_telegram_cookies('first')
+        manager.set_telegram_cookies(sample_cookies('a2'), 'first')
+        self.assertEqual(manager.get_telegram_cookies('first'), sample_cookies('a2'))
+
+    def test_foreign_write_is_notified(self) -> None:
+        """Watcher wakes up waiting loop when another client edits message."""
+        manager = self.make_manager(cache_ttl=0.01)
+        manager.refresh()
+        manager.wait_for_change(timeout=0)
+        other = self.make_manager()
+        other.bot = manager.bot
+        other.set_telegram_cookies(sample_cookies('b2'), 'second')
+        manager.watch(interval=0.01)
+        self.assertTrue(manager.wait_for_change(timeout=5))
+        self.assertEqual(manager.get_telegram_cookies('second'), sample_cookies('b2'))
+
+    def test_refresh_follows_cache_ttl(self) -> None:
+        """Watcher does not request telegram while the cached message is fresh."""
+        manager = self.make_manager()
+        manager.get_telegram_cookies('first')
+        manager.refresh()
+        self.assertEqual(manager.bot.calls['get_chat'], 1)
+
+    def test_only_moved_cookies_are_returned(self) -> None:
+        """Cookies are returned when the digest differs from the known one."""
+        manager = self.make_manager()
+        digest, cookies = manager.get_moved_cookies({'first': None})['first']
+        self.assertEqual(cookies, sample_cookies('a1'))
+        self.assertEqual(manager.get_moved_cookies({'first': digest})['first'], (digest, None))
+        manager.set_telegram_cookies([dict(cookie, expiry=1) for cookie in sample_cookies('a1')], 'first')
+        self.assertIsNone(manager.get_moved_cookies({'first': digest})['first'][1])
+        manager.set_telegram_cookies(sample_cookies('a2'), 'first')
+        self.assertEqual(manager.get_moved_cookies({'first': digest})['first'][1], sample_cookies('a2'))
+
+    def test_write_increments_revision(self) -> None:
+        """Every write stores a new revision."""
+        manager = self.make_manager()
+        manager.set_telegram_cookies(sample_cookies('a2'), 'first')
+        manager.add_account('third')
+        stored = decode(manager.bot.pinned.text)
+        self.assertEqual(stored[StorageFields.revision], 2)
+        self.assertEqual(manager.get_accounts(), ['first', 'second', 'third'])
+
+    def test_lost_update_is_merged(self) -> None:
+        """Write overwritten by a stale concurrent writer is applied again."""
+        manager = self.make_manager()
+
+        def stale_writer(previous: str) -> str:
+            as_json = decode(previous)
+            as_json['second'] = sample_cookies('b2')
+            as_json[StorageFields.revision] = as_json.get(StorageFields.revision, 0) + 1
+            return manager.codec.encode(as_json)
+
+        manager.bot.on_edit = stale_writer
+        manager.set_telegram_cookies(sample_cookies('a2'), 'first')
+        stored = decode(manager.bot.pinned.text)
+        self.assertEqual(stored['first'], sample_cookies('a2'))
+        self.assertEqual(stored['second'], sample_cookies('b2'))
+        self.assertEqual(manager.bot.calls['edit_message_text'], 2)
+
+    def test_moved_revision_is_rebased(self) -> None:
+        """Change is applied on top of a write made after the base was read, without editing twice."""
+        manager = self.make_manager()
+        writes = []
+
+        def mutate(as_json: Dict) -> None:
+            if not writes:
+                # another client writes while the change is prepared
+                foreign = decode(manager.bot.pinned.text)
+                foreign['second'] = sample_cookies('b2')
+                foreign[StorageFields.revision] = 5
+                manager.bot.pinned.text = manager.codec.encode(foreign)
+            writes.append(as_json.get(StorageFields.revision))
+            as_json['first'] = sample_cookies('a2')
+
+        manager._update(mutate)
+        stored = decode(manager.bot.pinned.text)
+        self.assertEqual((stored['first'], stored['second']), (sample_cookies('a2'), sample_cookies('b2')))
+        self.assertEqual(stored[StorageFields.revision], 6)
+        self.assertEqual(manager.bot.calls['edit_message_text'], 1)
+
+    def test_accounts_overflow_to_shard(self) -> None:
+        """Full main message spills new accounts to shard."""
+        manager = self.make_manager(codec=JsonCodec())
+        with self.assertRaises(MessageTooLong):
+            for num in range(100):
+                manager.add_account('account_{num}'.format(num=num))
+        main_count = len(manager.get_accounts())
+        manager.add_shard('-200')
+        manager.add_account('sharded')
+        self.assertEqual(len(manager.get_accounts()), main_count + 1)
+        self.assertEqual(decode(manager.bot.pinned.text)[StorageFields.index], {'sharded': '-200'})
+        manager.set_telegram_cookies(sample_cookies('s2'), 'sharded')
+        self.assertEqual(decode(manager.bot.chats['-200'].text)['sharded'], sample_cookies('s2'))
+        self.assertEqual(manager.get_telegram_cookies('sharded'), sample_cookies('s2'))
+        manager.remove_account('sharded')
+        self.assertNotIn(StorageFields.index, decode(manager.bot.pinned.text))
+
+    def test_reinit_keeps_shards(self) -> None:
+        """Sample message with registered shards is not rewritten, account list is read through the cache."""
+        manager = MessageManager(cache_ttl=60)
+        manager.bot = FakeBot(manager.message_sample)
+        manager.add_shard('-200')
+        manager.bot.calls.clear()
+        manager.reinit()
+        self.assertNotIn('edit_message_text', manager.bot.calls)
+        self.assertEqual(manager.get_shards(), ['-200'])
+        manager.bot.calls.clear()
+        self.assertEqual(manager.get_accounts(), ['test'])
+        self.assertNotIn('get_chat', manager.bot.calls)
+
+    def test_bulk_accounts(self) -> None:
+        """Bulk change writes every touched chat once and checks sizes before writing."""
+        manager = self.make_manager(codec=JsonCodec())
+        manager.add_shard('-200')
+        names = ['bulk_{num}'.format(num=num) for num in range(10)]
+        preview = manager.apply_accounts(add=names + ['first'], remove=['second', 'unknown'], dry_run=True)
+        self.assertEqual(manager.bot.calls.get('edit_message_text'), 1)
+        self.assertEqual(preview.existing, ['first'])
+        self.assertEqual(preview.missing, ['unknown'])
+        self.assertEqual(set(preview.added.values()), {manager.chat, '-200'})
+        manager.bot.calls.clear()
+        plan = manager.apply_accounts(add=names + ['first'], remove=['second', 'unknown'])
+        self.assertEqual(plan, preview)
+        self.assertEqual(manager.bot.calls['edit_message_text'], 2)
+        self.assertEqual(sorted(manager.get_accounts()), sorted(['first'] + names))
+        with self.assertRaises(MessageTooLong):
+            manager.apply_accounts(add=['more_{num}'.format(num=num) for num in range(100)])
+        self.assertEqual(manager.bot.calls['edit_message_text'], 2)
+
+    def test_rebalance(self) -> None:
+        """Rebalance spreads accounts over shards without losing cookies."""
+        manager = self.make_manager()
+        manager.add_shard('-200')
+        manager.add_shard('-300')
+        manager.set_telegram_cookies(sample_cookies('c1'), 'third')
+        counts = manager.rebalance()
+        self.assertEqual(sorted(counts.values()), [1, 1, 1])
+        for hsh, value in (('first', 'a1'), ('second', 'b1'), ('third', 'c1')):
+            self.assertEqual(manager.get_telegram_cookies(hsh), sample_cookies(value))
+
+    def test_delayed_writes_are_merged(self) -> None:
+        """Queued cookies are read back at once and written with one edit, the last change of an account wins."""
+        manager = self.make_manager(cache_ttl=0)
+        manager.write_delay = 60
+        manager.set_telegram_cookies(sample_cookies('a2'), 'first')
+        manager.set_telegram_cookies(sample_cookies('a3'), 'first')
+        manager.set_telegram_cookies(sample_cookies('b2'), 'second')
+        self.assertEqual(manager.get_telegram_cookies('first'), sample_cookies('a3'))
+        self.assertEqual(manager.get_moved_cookies({'second': None})['second'][1], sample_cookies('b2'))
+        self.assertNotIn('edit_message_text', manager.bot.calls)
+        manager.flush_writes()
+        self.assertEqual(manager.bot.calls['edit_message_text'], 1)
+        stored = decode(manager.bot.pinned.text)
+        self.assertEqual((stored['first'], stored['second']), (sample_cookies('a3'), sample_cookies('b2')))
+
+    def test_delayed_write_is_flushed(self) -> None:
+        """Queued cookies are written in background after the delay, published ones renew the lease."""
+        manager = self.make_manager(cache_ttl=0)
+        manager.write_delay = 0.05
+        self.assertTrue(manager.publish_cookies(sample_cookies('a2'), 'first', 'one', 600))
+        stored = self.wait_stored(manager, 'first', sample_cookies('a2'))
+        self.assertEqual(stored[StorageFields.leases]['first'][0], 'one')
+        self.assertFalse(manager.publish_cookies(sample_cookies('a3'), 'first', 'two', 600))
+
+    def test_flusher_survives_errors(self) -> None:
+        """Cookies that failed with an unexpected error are written on the next attempt of the same flusher."""
+        manager = self.make_manager(cache_ttl=0)
+        manager.write_delay = 0.05
+
+        def fail(text: str) -> str:
+            raise RuntimeError('connection reset')
+
+        manager.bot.on_edit = fail
+        manager.set_telegram_cookies(sample_cookies('a2'), 'first')
+        self.wait_stored(manager, 'first', sample_cookies('a2'))
+        self.assertTrue(manager._flusher.is_alive())
+
+    def test_permanent_error_is_dropped(self) -> None:
+        """Cookies that can never be written are not queued again."""
+        manager = self.make_manager(cache_ttl=0)
+        manager.write_delay = 60
+        manager.set_telegram_cookies(sample_cookies(os.urandom(2500).hex()), 'first')
+        with self.assertRaises(MessageTooLong):
+            manager.flush_writes()
+        self.assertEqual(manager._pending, {})
+        self.assertEqual(manager.get_telegram_cookies('first'), sample_cookies('a1'))
+
+    def wait_stored(self, manager: MessageManager, hsh: str, cookies: List) -> Dict:
+        """Wait until the background flusher writes cookies to the pinned message.
+
+        Args:
+            manager: manager with delayed writes.
+            hsh: user identification hash.
+            cookies: expected cookies.
+
+        Returns:
+            Pinned message content.
+        """
+        for _ in range(100):
+            stored = decode(manager.bot.pinned.text)
+            if stored.get(hsh) == cookies:
+                return stored
+            time.sleep(0.02)
+        self.fail('cookies are not written')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Test module for metrics and runtime profiling."""
+
+import json
+import tempfile
+import time
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from src.metrics import Instrumented, Metrics, RuntimeProfiler, serve
+
+
+class MetricsTestCase(unittest.TestCase):
+    """Metrics registry and endpoint test case."""
+
+    def setUp(self) -> None:
+        """Create separate registry and profiler."""
+        self.registry = Metrics()
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.profiler = RuntimeProfiler(self.folder.name)
+
+    def test_instrumented_calls(self) -> None:
+        """Calls of the proxy are timed by method, failed calls are counted."""
+        bot = Instrumented({'chat': 1}, self.registry, 'telegram_call_seconds')
+        self.assertEqual(bot.get('chat'), 1)
+        with self.assertRaises(KeyError):
+            bot.pop('missing')
+        text = self.registry.to_prometheus()
+        self.assertIn('reso_telegram_call_seconds_count{method="get"} 1', text)
+        self.assertIn('reso_telegram_call_errors_total{method="pop"} 1', text)
+        self.assertEqual(text.count('# TYPE reso_telegram_call_seconds_count counter'), 1)
+
+    def test_endpoint_and_profile(self) -> None:
+        """Endpoint exports json, profiling starts on request and is finished by the loop."""
+        self.registry.inc('sync_decisions_total', branch='in_sync')
+        server = serve(0, self.registry, self.profiler)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+        counters = json.loads(urlopen(url + '/metrics.json').read())['counters']
+        self.assertIn({'name': 'sync_decisions_total', 'labels': {'branch': 'in_sync'}, 'value': 1}, counters)
+        with self.assertRaises(HTTPError):
+            urlopen(url + '/profile')
+        for seconds in ('abc', '-1', 'nan', 'inf'):
+            with self.assertRaises(HTTPError) as error:
+                urlopen(url + '/profile?seconds=' + seconds)
+            self.assertEqual(error.exception.code, 400)
+        urlopen(url + '/profile?seconds=0.01')
+        self.profiler.step()
+        time.sleep(0.02)
+        self.profiler.step()
+        self.assertIn('function calls', urlopen(url + '/profile').read().decode())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""Test module for local cookie cache."""
+
+import os
+import tempfile
+import unittest
+from contextlib import contextmanager
+from typing import Iterator
+from unittest import mock
+
+from src.exceptions import LocalStorageError
+from src.metrics import Metrics
+from src.offline import CachedStorage
+from src.storage import SQLiteStorage
+from tests.test_manager import sample_cookies
+
+
+class FlakyStorage(SQLiteStorage):
+    """Local storage that can be made unreachable."""
+
+    down = False
+    connections = 0
+
+    @contextmanager
+    def _connect(self) -> Iterator:
+        self.connections += 1
+        if self.down:
+            raise LocalStorageError(LocalStorageError.msg.format(path=self.path, error='down'))
+        with super()._connect() as conn:
+            yield conn
+
+
+class CachedStorageTestCase(unittest.TestCase):
+    """Local cache test case with a flaky shared storage."""
+
+    def setUp(self) -> None:
+        """Create shared storage with one account and cache file."""
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.remote = FlakyStorage(os.path.join(self.folder.name, 'cookies.sqlite3'))
+        self.remote.set_telegram_cookies(sample_cookies('a1'), 'test')
+        self.cache_path = os.path.join(self.folder.name, 'cookies-cache.json')
+        self.storage = CachedStorage(self.remote, self.cache_path)
+        self.storage.get_telegram_cookies('test')
+
+    def test_start_from_cache(self) -> None:
+        """Cached account is served at once after restart, even if shared storage is down."""
+        self.remote.down = True
+        connections = self.remote.connections
+        restarted = CachedStorage(self.remote, self.cache_path)
+        self.assertEqual(restarted.get_telegram_cookies('test'), sample_cookies('a1'))
+        self.assertEqual(self.remote.connections, connections)
+        restarted.refresh()
+        self.assertFalse(restarted.online)
+
+    def test_offline_writes_are_pushed(self) -> None:
+        """Writes are queued during outage and pushed unless another client changed the account."""
+        self.remote.down = True
+        self.storage.set_telegram_cookies(sample_cookies('a2'), 'test')
+        self.assertEqual(self.storage.get_telegram_cookies('test'), sample_cookies('a2'))
+        self.assertFalse(self.storage.online)
+        self.remote.down = False
+        self.storage.refresh()
+        self.assertTrue(self.storage.online)
+        self.assertEqual(self.remote.get_telegram_cookies('test'), sample_cookies('a2'))
+        self.assertFalse(self.storage.pending)
+
+        self.remote.down = True
+        self.storage.set_telegram_cookies(sample_cookies('a3'), 'test')
+        self.remote.down = False
+        self.remote.set_telegram_cookies(sample_cookies('b1'), 'test')
+        registry = Metrics()
+        with mock.patch('src.offline.metrics', registry):
+            self.storage.refresh()
+        self.assertEqual(self.remote.get_telegram_cookies('test'), sample_cookies('b1'))
+        self.assertEqual(self.storage.get_telegram_cookies('test'), sample_cookies('b1'))
+        self.assertIn('reso_cache_dropped_writes_total{reason="changed"} 1', registry.to_prometheus())
+
+
+if __name__ == '__main__':
+    unittest.main()
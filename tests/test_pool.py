@@ -0,0 +1,95 @@
+"""Test module for warm browser pool."""
+
+import os
+import tempfile
+import time
+import unittest
+from typing import List
+from unittest import mock
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.firefox.webdriver import WebDriver as Firefox
+
+from src.main import ResoSession
+from src.pool import BrowserPool
+from src.storage import SQLiteStorage
+
+
+class FakeBrowser(object):
+    """Browser that records opened pages."""
+
+    url_main = 'https://office.reso.ru/'
+    launched: List['FakeBrowser'] = []
+
+    def __init__(self) -> None:
+        self.pages: List[str] = []
+        self.dead = False
+        self.closed = False
+        FakeBrowser.launched.append(self)
+
+    def get(self, url: str) -> None:
+        if self.dead:
+            raise WebDriverException('browser is gone')
+        self.pages.append(url)
+
+    def quit(self) -> None:
+        self.closed = True
+
+
+class BrowserPoolTestCase(unittest.TestCase):
+    """Browser pool test case."""
+
+    def setUp(self) -> None:
+        """Create pool with two browsers."""
+        FakeBrowser.launched = []
+        self.pool = BrowserPool(FakeBrowser, size=2, idle_timeout=60)
+        self.addCleanup(self.pool.close)
+
+    def wait_filled(self) -> None:
+        self.pool.fill()
+        self.pool._filler.join(1)
+
+    def test_acquire_takes_warm_browser(self) -> None:
+        """Acquired browser is already on the office page and the pool is refilled."""
+        self.wait_filled()
+        self.assertEqual(len(self.pool), 2)
+        browser = self.pool.acquire()
+        self.assertEqual(browser.pages, [FakeBrowser.url_main])
+        self.pool._filler.join(1)
+        self.assertEqual(len(self.pool), 2)
+        self.assertEqual(len(FakeBrowser.launched), 3)
+
+    def test_maintain_reloads_and_replaces(self) -> None:
+        """Idle browsers reload the page, dead ones are quit and replaced."""
+        self.wait_filled()
+        alive, dead = FakeBrowser.launched
+        dead.dead = True
+        self.pool._idle = [(browser, time.monotonic() - 61) for browser, _ in self.pool._idle]
+        self.pool.maintain()
+        self.pool._filler.join(1)
+        self.assertEqual(len(alive.pages), 2)
+        self.assertTrue(dead.closed)
+        self.assertEqual(len(self.pool), 2)
+        self.pool.close()
+        self.assertTrue(alive.closed)
+
+    def test_browsers_have_own_service(self) -> None:
+        """Each launched session gets its own driver service and port, quit of one does not stop the others."""
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        storage = SQLiteStorage(os.path.join(folder.name, 'cookies.sqlite3'))
+        klass = ResoSession.session_class({'hash': 'test', 'browser': 'firefox', 'user-agent': 'agent'}, storage)
+        pool = BrowserPool(klass, size=2, idle_timeout=60)
+        started = []
+        with mock.patch('src.main.driver_cache.apply', return_value=True), \
+                mock.patch.object(Firefox, '__init__', lambda browser, service, options: started.append(service)), \
+                mock.patch.object(klass, 'get'):
+            first, second = pool.launch(), pool.launch()
+        self.assertEqual(started, [first.service, second.service])
+        self.assertIsNot(first.service, second.service)
+        self.assertNotEqual(first.service.port, second.service.port)
+        self.assertIsNot(first.options, second.options)
+
+
+if __name__ == '__main__':
+    unittest.main()
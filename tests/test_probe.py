@@ -0,0 +1,57 @@
+"""Test module for HTTP cookie probe."""
+
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.probe import CookieProbe
+from tests.test_manager import sample_cookies
+
+
+class OfficeHandler(BaseHTTPRequestHandler):
+    """Office page that accepts only a1 session."""
+
+    def do_GET(self) -> None:
+        cookie = self.headers.get('Cookie', '')
+        valid = 'ASP.NET_SessionId=a1' in cookie and 'ResoOffice60=A1' in cookie
+        body = b'<div>welcome</div>' if valid else b'<form><input type="password"></form>'
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'ASP.NET_SessionId=rotated; Path=/')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        """Keep test output clean."""
+
+
+class CookieProbeTestCase(unittest.TestCase):
+    """Probe test case with local office page."""
+
+    def setUp(self) -> None:
+        """Start local office server."""
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), OfficeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.probe = CookieProbe(url='http://127.0.0.1:{port}/'.format(port=self.server.server_port), user_agent='test')
+
+    def tearDown(self) -> None:
+        """Stop local office server."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_validity(self) -> None:
+        """Valid and invalid cookies are told apart, cookies of responses do not leak."""
+        self.assertTrue(self.probe.is_valid(sample_cookies('a1')))
+        self.assertFalse(self.probe.is_valid(sample_cookies('b1')))
+        self.assertTrue(self.probe.is_valid(sample_cookies('a1')))
+        self.assertFalse(self.probe.is_valid(None))
+
+    def test_unreachable_office(self) -> None:
+        """Result is unknown when office is unreachable."""
+        self.tearDown()
+        self.assertIsNone(self.probe.is_valid(sample_cookies('x1')))
+        self.setUp()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Test module for multi-session runner."""
+
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from typing import List, Optional
+
+from src.runner import SessionRunner
+from src.storage import SQLiteStorage
+from tests.test_manager import sample_cookies
+
+
+class FakeSession(SimpleNamespace):
+    """Session that records cookies it was synced with."""
+
+    def tick(self, tele_cookies: Optional[List] = None) -> bool:
+        self.seen = tele_cookies
+        if self.publish:
+            self.manager.set_telegram_cookies(self.publish, self.hash)
+            self.last_cookies = self.publish
+            return True
+        return False
+
+
+class SessionRunnerTestCase(unittest.TestCase):
+    """Runner test case with local storage and fake sessions."""
+
+    def setUp(self) -> None:
+        """Create storage with two accounts."""
+        self.folder = tempfile.TemporaryDirectory()
+        self.manager = SQLiteStorage(os.path.join(self.folder.name, 'cookies.sqlite3'))
+        for hsh, value in (('first', 'a1'), ('second', 'b1')):
+            self.manager.add_account(hsh)
+            self.manager.set_telegram_cookies(sample_cookies(value), hsh)
+        self.runner = SessionRunner([], self.manager)
+
+    def tearDown(self) -> None:
+        """Remove temporary folder."""
+        self.folder.cleanup()
+
+    def test_tick_fans_out_published_cookies(self) -> None:
+        """Sessions get their account cookies, cookies published in the tick are passed further."""
+        writer = FakeSession(hash='first', manager=self.manager, publish=sample_cookies('a2'))
+        reader = FakeSession(hash='first', manager=self.manager, publish=None)
+        other = FakeSession(hash='second', manager=self.manager, publish=None)
+        self.runner.sessions = [writer, reader, other]
+        self.runner.tick()
+        self.assertEqual(writer.seen, sample_cookies('a1'))
+        self.assertEqual(reader.seen, sample_cookies('a2'))
+        self.assertEqual(other.seen, sample_cookies('b1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
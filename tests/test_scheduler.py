@@ -0,0 +1,22 @@
+"""Test module for adaptive polling."""
+
+import unittest
+
+from src.scheduler import AdaptivePoller
+
+
+class AdaptivePollerTestCase(unittest.TestCase):
+    """Adaptive poller test case."""
+
+    def test_backoff_and_reset(self) -> None:
+        """Interval grows up to ceiling with jitter and drops after reset."""
+        poller = AdaptivePoller(minimum=0.5, maximum=4, factor=2, jitter=0.2)
+        intervals = [poller.next_interval() for _ in range(10)]
+        self.assertTrue(0.4 <= intervals[0] <= 0.6)
+        self.assertTrue(all(3.2 <= interval <= 4.8 for interval in intervals[3:]))
+        poller.reset()
+        self.assertTrue(0.4 <= poller.next_interval() <= 0.6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Test module for startup helpers."""
+
+import json
+import os
+import tempfile
+import unittest
+
+from selenium.webdriver.firefox.options import Options as FirefoxOptions
+from selenium.webdriver.firefox.service import Service as FirefoxService
+
+from src.main import BrowserDetector
+from src.startup import DriverCache
+
+
+class DriverCacheTestCase(unittest.TestCase):
+    """Driver paths cache test case."""
+
+    def setUp(self) -> None:
+        """Create temporary folder with fake binaries."""
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.driver_path = os.path.join(self.folder.name, 'geckodriver')
+        self.browser_path = os.path.join(self.folder.name, 'firefox')
+        for path in (self.driver_path, self.browser_path):
+            open(path, 'w').close()
+        self.cache = DriverCache(os.path.join(self.folder.name, 'drivers.json'))
+
+    def test_cached_paths_are_applied(self) -> None:
+        """Cached paths are put into service and options without resolving."""
+        self.cache._save({'Firefox': {'driver_path': self.driver_path, 'browser_path': self.browser_path}})
+        service, options = FirefoxService(), FirefoxOptions()
+        self.assertTrue(self.cache.apply('Firefox', service, options))
+        self.assertEqual(service.path, self.driver_path)
+        self.assertEqual(options.binary_location, self.browser_path)
+
+    def test_missing_binary_invalidates(self) -> None:
+        """Paths of removed binaries are not used, forget drops only one browser."""
+        paths = {'driver_path': self.driver_path, 'browser_path': self.browser_path}
+        self.cache._save({'Firefox': paths, 'Chrome': paths})
+        os.remove(self.browser_path)
+        self.assertIsNone(self.cache.get('Firefox'))
+        self.cache.forget('Firefox')
+        with open(self.cache.path) as cache_file:
+            self.assertEqual(list(json.load(cache_file)), ['Chrome'])
+
+    def test_paths_are_resolved_again(self) -> None:
+        """After the cached paths fail, new service and options have no paths, so Selenium Manager resolves them."""
+        self.cache._save({'Firefox': {'driver_path': self.driver_path, 'browser_path': self.browser_path}})
+        detector = BrowserDetector('Firefox', 'agent')
+        self.assertTrue(self.cache.apply('Firefox', detector.service, detector.options))
+        self.assertEqual(detector.service.path, self.driver_path)
+        self.cache.forget('Firefox')
+        service, options = detector.setup()
+        self.assertEqual((service.path, options.binary_location), ('', ''))
+        self.assertIsNot(service, detector.service)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Test module for local SQLite storage."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from src.exceptions import InvalidHash
+from src.storage import SQLiteStorage
+from tests.test_manager import sample_cookies
+
+
+class SQLiteStorageTestCase(unittest.TestCase):
+    """Local storage test case, two storages on one file play two clients."""
+
+    def setUp(self) -> None:
+        """Create storage in temporary folder."""
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'cookies.sqlite3')
+        self.storage = SQLiteStorage(self.path)
+
+    def tearDown(self) -> None:
+        """Remove temporary folder."""
+        self.folder.cleanup()
+
+    def test_new_file_has_sample(self) -> None:
+        """New storage is initialized with message sample."""
+        self.assertEqual(self.storage.get_accounts(), list(self.storage.message_sample))
+
+    def test_accounts_managing(self) -> None:
+        """Accounts are added, updated and removed for every client of the file."""
+        other = SQLiteStorage(self.path)
+        self.storage.add_account('first')
+        other.set_telegram_cookies(sample_cookies('a1'), 'first')
+        self.assertEqual(self.storage.get_telegram_cookies('first'), sample_cookies('a1'))
+        other.remove_account('first')
+        with self.assertRaises(InvalidHash):
+            self.storage.get_telegram_cookies('first')
+
+    def test_change_is_notified(self) -> None:
+        """Refresh notifies about writes of other clients."""
+        other = SQLiteStorage(self.path)
+        self.storage.refresh()
+        self.storage.wait_for_change(timeout=0)
+        self.storage.refresh()
+        self.assertFalse(self.storage.wait_for_change(timeout=0))
+        other.add_account('first')
+        self.storage.refresh()
+        self.assertTrue(self.storage.wait_for_change(timeout=0))
+
+    def test_only_moved_cookies_are_returned(self) -> None:
+        """Cookies are read when the digest differs, files without digest column are upgraded."""
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute('CREATE TABLE old (hash TEXT PRIMARY KEY, cookies TEXT NOT NULL)')
+            conn.execute('INSERT INTO old SELECT hash, cookies FROM accounts')
+            conn.execute('DROP TABLE accounts')
+            conn.execute('ALTER TABLE old RENAME TO accounts')
+        conn.close()
+        storage = SQLiteStorage(self.path)
+        digest, cookies = storage.get_moved_cookies({'test': None})['test']
+        self.assertEqual(cookies, storage.message_sample['test'])
+        storage.set_telegram_cookies(sample_cookies('a1'), 'test')
+        digest, cookies = storage.get_moved_cookies({'test': digest})['test']
+        self.assertEqual(cookies, sample_cookies('a1'))
+        self.assertEqual(storage.get_moved_cookies({'test': digest})['test'], (digest, None))
+
+
+if __name__ == '__main__':
+    unittest.main()